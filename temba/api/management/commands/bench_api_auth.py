@@ -0,0 +1,61 @@
+import time
+
+from rest_framework.request import Request
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from temba.api.models import APIPermission, APIToken
+from temba.api.support import APITokenAuthentication
+from temba.api.v2.views import ContactsEndpoint
+from temba.orgs.models import Org, OrgRole
+
+
+class Command(BaseCommand):  # pragma: no cover
+    help = "Benchmarks the per-request overhead of API token authentication and permission checking"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--org", type=int, help="ID of org to authenticate against (defaults to first org)")
+        parser.add_argument("--requests", type=int, default=1000, help="Number of requests to simulate")
+
+    def handle(self, org: int, requests: int, **options):
+        org = Org.objects.get(id=org) if org else Org.objects.order_by("id").first()
+        token = APIToken.get_or_create(org, org.get_admins().first(), role=OrgRole.ADMINISTRATOR)
+
+        with override_settings(API_TOKEN_CACHE_TTL=0):
+            self._bench("uncached", token, requests)
+
+        with override_settings(API_TOKEN_CACHE_TTL=60, API_TOKEN_LOCAL_CACHE_TTL=0):
+            self._bench("cached in redis", token, requests)
+
+        with override_settings(API_TOKEN_CACHE_TTL=60, API_TOKEN_LOCAL_CACHE_TTL=60):
+            self._bench("cached in redis and local memory", token, requests)
+
+    def _bench(self, name: str, token, requests: int):
+        factory = RequestFactory()
+        view = ContactsEndpoint()
+
+        def request():
+            request = Request(
+                factory.get("/api/v2/contacts.json", HTTP_AUTHORIZATION=f"Token {token.key}"),
+                authenticators=[APITokenAuthentication()],
+            )
+            assert request.user.is_authenticated  # forces authentication
+            assert APIPermission().has_permission(request, view)
+
+        request()  # warm up cache
+
+        with CaptureQueriesContext(connection) as queries:
+            request()
+
+        start = time.perf_counter()
+        for i in range(requests):
+            request()
+        time_taken = time.perf_counter() - start
+
+        self.stdout.write(
+            f" > {name}: {len(queries)} queries/request, {time_taken * 1000 / requests:.2f}ms/request "
+            f"({int(requests / time_taken)} requests/s)"
+        )
@@ -0,0 +1,75 @@
+import time
+
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+
+from temba.api.v2.views import ContactsEndpoint, MessagesEndpoint, RunsEndpoint
+from temba.orgs.models import Org
+
+ENDPOINTS = {"contacts": ContactsEndpoint, "messages": MessagesEndpoint, "runs": RunsEndpoint}
+
+
+class Command(BaseCommand):  # pragma: no cover
+    help = "Benchmarks the fast serializers of API endpoints against their regular read serializers"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--org", type=int, help="ID of org to fetch objects from (defaults to first org)")
+        parser.add_argument("--endpoint", type=str, choices=ENDPOINTS.keys(), help="Only benchmark this endpoint")
+        parser.add_argument("--size", type=int, default=250, help="Number of objects per page")
+        parser.add_argument("--pages", type=int, default=20, help="Number of times to serialize the page")
+
+    def handle(self, org: int, endpoint: str, size: int, pages: int, **options):
+        org = Org.objects.get(id=org) if org else Org.objects.order_by("id").first()
+        user = org.get_admins().first()
+
+        for name, endpoint_class in ENDPOINTS.items():
+            if endpoint and name != endpoint:
+                continue
+
+            view, page = self._fetch_page(endpoint_class, org, user, size)
+            context = view.get_serializer_context()
+            renderer = JSONRenderer()
+
+            def regular():
+                return renderer.render(view.serializer_class(page, many=True, context=context).data)
+
+            def fast():
+                return renderer.render(view.fast_serializer_class(page, many=True, context=context).data)
+
+            if regular() != fast():
+                raise CommandError(f"Output of fast serializer for {name} doesn't match regular serializer")
+
+            self.stdout.write(f"{name} ({len(page)} objects, output identical):")
+
+            regular_time = self._bench("regular", len(page), pages, regular)
+            fast_time = self._bench("fast", len(page), pages, fast)
+
+            self.stdout.write(f" > speedup: {regular_time / fast_time:.1f}x")
+
+    def _fetch_page(self, endpoint_class, org, user, size: int) -> tuple:
+        """
+        Fetches a page of objects in the same way as the endpoint would
+        """
+        request = Request(RequestFactory().get("/"))
+        request.org = org
+        request.user = user
+
+        view = endpoint_class(request=request, format_kwarg=None, kwargs={})
+
+        queryset = view.filter_queryset(view.get_queryset())
+        page = list(queryset[:size])
+        view.prepare_for_serialization(page, using=queryset.db)
+
+        return view, page
+
+    def _bench(self, name: str, size: int, pages: int, fn) -> float:
+        start = time.perf_counter()
+        for i in range(pages):
+            fn()
+        time_taken = time.perf_counter() - start
+
+        self.stdout.write(f" > {name}: {time_taken:.2f}s ({int(size * pages / time_taken)} objects/s)")
+        return time_taken
@@ -1,13 +1,18 @@
 import hmac
 import logging
+import pickle
+import time
 from hashlib import sha1
 
 from rest_framework.permissions import BasePermission
 from smartmin.models import SmartModel
 
 from django.conf import settings
-from django.contrib.auth.models import Group
+from django.contrib.auth.models import Group, User as AuthUser
+from django.core.cache import cache
 from django.db import models
+from django.db.models.signals import m2m_changed, post_save
+from django.dispatch import receiver
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
@@ -214,6 +219,9 @@ class APIToken(models.Model):
         "Prometheus": (OrgRole.ADMINISTRATOR,),
     }
 
+    CACHE_KEY = "api_token:%s"
+    LOCAL_CACHE_MAX_SIZE = 10_000  # max number of tokens kept in local memory before it's cleared
+
     org = models.ForeignKey(Org, on_delete=models.PROTECT, related_name="api_tokens")
     user = models.ForeignKey(User, on_delete=models.PROTECT, related_name="api_tokens")
     role = models.ForeignKey(Group, on_delete=models.PROTECT)
@@ -273,6 +281,72 @@ class APIToken(models.Model):
 
         return role
 
+    @classmethod
+    def get_active(cls, key: str):
+        """
+        Gets the active token with the given key, with its user, org and role loaded, or None if there's no such token.
+        If API_TOKEN_CACHE_TTL is set, the roles of tokens are cached in redis so that only the token, user and org need
+        to be loaded, and if API_TOKEN_LOCAL_CACHE_TTL is set, whole tokens are briefly kept in local memory so that
+        repeated requests with the same token don't need any queries.
+        """
+        if not settings.API_TOKEN_CACHE_TTL:
+            return cls.objects.filter(is_active=True, key=key).select_related("user", "org", "role").first()
+
+        # locally cached tokens are kept pickled so each request gets its own instances of the token, user and org
+        local = _local_tokens.get(key)
+        if local and local[0] > time.monotonic():
+            return pickle.loads(local[1])
+
+        cached = cache.get(cls.CACHE_KEY % key)
+        if cached:
+            token = cls.objects.filter(is_active=True, key=key).select_related("user", "org").first()
+            if not token:
+                return None
+
+            # so that neither the role nor is_valid() need a query
+            token.role = Group(id=token.role_id, name=cached["role_name"])
+            org_role = OrgRole.from_code(cached["org_role"]) if cached["org_role"] else None
+            token.org._user_role_cache[token.user] = org_role
+        else:
+            token = cls.objects.filter(is_active=True, key=key).select_related("user", "org", "role").first()
+            if not token:
+                return None
+
+            org_role = token.org.get_user_role(token.user)
+            cached = {"role_name": token.role.name, "org_role": org_role.code if org_role else None}
+            cache.set(cls.CACHE_KEY % key, cached, settings.API_TOKEN_CACHE_TTL)
+
+        if settings.API_TOKEN_LOCAL_CACHE_TTL:
+            if len(_local_tokens) >= cls.LOCAL_CACHE_MAX_SIZE:
+                _local_tokens.clear()
+
+            _local_tokens[key] = (time.monotonic() + settings.API_TOKEN_LOCAL_CACHE_TTL, pickle.dumps(token))
+
+        return token
+
+    @classmethod
+    def invalidate_cached(cls, *, keys=(), org_ids=(), user_id: int = None):
+        """
+        Removes cached tokens with the given keys or belonging to the given orgs and/or user. Tokens cached in the local
+        memory of other processes are only removed when they expire.
+        """
+        if not settings.API_TOKEN_CACHE_TTL:
+            return
+
+        keys = set(keys)
+        if org_ids or user_id:
+            tokens = cls.objects.filter(is_active=True)
+            if org_ids:
+                tokens = tokens.filter(org_id__in=org_ids)
+            if user_id:
+                tokens = tokens.filter(user_id=user_id)
+            keys.update(tokens.values_list("key", flat=True))
+
+        if keys:
+            cache.delete_many([cls.CACHE_KEY % k for k in keys])
+            for key in keys:
+                _local_tokens.pop(key, None)
+
     def is_valid(self) -> bool:
         """
         A user's role in an org can change so this return whether this token is still valid.
@@ -294,5 +368,38 @@ class APIToken(models.Model):
         self.is_active = False
         self.save(update_fields=("is_active",))
 
+        APIToken.invalidate_cached(keys=(self.key,))
+
     def __str__(self):
         return self.key
+
+
+# local memory level of the token cache, of key -> (expires, pickled token)
+_local_tokens = {}
+
+# fields of orgs and users which authentication, permission and throttle checks depend on
+TOKEN_ORG_FIELDS = {"is_active", "is_suspended", "api_rates"}
+TOKEN_USER_FIELDS = {"is_active", "is_staff", "username"}
+
+
+@receiver(post_save, sender=Org)
+def invalidate_org_tokens(sender, instance, created, update_fields, **kwargs):
+    if not created and (update_fields is None or TOKEN_ORG_FIELDS & set(update_fields)):
+        APIToken.invalidate_cached(org_ids=(instance.id,))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=AuthUser)
+def invalidate_user_tokens(sender, instance, created, update_fields, **kwargs):
+    if not created and (update_fields is None or TOKEN_USER_FIELDS & set(update_fields)):
+        APIToken.invalidate_cached(user_id=instance.id)
+
+
+@receiver(m2m_changed, sender=Org.users.through)
+def invalidate_member_tokens(sender, instance, action, pk_set, **kwargs):
+    if action in ("post_add", "post_remove", "post_clear"):
+        if isinstance(instance, Org):
+            for user_id in pk_set or (None,):
+                APIToken.invalidate_cached(org_ids=(instance.id,), user_id=user_id)
+        else:
+            APIToken.invalidate_cached(org_ids=pk_set or (), user_id=instance.id)
@@ -1,5 +1,7 @@
 import logging
+import math
 
+from django_redis import get_redis_connection
 from rest_framework import exceptions, status
 from rest_framework.authentication import BasicAuthentication, SessionAuthentication, TokenAuthentication
 from rest_framework.exceptions import APIException
@@ -47,9 +49,8 @@ class APITokenAuthentication(RequestAttributesMixin, TokenAuthentication):
     model = APIToken
 
     def authenticate_credentials(self, key):
-        try:
-            token = self.model.objects.get(is_active=True, key=key)
-        except self.model.DoesNotExist:
+        token = self.model.get_active(key)
+        if not token:
             raise exceptions.AuthenticationFailed("Invalid token")
 
         if token.user.is_active:
@@ -68,12 +69,8 @@ class APIBasicAuthentication(RequestAttributesMixin, BasicAuthentication):
     """
 
     def authenticate_credentials(self, userid, password, request=None):
-        try:
-            token = APIToken.objects.get(is_active=True, key=password)
-        except APIToken.DoesNotExist:
-            raise exceptions.AuthenticationFailed("Invalid token or email")
-
-        if token.user.username != userid:
+        token = APIToken.get_active(password)
+        if not token or token.user.username != userid:
             raise exceptions.AuthenticationFailed("Invalid token or email")
 
         if token.user.is_active:
@@ -90,7 +87,9 @@ class APISessionAuthentication(SessionAuthentication):
 
 class OrgUserRateThrottle(ScopedRateThrottle):
     """
-    Throttle class which rate limits at an org level or user level for staff users
+    Throttle class which rate limits at an org level or user level for staff users. Rather than storing the timestamps
+    of all recent requests like the regular REST framework throttles, we keep a redis counter per time window and
+    estimate the number of requests in the sliding window from the current and previous counters.
     """
 
     def get_org_rate(self, request, by_token: bool):
@@ -113,7 +112,52 @@ class OrgUserRateThrottle(ScopedRateThrottle):
         self.rate = self.get_org_rate(request, by_token)
         self.num_requests, self.duration = self.parse_rate(self.rate)
 
-        return super(ScopedRateThrottle, self).allow_request(request, view)
+        if self.rate is None:
+            return True
+
+        self.key = self.get_cache_key(request, view)
+        self.now = self.timer()
+
+        window = int(self.now // self.duration)
+        self.elapsed = self.now - window * self.duration
+
+        r = get_redis_connection()
+        pipe = r.pipeline()
+        pipe.incr(f"{self.key}:{window}")
+        pipe.expire(f"{self.key}:{window}", self.duration * 2)
+        pipe.get(f"{self.key}:{window - 1}")
+        self.count, _, previous = pipe.execute()
+
+        # previous window's requests are assumed to have been evenly spread, so only some of them are in our window
+        self.previous = int(previous or 0)
+        self.estimate = self.previous * (self.duration - self.elapsed) / self.duration + self.count
+
+        if self.estimate > self.num_requests:
+            r.decr(f"{self.key}:{window}")  # rejected requests don't count
+            self.count -= 1
+            allowed = self.throttle_failure()
+        else:
+            allowed = self.throttle_success()
+
+        view.rate_limit_headers = {
+            "X-RateLimit-Limit": self.num_requests,
+            "X-RateLimit-Remaining": max(self.num_requests - math.ceil(self.estimate), 0),
+            "X-RateLimit-Reset": math.ceil(self.duration - self.elapsed),
+        }
+        return allowed
+
+    def throttle_success(self):
+        return True
+
+    def wait(self):
+        # if the current window is full we have to wait for the next one, otherwise until enough of the previous
+        # window's requests have slid out of our window
+        if self.count >= self.num_requests:
+            return self.duration - self.elapsed
+        elif self.previous:
+            return max(self.duration * (1 - (self.num_requests - self.count - 1) / self.previous) - self.elapsed, 0)
+
+        return None  # pragma: no cover
 
     def get_cache_key(self, request, view):
         org = request.org
@@ -1,6 +1,9 @@
-from datetime import timedelta
+import time
+from datetime import timedelta, timezone as tzone
+from unittest.mock import patch
 
 from django.contrib.auth.models import Group
+from django.core.cache import cache
 from django.db import connection
 from django.http import HttpRequest
 from django.test import override_settings
@@ -8,7 +11,7 @@ from django.utils import timezone
 
 from temba.api.models import APIToken, Resthook, WebHookEvent
 from temba.api.tasks import trim_webhook_events
-from temba.orgs.models import OrgRole
+from temba.orgs.models import Org, OrgRole
 from temba.tests import TembaTest
 
 
@@ -79,6 +82,114 @@ class APITokenTest(TembaTest):
         self.assertTrue(token3.is_valid())
         self.assertFalse(token4.is_valid())
 
+    @override_settings(API_TOKEN_CACHE_TTL=60, API_TOKEN_LOCAL_CACHE_TTL=0)
+    def test_get_active(self):
+        token1 = APIToken.get_or_create(self.org, self.admin, role=OrgRole.ADMINISTRATOR)
+        token2 = APIToken.get_or_create(self.org, self.editor, role=OrgRole.EDITOR)
+
+        self.assertIsNone(APIToken.get_active("1234567890"))
+
+        # first lookup loads the token, user, org and role, and the user's role in the org
+        with self.assertNumQueries(2):
+            token = APIToken.get_active(token1.key)
+
+        self.assertEqual(token1, token)
+        self.assertEqual(self.admin, token.user)
+        self.assertEqual(self.org, token.org)
+        self.assertEqual(self.admins_group, token.role)
+
+        # next lookups get the roles from the cache so only load the token, user and org
+        with self.assertNumQueries(1):
+            token = APIToken.get_active(token1.key)
+            self.assertTrue(token.is_valid())
+
+        self.assertEqual(token1, token)
+        self.assertEqual(self.admin, token.user)
+        self.assertEqual(self.org, token.org)
+        self.assertEqual(self.admins_group, token.role)
+        self.assertEqual("Administrators", token.role.name)
+
+        # user isn't cached in redis with its password
+        self.assertNotIn("password", str(cache.get(APIToken.CACHE_KEY % token1.key)))
+
+        # so changes to the org are always seen
+        self.org.name = "Nyaruka Ltd"
+        self.org.save(update_fields=("name",))
+
+        with self.assertNumQueries(1):
+            self.assertEqual("Nyaruka Ltd", APIToken.get_active(token1.key).org.name)
+
+        # and saves of fields that checks depend on invalidate the cache
+        self.org.api_rates = {"v2": "15000/hour"}
+        self.org.save(update_fields=("api_rates",))
+
+        with self.assertNumQueries(2):
+            self.assertEqual({"v2": "15000/hour"}, APIToken.get_active(token1.key).org.api_rates)
+
+        # but other saves, like logging in, don't
+        self.admin.last_login = timezone.now()
+        self.admin.save(update_fields=("last_login",))
+
+        with self.assertNumQueries(1):
+            APIToken.get_active(token1.key)
+
+        # changing the user's role invalidates their tokens
+        APIToken.get_active(token2.key)
+        self.org.add_user(self.admin, OrgRole.EDITOR)
+
+        self.assertFalse(APIToken.get_active(token1.key).is_valid())
+
+        with self.assertNumQueries(1):
+            self.assertTrue(APIToken.get_active(token2.key).is_valid())  # other user's token unaffected
+
+        # as does suspending the parent of their workspace
+        self.org.features += [Org.FEATURE_CHILD_ORGS]
+        child = self.org.create_new(self.admin, "Child Workspace", tzone.utc, as_child=True)
+        token3 = APIToken.get_or_create(child, self.admin, role=OrgRole.ADMINISTRATOR)
+        APIToken.get_active(token3.key)
+
+        self.org.suspend()
+
+        self.assertIsNone(cache.get(APIToken.CACHE_KEY % token3.key))
+        self.assertTrue(APIToken.get_active(token3.key).org.is_suspended)
+
+        # and releasing the token
+        token1.release()
+
+        self.assertIsNone(APIToken.get_active(token1.key))
+
+    @override_settings(API_TOKEN_CACHE_TTL=60, API_TOKEN_LOCAL_CACHE_TTL=5)
+    def test_get_active_local(self):
+        token1 = APIToken.get_or_create(self.org, self.admin, role=OrgRole.ADMINISTRATOR)
+        token2 = APIToken.get_or_create(self.org, self.editor, role=OrgRole.EDITOR)
+
+        APIToken.get_active(token1.key)
+
+        # tokens cached in local memory don't need any queries
+        with self.assertNumQueries(0):
+            token = APIToken.get_active(token1.key)
+            self.assertTrue(token.is_valid())
+
+        self.assertEqual(token1, token)
+        self.assertEqual(self.admin, token.user)
+        self.assertEqual(self.org, token.org)
+        self.assertEqual(self.admins_group, token.role)
+
+        # but each lookup gets its own instances
+        self.assertIsNot(token.org, APIToken.get_active(token1.key).org)
+
+        # they expire after a few seconds
+        APIToken.get_active(token2.key)
+
+        with patch("temba.api.models.time.monotonic", return_value=time.monotonic() + 10):
+            with self.assertNumQueries(1):
+                APIToken.get_active(token2.key)
+
+        # and are invalidated along with tokens cached in redis
+        token1.release()
+
+        self.assertIsNone(APIToken.get_active(token1.key))
+
     def test_get_default_role(self):
         self.assertEqual(APIToken.get_default_role(self.org, self.admin), OrgRole.ADMINISTRATOR)
         self.assertEqual(APIToken.get_default_role(self.org, self.editor), OrgRole.EDITOR)
@@ -0,0 +1,259 @@
+import re
+from datetime import timezone as tzone
+from decimal import Decimal
+
+import iso8601
+
+from temba.contacts.models import URN, Contact, ContactField, ContactURN
+from temba.flows.models import FlowRun
+from temba.msgs.models import Msg
+from temba.utils import format_number
+
+from .serializers import ContactReadSerializer, FlowRunReadSerializer, MsgReadSerializer, format_datetime
+
+# engine timestamps of the form 2024-01-02T03:04:05.123456789Z which we can normalize without parsing
+ENGINE_DATETIME_REGEX = re.compile(r"^[1-9]\d{3}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(\.\d{1,9})?Z$")
+
+
+def serialize_datetime(value):
+    """
+    Formats a datetime the same way as the DRF datetime fields of our read serializers
+    """
+    if not value:
+        return None
+
+    value = value.astimezone(tzone.utc).isoformat()
+    return value[:-6] + "Z" if value.endswith("+00:00") else value
+
+
+def normalize_engine_datetime(value: str) -> str:
+    """
+    Formats an engine timestamp string the same way as format_datetime(iso8601.parse_date(value)), i.e. as UTC with
+    exactly 6 decimal places, without parsing it if it's already UTC
+    """
+    if ENGINE_DATETIME_REGEX.match(value):
+        return value[:19] + "." + (value[20:-1] + "000000")[:6] + "Z"
+
+    return format_datetime(iso8601.parse_date(value))
+
+
+def serialize_ref(obj) -> dict:
+    return {"uuid": str(obj.uuid), "name": obj.name} if obj else None
+
+
+class FastSerializer:
+    """
+    Serializer for list endpoints which produces the same JSON as the endpoint's read serializer, but by calling a
+    function compiled once per request for each object rather than going through the DRF field machinery. Endpoints opt
+    in by setting fast_serializer_class, and it's used if API_FAST_SERIALIZERS is enabled.
+    """
+
+    def __init__(self, instance=None, many=False, context=None, **kwargs):
+        self.instance = instance
+        self.many = many
+        self.context = context
+        self.serialize = self.compile(context)
+
+    def compile(self, context: dict):  # pragma: no cover
+        """
+        Returns a function which serializes a single object
+        """
+        raise NotImplementedError()
+
+    @property
+    def data(self):
+        if self.many:
+            return [self.serialize(obj) for obj in self.instance]
+
+        return self.serialize(self.instance)
+
+
+class FastContactSerializer(FastSerializer):
+    """
+    Fast version of ContactReadSerializer
+    """
+
+    STATUSES = ContactReadSerializer.STATUSES
+
+    def compile(self, context: dict):
+        org = context["org"]
+        is_anon = org.is_anon
+        statuses = self.STATUSES
+        status_blocked, status_stopped = Contact.STATUS_BLOCKED, Contact.STATUS_STOPPED
+        urn_mask = ContactURN.ANON_MASK
+
+        # precompute the UUID and type of each field so that extracting values is just dict lookups
+        number_type = ContactField.TYPE_NUMBER
+        field_specs = [
+            (f.key, str(f.uuid), ContactField.ENGINE_TYPES[f.value_type], f.value_type == number_type)
+            for f in context["contact_fields"]
+        ]
+
+        def serialize_fields(contact) -> dict:
+            values = contact.fields or {}
+            fields = {}
+            for key, uuid, engine_type, is_number in field_specs:
+                value = values.get(uuid)
+                if not value:
+                    fields[key] = None
+                elif is_number:
+                    number = value.get(engine_type, value.get("decimal"))
+                    fields[key] = format_number(Decimal(number)) if number is not None else None
+                else:
+                    fields[key] = value.get(engine_type)
+            return fields
+
+        def serialize_urn(urn):
+            if isinstance(urn, ContactURN):
+                return URN.from_parts(urn.scheme, urn_mask if is_anon else urn.path)
+
+            return {
+                "channel": urn["channel"],
+                "scheme": urn["scheme"],
+                "path": urn_mask if is_anon else urn["path"],
+                "display": urn["display"] or None,
+            }
+
+        def serialize(contact) -> dict:
+            rep = {"uuid": str(contact.uuid)}
+
+            if contact.is_active:
+                urns = contact.expanded_urns if hasattr(contact, "expanded_urns") else contact.get_urns()
+                groups = contact.prefetched_groups if hasattr(contact, "prefetched_groups") else contact.get_groups()
+
+                rep["name"] = contact.name
+                if is_anon:
+                    rep["anon_display"] = contact.anon_display
+                rep["status"] = statuses[contact.status]
+                rep["language"] = contact.language
+                rep["urns"] = [serialize_urn(u) for u in urns]
+                rep["groups"] = [{"uuid": g.uuid, "name": g.name} for g in groups]
+                rep["fields"] = serialize_fields(contact)
+            else:
+                rep["name"] = None
+                if is_anon:
+                    rep["anon_display"] = contact.anon_display
+                rep["status"] = None
+                rep["language"] = None
+                rep["urns"] = []
+                rep["groups"] = []
+                rep["fields"] = {}
+
+            rep["flow"] = serialize_ref(contact.current_flow)
+            rep["created_on"] = serialize_datetime(contact.created_on)
+            rep["modified_on"] = serialize_datetime(contact.modified_on)
+            rep["last_seen_on"] = serialize_datetime(contact.last_seen_on)
+            rep["blocked"] = contact.status == status_blocked if contact.is_active else None
+            rep["stopped"] = contact.status == status_stopped if contact.is_active else None
+            return rep
+
+        return serialize
+
+
+class FastFlowRunSerializer(FastSerializer):
+    """
+    Fast version of FlowRunReadSerializer
+    """
+
+    EXIT_TYPES = FlowRunReadSerializer.EXIT_TYPES
+
+    def compile(self, context: dict):
+        org = context["org"]
+        is_anon = org.is_anon
+        include_paths = context["include_paths"]
+        exit_types = self.EXIT_TYPES
+        urn_mask = ContactURN.ANON_MASK
+
+        path_node, path_arrived_on = FlowRun.PATH_NODE_UUID, FlowRun.PATH_ARRIVED_ON
+        result_value, result_category = FlowRun.RESULT_VALUE, FlowRun.RESULT_CATEGORY
+        result_node, result_created_on = FlowRun.RESULT_NODE_UUID, FlowRun.RESULT_CREATED_ON
+        result_input, result_name = FlowRun.RESULT_INPUT, FlowRun.RESULT_NAME
+
+        def serialize_contact(contact) -> dict:
+            rep = {"uuid": str(contact.uuid), "name": contact.name}
+
+            urn = contact.get_urn()
+            if urn:
+                rep["urn"] = URN.from_parts(urn.scheme, urn_mask if is_anon else urn.path)
+                rep["urn_display"] = contact.get_urn_display() if not is_anon else None
+            else:
+                rep["urn"], rep["urn_display"] = None, None
+
+            if is_anon:
+                rep["anon_display"] = contact.anon_display
+            return rep
+
+        def serialize_result(result: dict) -> dict:
+            return {
+                "value": result[result_value],
+                "category": result.get(result_category),
+                "node": result[result_node],
+                "time": normalize_engine_datetime(result[result_created_on]),
+                "input": result.get(result_input),
+                "name": result.get(result_name),
+            }
+
+        def serialize(run) -> dict:
+            if include_paths:
+                path = [{"node": s[path_node], "time": normalize_engine_datetime(s[path_arrived_on])} for s in run.path]
+            else:
+                path = None
+
+            return {
+                "id": run.id,
+                "uuid": str(run.uuid),
+                "flow": serialize_ref(run.flow),
+                "contact": serialize_contact(run.contact) if run.contact else None,
+                "start": {"uuid": str(run.start.uuid)} if run.start else None,
+                "responded": run.responded,
+                "path": path,
+                "values": {k: serialize_result(r) for k, r in run.results.items()},
+                "created_on": serialize_datetime(run.created_on),
+                "modified_on": serialize_datetime(run.modified_on),
+                "exited_on": serialize_datetime(run.exited_on),
+                "exit_type": exit_types.get(run.status),
+            }
+
+        return serialize
+
+
+class FastMsgSerializer(FastSerializer):
+    """
+    Fast version of MsgReadSerializer
+    """
+
+    TYPES = MsgReadSerializer.TYPES
+    STATUSES = MsgReadSerializer.STATUSES
+    VISIBILITIES = MsgReadSerializer.VISIBILITIES
+
+    def compile(self, context: dict):
+        is_anon = context["org"].is_anon
+        types, statuses, visibilities = self.TYPES, self.STATUSES, self.VISIBILITIES
+        direction_in, visibility_archived = Msg.DIRECTION_IN, Msg.VISIBILITY_ARCHIVED
+
+        def serialize(msg) -> dict:
+            is_in = msg.direction == direction_in
+            attachments = msg.attachments
+
+            return {
+                "id": msg.id,
+                "broadcast": msg.broadcast_id,
+                "contact": serialize_ref(msg.contact),
+                "urn": str(msg.contact_urn) if msg.contact_urn and not is_anon else None,
+                "channel": serialize_ref(msg.channel),
+                "direction": "in" if is_in else "out",
+                "type": types.get(msg.msg_type),
+                "status": statuses.get(msg.status),
+                "archived": msg.visibility == visibility_archived,
+                "visibility": visibilities.get(msg.visibility),
+                "text": str(msg.text) if msg.text is not None else None,
+                "labels": [{"uuid": str(lb.uuid), "name": lb.name} for lb in msg.labels.all()] if is_in else [],
+                "flow": serialize_ref(msg.flow),
+                "attachments": [a.as_json() for a in msg.get_attachments()],
+                "created_on": serialize_datetime(msg.created_on),
+                "sent_on": serialize_datetime(msg.sent_on),
+                "modified_on": serialize_datetime(msg.modified_on),
+                "media": attachments[0] if attachments else None,
+            }
+
+        return serialize
@@ -1,5 +1,5 @@
 import base64
-import time
+import json
 from collections import OrderedDict
 from datetime import datetime, timezone as tzone
 from decimal import Decimal
@@ -7,13 +7,13 @@ from unittest.mock import call, patch
 from urllib.parse import quote_plus
 
 import iso8601
+from django_redis import get_redis_connection
 from rest_framework import serializers
 from rest_framework.test import APIClient
 
 from django.conf import settings
 from django.contrib.auth.models import Group
 from django.contrib.gis.geos import GEOSGeometry
-from django.core.cache import cache
 from django.test import override_settings
 from django.urls import reverse
 from django.utils import timezone
@@ -446,7 +446,12 @@ class EndpointsTest(APITest):
         )
         self.assertEqual(OrderedDict([("a", "x" * 640)]), normalize_extra({"a": "x" * 641}))
 
-    def test_authentication(self):
+    @patch("temba.api.support.OrgUserRateThrottle.timer")
+    def test_authentication(self, mock_timer):
+        mock_timer.return_value = 1_700_003_700.0  # 15 minutes into an hour long throttle window
+        window = int(mock_timer.return_value // 3600)
+        r = get_redis_connection()
+
         def request(endpoint, **headers):
             return self.client.get(
                 f"{endpoint}.json", content_type="application/json", HTTP_X_FORWARDED_HTTPS="https", **headers
@@ -514,12 +519,20 @@ class EndpointsTest(APITest):
         self.assertEqual(200, response.status_code)
         self.assertEqual(str(self.org.id), response["X-Temba-Org"])
 
+        # token requests are given rate limit headers (this is the 4th token request in the v2 scope)
+        response = request_by_token(fields_url, token1.key)
+        self.assertEqual("2500", response["X-RateLimit-Limit"])
+        self.assertEqual("2496", response["X-RateLimit-Remaining"])
+        self.assertEqual("2700", response["X-RateLimit-Reset"])
+
         # simulate the admin user exceeding the rate limit for the v2 scope
-        cache.set(f"throttle_v2_{self.org.id}", [time.time() for r in range(10000)])
+        r.set(f"throttle_v2_{self.org.id}:{window}", 10000)
 
         # next request they make using a token will be rejected
         response = request_by_token(fields_url, token1.key)
         self.assertEqual(response.status_code, 429)
+        self.assertEqual("0", response["X-RateLimit-Remaining"])
+        self.assertEqual("2700", response["Retry-After"])
 
         # same with basic auth
         response = request_by_basic_auth(fields_url, self.admin.username, token1.key)
@@ -543,13 +556,31 @@ class EndpointsTest(APITest):
 
         response = request_by_basic_auth(fields_url, self.admin.username, token1.key)
         self.assertEqual(response.status_code, 200)
+        self.assertEqual("15000", response["X-RateLimit-Limit"])
+        self.assertEqual("4999", response["X-RateLimit-Remaining"])
 
-        cache.set(f"throttle_v2_{self.org.id}", [time.time() for r in range(15000)])
+        r.set(f"throttle_v2_{self.org.id}:{window}", 15000)
 
         # next request they make using a token will be rejected
         response = request_by_token(fields_url, token1.key)
         self.assertEqual(response.status_code, 429)
 
+        # requests in the previous window count towards the limit in proportion to how much it overlaps ours
+        self.org.api_rates = {}
+        self.org.save(update_fields=("api_rates",))
+        r.set(f"throttle_v2_{self.org.id}:{window - 1}", 4000)
+        r.set(f"throttle_v2_{self.org.id}:{window}", 0)
+
+        response = request_by_token(fields_url, token1.key)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual("451", response["Retry-After"])  # when enough of the previous window has slid out
+
+        mock_timer.return_value += 451
+
+        response = request_by_token(fields_url, token1.key)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual("0", response["X-RateLimit-Remaining"])
+
         # if user loses access to the token's role, don't allow the request
         self.org.add_user(self.admin, OrgRole.SURVEYOR)
 
@@ -2921,6 +2952,199 @@ class EndpointsTest(APITest):
         )
 
     @override_settings(ORG_LIMIT_DEFAULTS={"fields": 10})
+    @mock_mailroom
+    def test_fast_serializers(self, mr_mocks):
+        age = self.create_field("age", "Age", value_type=ContactField.TYPE_NUMBER)
+        self.create_field("nickname", "Nickname")
+        self.create_field("joined", "Joined", value_type=ContactField.TYPE_DATETIME)
+
+        flow = self.get_flow("color_v13")
+        nodes = flow.get_definition()["nodes"]
+
+        jean = self.create_contact(
+            "Jean", urns=["tel:+250788000001", "twitter:jeanj"], fields={"age": "32.50", "nickname": "JJ"}
+        )
+        self.set_contact_field(jean, "joined", "2024-01-02T03:04:05.123456Z")
+        jean.current_flow = flow
+        jean.save(update_fields=("current_flow",))
+        self.create_group("Customers", [self.joe, jean])
+        self.create_contact("Gone", phone="+250788000002").release(self.admin)
+
+        label = self.create_label("Important")
+        msg_in = self.create_incoming_msg(jean, "Hi", attachments=["image/jpeg:https://example.com/a.jpg"])
+        msg_in.labels.add(label)
+        self.create_outgoing_msg(jean, "Hello", status=Msg.STATUS_DELIVERED)
+        archived = self.create_incoming_msg(self.frank, "Old")
+        Msg.objects.filter(id=archived.id).update(visibility=Msg.VISIBILITY_ARCHIVED)
+
+        (
+            MockSessionWriter(jean, flow)
+            .visit(nodes[0])
+            .visit(nodes[4])
+            .wait()
+            .resume(msg=msg_in)
+            .set_result("Color", "blue", "Blue", "Hi")
+            .complete()
+            .save()
+        )
+        MockSessionWriter(self.frank, flow).visit(nodes[0]).wait().save()
+
+        # contact field values with no number are still serialized the same
+        jean.refresh_from_db()
+        jean.fields[str(age.uuid)] = {"text": "x"}
+        jean.save(update_fields=("fields",))
+
+        urls = [
+            reverse("api.v2.contacts") + ".json",
+            reverse("api.v2.contacts") + ".json?deleted=true",
+            reverse("api.v2.contacts") + ".json?expand_urns=true",
+            reverse("api.v2.messages") + ".json",
+            reverse("api.v2.messages") + ".json?folder=archived",
+            reverse("api.v2.runs") + ".json",
+            reverse("api.v2.runs") + ".json?paths=false",
+        ]
+
+        def assert_same_output():
+            for url in urls:
+                with override_settings(API_FAST_SERIALIZERS=False):
+                    expected = self._getJSON(url, self.admin)
+                with override_settings(API_FAST_SERIALIZERS=True):
+                    actual = self._getJSON(url, self.admin)
+
+                self.assertEqual(expected.content, actual.content, f"output mismatch for {url}")
+                self.assertTrue(len(actual.json()["results"]) > 0)
+
+        assert_same_output()
+
+        with self.anonymous(self.org):
+            assert_same_output()
+
+    @override_settings(API_STREAM_BATCH_SIZE=2, API_STREAM_RECORDS_PER_REQUEST=2)
+    @patch("temba.api.support.OrgUserRateThrottle.timer")
+    def test_streaming(self, mock_timer):
+        mock_timer.return_value = 1_700_003_700.0
+        throttle_key = f"throttle_v2.contacts_{self.org.id}:{int(mock_timer.return_value // 3600)}"
+        endpoint_url = reverse("api.v2.contacts") + ".json"
+
+        for i in range(5):
+            self.create_contact(f"Bob {i}", phone=f"+25078800000{i}")
+
+        # give some contacts the same modified_on so that we have to page by id as well
+        Contact.objects.filter(name__in=("Bob 1", "Bob 2", "Bob 3")).update(modified_on=timezone.now())
+
+        def get_lines(url, user=None, **headers):
+            if user:
+                response = self._getJSON(url, user)
+            else:
+                response = self.client.get(url, HTTP_X_FORWARDED_HTTPS="https", **headers)
+
+            self.assertEqual(200, response.status_code)
+            self.assertEqual("application/x-ndjson", response["Content-Type"])
+            return [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+
+        expected = self._getJSON(endpoint_url, self.admin).json()["results"]
+        self.assertEqual(7, len(expected))
+
+        # all results streamed in the same order as the paginated results, with no next URL at the end
+        self.assertEqual(expected + [{"next": None}], get_lines(endpoint_url + "?stream=true", self.admin))
+
+        # filtering and reverse ordering still apply
+        after, before = quote_plus(expected[4]["modified_on"]), quote_plus(expected[3]["modified_on"])
+        lines = get_lines(endpoint_url + f"?stream=true&after={after}&before={before}", self.admin)
+        self.assertEqual(expected[3:5] + [{"next": None}], lines)
+
+        lines = get_lines(endpoint_url + "?stream=true&reverse=true", self.admin)
+        self.assertEqual(list(reversed(expected)) + [{"next": None}], lines)
+
+        # with fast serializers we get the same output
+        with override_settings(API_FAST_SERIALIZERS=True):
+            self.assertEqual(expected + [{"next": None}], get_lines(endpoint_url + "?stream=true", self.admin))
+
+        # responses can be limited in size, in which case we get a URL to resume from
+        with override_settings(API_STREAM_MAX_RECORDS=3):
+            lines = get_lines(endpoint_url + "?stream=true", self.admin)
+            self.assertEqual(expected[:3], lines[:3])
+            self.assertEqual(4, len(lines))
+
+            lines = get_lines(lines[3]["next"], self.admin)
+            self.assertEqual(expected[3:6], lines[:3])
+
+            lines = get_lines(lines[3]["next"], self.admin)
+            self.assertEqual(expected[6:] + [{"next": None}], lines)
+
+        # invalid cursors are rejected
+        response = self._getJSON(endpoint_url + "?stream=true&cursor=xyz", self.admin)
+        self.assertEqual(404, response.status_code)
+
+        # with a token, every 2 records streamed count as another request against the throttle
+        token = APIToken.get_or_create(self.org, self.admin, role=OrgRole.ADMINISTRATOR)
+        r = get_redis_connection()
+        r.set(throttle_key, 2497)
+
+        self.client.logout()
+        lines = get_lines(endpoint_url + "?stream=true", HTTP_AUTHORIZATION=f"Token {token.key}")
+        self.assertEqual(expected[:6], lines[:6])
+        self.assertEqual(7, len(lines))
+        self.assertEqual(b"2500", r.get(throttle_key))
+
+        # and we can't continue until the throttle allows it
+        response = self.client.get(lines[6]["next"], HTTP_AUTHORIZATION=f"Token {token.key}")
+        self.assertEqual(429, response.status_code)
+
+        r.delete(throttle_key)
+
+        lines = get_lines(lines[6]["next"], HTTP_AUTHORIZATION=f"Token {token.key}")
+        self.assertEqual(expected[6:] + [{"next": None}], lines)
+
+        # non-streamable endpoints ignore the stream param
+        response = self._getJSON(reverse("api.v2.fields") + ".json?stream=true", self.admin)
+        self.assertEqual(200, response.status_code)
+        self.assertIn("results", response.json())
+
+    def test_streaming_messages_and_runs(self):
+        def get_lines(url):
+            response = self._getJSON(url, self.admin)
+            self.assertEqual(200, response.status_code)
+            return [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+
+        def stream_all(url):
+            # follows next URLs until the stream is finished
+            results = []
+            while url:
+                lines = get_lines(url)
+                results += lines[:-1]
+                url = lines[-1]["next"]
+            return results
+
+        for i in range(3):
+            self.create_incoming_msg(self.joe, f"In {i}")
+        sent = [self.create_outgoing_msg(self.joe, f"Out {i}", status=Msg.STATUS_WIRED) for i in range(5)]
+
+        # messages in the sent folder can still be without a sent_on
+        Msg.objects.filter(id__in=(sent[1].id, sent[3].id)).update(sent_on=None)
+
+        flow = self.create_flow("Test")
+        for contact in (self.joe, self.frank, self.joe):
+            MockSessionWriter(contact, flow).wait().save()
+
+        urls = [
+            reverse("api.v2.messages") + ".json?stream=true",
+            reverse("api.v2.messages") + ".json?stream=true&folder=incoming",
+            reverse("api.v2.messages") + ".json?stream=true&folder=sent",
+            reverse("api.v2.runs") + ".json?stream=true",
+        ]
+
+        for url in urls:
+            expected = self._getJSON(url.replace("stream=true", "stream=false"), self.admin).json()["results"]
+            self.assertTrue(expected)
+
+            # results are streamed in the same order as the paginated results
+            self.assertEqual(expected + [{"next": None}], get_lines(url), f"mismatch for {url}")
+
+            # and when cut short, resuming gives us the rest, including from objects with null sort values
+            with override_settings(API_STREAM_MAX_RECORDS=1):
+                self.assertEqual(expected, stream_all(url), f"mismatch for {url}")
+
     def test_fields(self):
         endpoint_url = reverse("api.v2.fields") + ".json"
 
@@ -3180,7 +3404,7 @@ class EndpointsTest(APITest):
                     "modified_on": format_datetime(survey.modified_on),
                 },
             ],
-            num_queries=NUM_BASE_REQUEST_QUERIES + 5,
+            num_queries=NUM_BASE_REQUEST_QUERIES + 3,
         )
 
         self.assertGet(endpoint_url, [self.admin2], results=[other_org])
@@ -46,6 +46,7 @@ from ..support import (
     SentOnCursorPagination,
 )
 from ..views import BaseAPIView, BulkWriteAPIMixin, DeleteAPIMixin, ListAPIMixin, WriteAPIMixin
+from .fast import FastContactSerializer, FastFlowRunSerializer, FastMsgSerializer
 from .serializers import (
     AdminBoundaryReadSerializer,
     ArchiveReadSerializer,
@@ -218,6 +219,15 @@ class BaseEndpoint(BaseAPIView):
     throttle_classes = (OrgUserRateThrottle,)
     throttle_scope = "v2"
 
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+
+        # add any rate limit headers set by the throttle
+        for name, value in getattr(self, "rate_limit_headers", {}).items():
+            response[name] = value
+
+        return response
+
 
 class RootView(BaseEndpoint):
     """
@@ -287,6 +297,10 @@ class RootView(BaseEndpoint):
     The rate limit for all endpoints is 2,500 requests per hour. It is important to honor the Retry-After header when
     encountering 429 responses as the limit is subject to change without notice.
 
+    Responses to requests made with an API token also include the headers 'X-RateLimit-Limit' and
+    'X-RateLimit-Remaining' which give the number of requests allowed per time window and how many of those remain, and
+    'X-RateLimit-Reset' which gives the number of seconds until the current time window ends.
+
     ## Date Values
 
     Many endpoints either return datetime values or can take datatime parameters. The values returned will always be in
@@ -1303,6 +1317,10 @@ class ContactsEndpoint(ListAPIMixin, WriteAPIMixin, DeleteAPIMixin, BaseEndpoint
      * **modified_on** - when this contact was last modified (datetime), filterable as `before` and `after`.
      * **last_seen_on** - when this contact last communicated with us (datetime).
 
+    You can fetch all results in one request by passing `stream=true`, in which case objects are returned one per line as
+    newline-delimited JSON, followed by a final line containing the `next` URL to resume from if the response was cut
+    short. Every 250 objects streamed count as one request towards your rate limit.
+
     Example:
 
         GET /api/v2/contacts.json
@@ -1414,6 +1432,8 @@ class ContactsEndpoint(ListAPIMixin, WriteAPIMixin, DeleteAPIMixin, BaseEndpoint
 
     model = Contact
     serializer_class = ContactReadSerializer
+    fast_serializer_class = FastContactSerializer
+    streamable = True
     write_serializer_class = ContactWriteSerializer
     write_with_transaction = False
     pagination_class = ModifiedOnCursorPagination
@@ -1923,10 +1943,11 @@ class FlowsEndpoint(ListAPIMixin, BaseEndpoint):
         if archived:
             queryset = queryset.filter(is_archived=str_to_bool(archived))
 
-        queryset = queryset.prefetch_related("labels")
-
         return self.filter_before_after(queryset, "modified_on")
 
+    def prepare_for_serialization(self, object_list, using: str):
+        Flow.prefetch_run_stats_and_labels(object_list, using=using)
+
     @classmethod
     def get_read_explorer(cls):
         return {
@@ -2466,6 +2487,10 @@ class MessagesEndpoint(ListAPIMixin, WriteAPIMixin, BaseEndpoint):
 
     Without any parameters this endpoint will return all incoming and outgoing messages ordered by creation date.
 
+    You can fetch all results in one request by passing `stream=true`, in which case objects are returned one per line as
+    newline-delimited JSON, followed by a final line containing the `next` URL to resume from if the response was cut
+    short. Every 250 objects streamed count as one request towards your rate limit.
+
     Example:
 
         GET /api/v2/messages.json?folder=inbox
@@ -2550,6 +2575,8 @@ class MessagesEndpoint(ListAPIMixin, WriteAPIMixin, BaseEndpoint):
 
     model = Msg
     serializer_class = MsgReadSerializer
+    fast_serializer_class = FastMsgSerializer
+    streamable = True
     write_serializer_class = MsgWriteSerializer
     write_with_transaction = False
     pagination_class = Pagination
@@ -3103,6 +3130,10 @@ class RunsEndpoint(ListAPIMixin, BaseEndpoint):
 
     Note that you cannot filter by `flow` and `contact` at the same time.
 
+    You can fetch all results in one request by passing `stream=true`, in which case objects are returned one per line as
+    newline-delimited JSON, followed by a final line containing the `next` URL to resume from if the response was cut
+    short. Every 250 objects streamed count as one request towards your rate limit.
+
     Example:
 
         GET /api/v2/runs.json?flow=f5901b62-ba76-4003-9c62-72fdacc1b7b7
@@ -3151,6 +3182,8 @@ class RunsEndpoint(ListAPIMixin, BaseEndpoint):
 
     model = FlowRun
     serializer_class = FlowRunReadSerializer
+    fast_serializer_class = FastFlowRunSerializer
+    streamable = True
     pagination_class = ModifiedOnCursorPagination
     exclusive_params = ("contact", "flow")
     throttle_scope = "v2.runs"
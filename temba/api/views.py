@@ -1,14 +1,23 @@
+import base64
 import contextlib
+import json
 from uuid import UUID
 
 import iso8601
 from rest_framework import generics, mixins, status
+from rest_framework.exceptions import NotFound
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
+from django.conf import settings
 from django.db import transaction
+from django.db.models import Q
+from django.http import StreamingHttpResponse
 
 from temba.api.support import InvalidQueryError
 from temba.contacts.models import URN
+from temba.utils import str_to_bool
 from temba.utils.models import TembaModel
 from temba.utils.views import NonAtomicMixin
 
@@ -102,6 +111,12 @@ class ListAPIMixin(mixins.ListModelMixin):
 
     exclusive_params = ()
 
+    # serializer which produces the same output as serializer_class but faster, used if API_FAST_SERIALIZERS is on
+    fast_serializer_class = None
+
+    # whether all results can be streamed as newline-delimited JSON with ?stream=true
+    streamable = False
+
     def get(self, request, *args, **kwargs):
         return self.list(request, *args, **kwargs)
 
@@ -111,6 +126,12 @@ class ListAPIMixin(mixins.ListModelMixin):
         if not kwargs.get("format", None):
             # if this is just a request to browse the endpoint docs, don't make a query
             return Response([])
+        elif self.streamable and str_to_bool(request.query_params.get("stream")):
+            return self.stream(request)
+        elif self.fast_serializer_class and settings.API_FAST_SERIALIZERS:
+            page = self.paginate_queryset(self.filter_queryset(self.get_queryset()))
+            serializer = self.fast_serializer_class(page, many=True, context=self.get_serializer_context())
+            return self.get_paginated_response(serializer.data)
         else:
             return super().list(request, *args, **kwargs)
 
@@ -155,6 +176,105 @@ class ListAPIMixin(mixins.ListModelMixin):
         """
         pass
 
+    def stream(self, request):
+        """
+        Streams all results as newline-delimited JSON, one object per line, followed by a final line with the URL to
+        resume from if the response was cut short by the record limit or throttling. Rather than paging with offsets,
+        results are fetched in batches using the paginator's ordering of a datetime field and the id as a keyset.
+        """
+        queryset = self.filter_queryset(self.get_queryset())
+        ordering = self.paginator.get_ordering(request, queryset, self)
+        after = self.decode_stream_cursor(request.query_params.get("cursor"))
+
+        return StreamingHttpResponse(
+            self.stream_lines(request, queryset, ordering, after), content_type="application/x-ndjson"
+        )
+
+    def stream_lines(self, request, queryset, ordering: tuple, after: tuple):
+        renderer = JSONRenderer()
+        context = self.get_serializer_context()
+        serializer_class = (
+            self.fast_serializer_class
+            if self.fast_serializer_class and settings.API_FAST_SERIALIZERS
+            else self.get_serializer_class()
+        )
+        throttles = self.get_throttles()
+        records_per_request = settings.API_STREAM_RECORDS_PER_REQUEST
+        max_records = settings.API_STREAM_MAX_RECORDS
+        sort_field, desc = ordering[0].lstrip("-"), ordering[0].startswith("-")
+        lookup = "lt" if desc else "gt"
+
+        # sort fields like sent_on can be null, and like the paginated results, nulls come first in descending order and
+        # last in ascending order
+        nulls_first = desc
+
+        queryset = queryset.order_by(*ordering)
+        num_sent = 0
+
+        while True:
+            batch_qs = queryset
+            if after and after[0] is None:
+                keyset = Q(**{f"{sort_field}__isnull": True, f"id__{lookup}": after[1]})
+                if nulls_first:
+                    keyset |= Q(**{f"{sort_field}__isnull": False})
+                batch_qs = batch_qs.filter(keyset)
+            elif after:
+                keyset = Q(**{f"{sort_field}__{lookup}": after[0]})
+                keyset |= Q(**{sort_field: after[0], f"id__{lookup}": after[1]})
+                if not nulls_first:
+                    keyset |= Q(**{f"{sort_field}__isnull": True})
+                batch_qs = batch_qs.filter(keyset)
+
+            batch = list(batch_qs[: settings.API_STREAM_BATCH_SIZE])
+            if not batch:
+                break
+
+            self.prepare_for_serialization(batch, using=queryset.db)
+
+            for obj, data in zip(batch, serializer_class(batch, many=True, context=context).data):
+                # the request itself covers the first records, after which every records_per_request records count as
+                # another request against the throttle, and we stop if that isn't allowed
+                if num_sent == max_records or (
+                    num_sent
+                    and num_sent % records_per_request == 0
+                    and not all(t.allow_request(request, self) for t in throttles)
+                ):
+                    yield self.render_stream_end(renderer, request, after)
+                    return
+
+                yield renderer.render(data) + b"\n"
+
+                num_sent += 1
+                after = (getattr(obj, sort_field), obj.id)
+
+            if len(batch) < settings.API_STREAM_BATCH_SIZE:
+                break
+
+        yield self.render_stream_end(renderer, request, None)
+
+    def render_stream_end(self, renderer, request, after: tuple) -> bytes:
+        url = None
+        if after:
+            url = replace_query_param(request.build_absolute_uri(), "cursor", self.encode_stream_cursor(after))
+
+        return renderer.render({"next": url}) + b"\n"
+
+    @staticmethod
+    def encode_stream_cursor(after: tuple) -> str:
+        value = after[0].isoformat() if after[0] is not None else None
+        return base64.urlsafe_b64encode(json.dumps([value, after[1]]).encode()).decode()
+
+    @staticmethod
+    def decode_stream_cursor(cursor: str) -> tuple:
+        if not cursor:
+            return None
+
+        try:
+            value, obj_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            return iso8601.parse_date(value) if value is not None else None, int(obj_id)
+        except Exception:
+            raise NotFound("Invalid cursor")
+
 
 class WriteAPIMixin:
     """
@@ -0,0 +1,163 @@
+import gzip
+import hashlib
+import io
+import random
+import tempfile
+import time
+from datetime import date
+from unittest.mock import patch
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from temba.archives.models import Archive, FileAndHash, jsonlgz_iterate, jsonlgz_rewrite
+from temba.orgs.models import Org
+from temba.tests.s3 import MockS3Client
+from temba.utils import json
+
+
+def legacy_iterate(in_file):
+    for line in gzip.GzipFile(fileobj=in_file, mode="r"):
+        yield json.loads(line.decode("utf-8"))
+
+
+def legacy_rewrite(in_file, out_file, transform):
+    out_wrapped = FileAndHash(out_file)
+    out_stream = gzip.GzipFile(fileobj=out_wrapped, mode="w")
+
+    for record in legacy_iterate(in_file):
+        record = transform(record)
+        if record is not None:
+            out_stream.write((json.dumps(record) + "\n").encode("utf-8"))
+
+    out_stream.close()
+
+
+class Command(BaseCommand):  # pragma: no cover
+    help = "Benchmarks reading and rewriting of gzipped JSONL archives"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--records", type=int, default=1_000_000, help="Number of records to generate")
+        parser.add_argument("--org", type=int, help="ID of org to create temporary archive for (defaults to first org)")
+
+    def handle(self, records: int, org: int, **options):
+        self.stdout.write(f"Generating archive with {records} run records...")
+
+        archive = tempfile.TemporaryFile()
+        with gzip.GzipFile(fileobj=archive, mode="w") as gz:
+            for i in range(records):
+                gz.write(json.dumps(self._generate_run(i)).encode("utf-8"))
+                gz.write(b"\n")
+
+        archive.seek(0, io.SEEK_END)
+        self.stdout.write(f" > {archive.tell()} bytes compressed")
+
+        def purge_contact(record):  # transform which inspects one nested key and drops a few records
+            return None if record["contact"]["name"] == "Jim" else record
+
+        def iterate(fn):
+            for record in fn():
+                pass
+
+        def access_one_key(fn):
+            for record in fn():
+                record["id"]
+
+        self._bench("iterate (legacy)", records, archive, lambda f: iterate(lambda: legacy_iterate(f)))
+        self._bench("iterate", records, archive, lambda f: iterate(lambda: jsonlgz_iterate(f)))
+        self._bench(
+            "iterate (lazy, one key)", records, archive, lambda f: access_one_key(lambda: jsonlgz_iterate(f, lazy=True))
+        )
+        self._bench(
+            "rewrite (legacy)", records, archive, lambda f: legacy_rewrite(f, tempfile.TemporaryFile(), purge_contact)
+        )
+        self._bench("rewrite", records, archive, lambda f: jsonlgz_rewrite(f, tempfile.TemporaryFile(), purge_contact))
+        self._bench(
+            "rewrite (lazy)",
+            records,
+            archive,
+            lambda f: jsonlgz_rewrite(f, tempfile.TemporaryFile(), purge_contact, lazy=True),
+        )
+
+        def trim_path(record):  # transform which changes a top-level key of every record
+            record["path"] = record["path"][:1]
+            return record
+
+        def purge_id(record):  # transform which only reads a top-level scalar and drops a few records
+            return None if record["id"] % 100 == 0 else record
+
+        org = Org.objects.get(id=org) if org else Org.objects.order_by("id").first()
+
+        for transform in (purge_contact, trim_path, purge_id):
+            for lazy in (False, True):
+                self._bench_archive_rewrite(org, records, archive, transform, lazy)
+
+    def _bench(self, name: str, num_records: int, archive, fn):
+        archive.seek(0)
+
+        start = time.perf_counter()
+        fn(archive)
+        time_taken = time.perf_counter() - start
+
+        self.stdout.write(f" > {name}: {time_taken:.2f}s ({int(num_records / time_taken)} records/s)")
+
+    def _bench_archive_rewrite(self, org, num_records: int, archive, transform, lazy: bool):
+        """
+        Benchmarks Archive.rewrite itself, i.e. including index building and the multipart upload, against a mock S3
+        client and an archive which is rolled back afterwards.
+        """
+        archive.seek(0)
+        body = archive.read()
+        body_hash = hashlib.md5(body).hexdigest()
+        mock_s3 = MockS3Client()
+
+        with patch("temba.utils.s3.client", return_value=mock_s3), transaction.atomic():
+            obj = Archive.objects.create(
+                org=org,
+                archive_type=Archive.TYPE_FLOWRUN,
+                size=len(body),
+                hash=body_hash,
+                url=f"https://s3-bucket.s3.amazonaws.com/{org.id}/run_D20200801_{body_hash}.jsonl.gz",
+                record_count=num_records,
+                start_date=date(2020, 8, 1),
+                period=Archive.PERIOD_DAILY,
+                build_time=0,
+            )
+            mock_s3.put_object(*obj.get_storage_location(), io.BytesIO(body))
+
+            start = time.perf_counter()
+            obj.rewrite(transform, lazy=lazy)
+            time_taken = time.perf_counter() - start
+
+            transaction.set_rollback(True)
+
+        name = f"Archive.rewrite ({transform.__name__}{', lazy' if lazy else ''})"
+        self.stdout.write(f" > {name}: {time_taken:.2f}s ({int(num_records / time_taken)} records/s)")
+
+    def _generate_run(self, i: int) -> dict:
+        return {
+            "id": i,
+            "uuid": f"1d4d1e58-0b0c-4a5e-9a3f-{i:012d}",
+            "flow": {"uuid": "2ac5b5b0-4dc7-4a3b-9a3c-1a5b2a8f3f0e", "name": "Registration"},
+            "contact": {"uuid": f"6fbf3d32-3f5b-4b0c-9c3f-{i:012d}", "name": random.choice(["Bob", "Jim", "Ann"])},
+            "responded": True,
+            "path": [
+                {"node": "a9b3c4d5-e6f7-4a8b-9c0d-1e2f3a4b5c6d", "time": "2020-08-01T10:00:00.000000Z"},
+                {"node": "b8c7d6e5-f4a3-4b2c-8d1e-0f9a8b7c6d5e", "time": "2020-08-01T10:01:00.000000Z"},
+            ],
+            "values": {
+                "age": {
+                    "name": "Age",
+                    "node": "b8c7d6e5-f4a3-4b2c-8d1e-0f9a8b7c6d5e",
+                    "time": "2020-08-01T10:01:00.000000Z",
+                    "input": "32",
+                    "value": "32",
+                    "category": "Valid",
+                }
+            },
+            "created_on": "2020-08-01T10:00:00.000000Z",
+            "modified_on": "2020-08-01T10:01:00.000000Z",
+            "exited_on": "2020-08-01T10:01:00.000000Z",
+            "exit_type": "completed",
+            "submitted_by": None,
+        }
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from temba.archives.models import Archive
+from temba.orgs.models import Org
+
+
+class Command(BaseCommand):  # pragma: no cover
+    help = "Builds index sidecars for archives which don't have them"
+
+    def add_arguments(self, parser):
+        parser.add_argument("org_id", help="ID of the org whose archives will be indexed")
+        parser.add_argument(
+            "--type",
+            choices=[Archive.TYPE_MSG, Archive.TYPE_FLOWRUN],
+            dest="archive_type",
+            default=None,
+            help="Only index archives of this type",
+        )
+        parser.add_argument("--rebuild", action="store_true", help="Rebuild indexes which already exist")
+
+    def handle(self, org_id, archive_type, rebuild, **options):
+        org = Org.objects.filter(id=org_id).first()
+        if not org:
+            raise CommandError(f"No such org with id {org_id}")
+
+        archives = org.archives.filter(record_count__gt=0, rollup=None).order_by("start_date")
+        if archive_type:
+            archives = archives.filter(archive_type=archive_type)
+
+        num_indexed = 0
+        for archive in archives:
+            if not rebuild and archive.has_index:
+                continue
+
+            archive.build_index()
+            num_indexed += 1
+
+            self.stdout.write(f" > indexed {archive.archive_type} archive for {archive.start_date} ({num_indexed})")
+
+        self.stdout.write(f"Indexed {num_indexed} archives")
@@ -28,3 +28,35 @@ class SearchArchivesTest(TembaTest):
 
         self.assertIn('"id": 1', out.getvalue())
         self.assertIn("Fetched 2 records in", out.getvalue())
+
+
+class IndexArchivesTest(TembaTest):
+    @patch("temba.utils.s3.client")
+    def test_command(self, mock_s3_client):
+        mock_s3 = MockS3Client()
+        mock_s3_client.return_value = mock_s3
+
+        archive = self.create_archive(
+            Archive.TYPE_FLOWRUN,
+            "D",
+            date(2020, 8, 1),
+            [{"id": 1, "created_on": "2020-07-30T10:00:00Z"}, {"id": 2, "created_on": "2020-07-30T15:00:00Z"}],
+            s3=mock_s3,
+        )
+
+        out = StringIO()
+        call_command("index_archives", self.org.id, stdout=out)
+
+        self.assertIn("Indexed 1 archives", out.getvalue())
+        self.assertEqual(2, archive.load_index().record_count)
+
+        # existing indexes aren't rebuilt unless asked to
+        out = StringIO()
+        call_command("index_archives", self.org.id, stdout=out)
+
+        self.assertIn("Indexed 0 archives", out.getvalue())
+
+        out = StringIO()
+        call_command("index_archives", self.org.id, rebuild=True, stdout=out)
+
+        self.assertIn("Indexed 1 archives", out.getvalue())
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.8 on 2024-02-05 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("archives", "0020_squashed"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="archive",
+            name="has_index",
+            field=models.BooleanField(default=False),
+        ),
+    ]
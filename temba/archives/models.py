@@ -1,13 +1,22 @@
 import base64
 import gzip
 import hashlib
+import io
+import json as stdlib_json
+import math
+import queue
 import re
-import tempfile
+import threading
+import zlib
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, datetime
 from gettext import gettext as _
 from urllib.parse import urlparse
 
+import iso8601
 from dateutil.relativedelta import relativedelta
+from django_redis import get_redis_connection
 
 from django.core.files.storage import storages
 from django.db import models
@@ -17,12 +26,26 @@ from django.utils import timezone
 from temba.utils import json, s3, sizeof_fmt
 from temba.utils.s3 import EventStreamReader
 
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+# size of blocks to read from decompressed archive streams
+JSONLGZ_BLOCK_SIZE = 1024 * 1024
+
 KEY_PATTERN = re.compile(r"^(?P<org>\d+)/(?P<type>run|message)_(?P<period>(D|M)\d+)_(?P<hash>[0-9a-f]{32})\.jsonl\.gz$")
 
 
 class Archive(models.Model):
     DOWNLOAD_EXPIRES = 60 * 60 * 24  # Up to 24 hours
 
+    READ_CONCURRENCY = 4  # number of archives to fetch ahead when iterating across archives
+    READ_BUFFER_SIZE = 1000  # max number of records to buffer for each archive being fetched ahead
+
+    REWRITE_PART_SIZE = 64 * 1024 * 1024  # size of parts uploaded when rewriting (S3 minimum is 5MB)
+    REWRITE_CHECKPOINT_KEY = "archive_rewrite"
+
     TYPE_MSG = "message"
     TYPE_FLOWRUN = "run"
     TYPE_CHOICES = ((TYPE_MSG, _("Message")), (TYPE_FLOWRUN, _("Run")))
@@ -65,6 +88,9 @@ class Archive(models.Model):
     # when this archive's records where deleted (if any)
     deleted_on = models.DateTimeField(null=True)
 
+    # whether an index sidecar has been saved for this archive
+    has_index = models.BooleanField(default=False)
+
     def size_display(self):
         return sizeof_fmt(self.size)
 
@@ -75,6 +101,54 @@ class Archive(models.Model):
         url_parts = urlparse(self.url)
         return url_parts.netloc.split(".")[0], url_parts.path[1:]
 
+    def get_index_location(self) -> tuple:
+        """
+        Returns a tuple of the storage bucket and key of this archive's index sidecar
+        """
+        bucket, key = self.get_storage_location()
+        return bucket, key + ArchiveIndex.KEY_SUFFIX
+
+    def load_index(self):
+        """
+        Loads the index sidecar for this archive if one exists
+        """
+        if not self.has_index:
+            return None
+
+        s3_client = s3.client()
+        bucket, key = self.get_index_location()
+        try:
+            s3_obj = s3_client.get_object(Bucket=bucket, Key=key)
+        except s3_client.exceptions.NoSuchKey:
+            return None
+
+        return ArchiveIndex.from_json(json.loads(s3_obj["Body"].read()))
+
+    def save_index(self, index):
+        """
+        Saves the given index as the sidecar for this archive
+        """
+        bucket, key = self.get_index_location()
+
+        s3.client().put_object(
+            Bucket=bucket,
+            Key=key,
+            Body=io.BytesIO(json.dumps(index.as_json()).encode("utf-8")),
+            ContentType="application/json",
+            ACL="private",
+        )
+
+        self.has_index = True
+        self.save(update_fields=("has_index",))
+
+    def build_index(self):
+        """
+        Builds and saves the index sidecar for this archive by reading through all its records
+        """
+        index = ArchiveIndex.build(self.iter_records(), capacity=self.record_count)
+        self.save_index(index)
+        return index
+
     def get_end_date(self):
         """
         Gets the date this archive ends non-inclusive
@@ -150,10 +224,20 @@ class Archive(models.Model):
 
     @classmethod
     def iter_all_records(
-        cls, org, archive_type: str, after: datetime = None, before: datetime = None, where: dict = None
+        cls,
+        org,
+        archive_type: str,
+        after: datetime = None,
+        before: datetime = None,
+        where: dict = None,
+        *,
+        concurrency: int = None,
+        buffer_size: int = None,
     ):
         """
-        Creates a record iterator across archives of the given type for records which match the given criteria
+        Creates a record iterator across archives of the given type for records which match the given criteria.
+        Archives are fetched and decompressed ahead on a pool of threads but records are always returned in archive
+        start date order.
         """
 
         if not where:
@@ -163,14 +247,17 @@ class Archive(models.Model):
         if before:
             where["created_on__lte"] = before
 
-        archives = cls._get_covering_period(org, archive_type, after, before)
-
-        def generator():
-            for archive in archives:
-                for record in archive.iter_records(where=where):
-                    yield record
+        archives = list(cls._get_covering_period(org, archive_type, after, before))
 
-        return generator()
+        return iter(
+            PrefetchingReader(
+                archives,
+                where=where,
+                use_indexes=True,
+                concurrency=concurrency if concurrency is not None else cls.READ_CONCURRENCY,
+                buffer_size=buffer_size if buffer_size is not None else cls.READ_BUFFER_SIZE,
+            )
+        )
 
     def iter_records(self, *, where: dict = None):
         """
@@ -201,41 +288,176 @@ class Archive(models.Model):
             s3_obj = s3_client.get_object(Bucket=bucket, Key=key)
             return jsonlgz_iterate(s3_obj["Body"])
 
-    def rewrite(self, transform, delete_old=False):
+    def rewrite(self, transform, delete_old=False, lazy=False, part_size: int = None):
+        """
+        Rewrites this archive using the given transform function. Output is streamed into a multipart upload in parts
+        of complete gzip members, with progress checkpointed in redis so that a rewrite interrupted by a crash can be
+        resumed by calling this again with the same transform. Checkpoints don't expire so that their uploads are
+        never forgotten, and are only removed once the rewrite completes or its upload is aborted.
+        """
         s3_client = s3.client()
+        r = get_redis_connection()
         bucket, key = self.get_storage_location()
-
-        s3_obj = s3_client.get_object(Bucket=bucket, Key=key)
-        old_file = s3_obj["Body"]
-
-        new_file = tempfile.TemporaryFile()
-        new_hash, new_size = jsonlgz_rewrite(old_file, new_file, transform)
-
-        new_file.seek(0)
+        part_size = part_size or self.REWRITE_PART_SIZE
+
+        checkpoint_key = f"{self.REWRITE_CHECKPOINT_KEY}:{self.id}"
+        checkpoint = r.get(checkpoint_key)
+        checkpoint = json.loads(checkpoint) if checkpoint else None
+
+        def save_checkpoint():
+            r.set(checkpoint_key, json.dumps(checkpoint))
+
+        # abort the upload of any checkpoint from rewriting a previous version of this archive
+        if checkpoint and checkpoint["source"] != key:
+            self._abort_rewrite(s3_client, bucket, checkpoint)
+            r.delete(checkpoint_key)
+            checkpoint = None
+
+        if not checkpoint:
+            upload_key = f"{self.org.id}/{self.archive_type}_{self.id}_rewrite.jsonl.gz"
+            upload = s3_client.create_multipart_upload(Bucket=bucket, Key=upload_key, ACL="private")
+            checkpoint = {
+                "source": key,
+                "upload_key": upload_key,
+                "upload_id": upload["UploadId"],
+                "records": 0,
+                "parts": [],
+                "completed": False,
+            }
+            save_checkpoint()  # straight away so that the upload is never orphaned
+
+        upload_key = checkpoint["upload_key"]
+        resumed = checkpoint["records"] > 0 or checkpoint["completed"]
+        new_hash, new_size, index = None, 0, None
+
+        try:
+            if not checkpoint["completed"]:
+                # can't restore hash or index state for records already written so these are only built if we start
+                # fresh, and in lazy mode the index is built afterwards so records the transform doesn't read aren't
+                # decoded
+                index = ArchiveIndex.Builder(capacity=self.record_count) if not resumed and not lazy else None
+                part_buffer = io.BytesIO()
+                out_wrapped = FileAndHash(part_buffer)
+
+                def upload_part():
+                    part_number = len(checkpoint["parts"]) + 1
+                    response = s3_client.upload_part(
+                        Bucket=bucket,
+                        Key=upload_key,
+                        UploadId=checkpoint["upload_id"],
+                        PartNumber=part_number,
+                        Body=part_buffer.getvalue(),
+                    )
+                    checkpoint["parts"].append({"PartNumber": part_number, "ETag": response["ETag"]})
+                    part_buffer.seek(0)
+                    part_buffer.truncate()
+
+                s3_obj = s3_client.get_object(Bucket=bucket, Key=key)
+                in_stream = gzip.GzipFile(fileobj=s3_obj["Body"], mode="r")
+                out_stream = gzip.GzipFile(fileobj=out_wrapped, mode="w")
+
+                for num, line in enumerate(jsonlgz_lines(in_stream), start=1):
+                    if num <= checkpoint["records"]:  # skip over records already written
+                        continue
+
+                    record = transform(LazyRecord(line) if lazy else json.loads(line))
+                    if record is not None:
+                        if index:
+                            index.add(record)
+
+                        out_line = record.encode() if isinstance(record, LazyRecord) else json.dumps(record).encode()
+                        out_stream.write(out_line)
+                        out_stream.write(b"\n")
+
+                    # once we have enough data for a part, end the current gzip member, upload it and checkpoint
+                    if part_buffer.tell() >= part_size:
+                        out_stream.close()
+                        upload_part()
+                        checkpoint["records"] = num
+                        save_checkpoint()
+
+                        out_stream = gzip.GzipFile(fileobj=out_wrapped, mode="w")
+
+                out_stream.close()
+                upload_part()
+
+                s3_client.complete_multipart_upload(
+                    Bucket=bucket,
+                    Key=upload_key,
+                    UploadId=checkpoint["upload_id"],
+                    MultipartUpload={"Parts": checkpoint["parts"]},
+                )
+                checkpoint["completed"] = True
+                save_checkpoint()
+
+                if not resumed:
+                    new_hash, new_size = out_wrapped.hash, out_wrapped.size
+        except (s3_client.exceptions.NoSuchKey, s3_client.exceptions.NoSuchUpload):
+            # if our source or upload has gone then this rewrite can never be resumed so abort it
+            self._abort_rewrite(s3_client, bucket, checkpoint)
+            r.delete(checkpoint_key)
+            raise
+
+        # if we resumed we need to re-read the uploaded file to calculate its hash and size
+        if not new_hash:
+            new_hash = hashlib.md5()
+            body = s3_client.get_object(Bucket=bucket, Key=upload_key)["Body"]
+            while chunk := body.read(JSONLGZ_BLOCK_SIZE):
+                new_hash.update(chunk)
+                new_size += len(chunk)
 
         match = KEY_PATTERN.match(key)
         new_key = f"{self.org.id}/{match.group('type')}_{match.group('period')}_{new_hash.hexdigest()}.jsonl.gz"
         new_url = f"https://{bucket}.s3.amazonaws.com/{new_key}"
         new_hash_base64 = base64.standard_b64encode(new_hash.digest()).decode()
 
-        s3_client.put_object(
+        # copy the upload to its final location, which depends on its hash, setting the metadata that needs that hash
+        s3_client.copy(
+            CopySource={"Bucket": bucket, "Key": upload_key},
             Bucket=bucket,
             Key=new_key,
-            Body=new_file,
-            ContentType="application/json",
-            ContentEncoding="gzip",
-            ACL="private",
-            ContentMD5=new_hash_base64,
-            Metadata={"md5chksum": new_hash_base64},
+            ExtraArgs={
+                "ContentType": "application/json",
+                "ContentEncoding": "gzip",
+                "ACL": "private",
+                "Metadata": {"md5chksum": new_hash_base64},
+                "MetadataDirective": "REPLACE",
+            },
         )
+        s3_client.delete_object(Bucket=bucket, Key=upload_key)
 
         self.url = new_url
         self.hash = new_hash.hexdigest()
         self.size = new_size
-        self.save(update_fields=("url", "hash", "size"))
+        self.has_index = False  # until the index for the new file has been saved
+        self.save(update_fields=("url", "hash", "size", "has_index"))
+
+        if index:
+            self.save_index(index.finish())
+        else:
+            self.build_index()
+
+        r.delete(checkpoint_key)
 
         if delete_old:
             s3_client.delete_object(Bucket=bucket, Key=key)
+            s3_client.delete_object(Bucket=bucket, Key=key + ArchiveIndex.KEY_SUFFIX)
+
+    @staticmethod
+    def _abort_rewrite(s3_client, bucket: str, checkpoint: dict):
+        """
+        Aborts the upload of the given rewrite checkpoint, or deletes it if it was completed
+        """
+        if checkpoint["completed"]:
+            s3_client.delete_object(Bucket=bucket, Key=checkpoint["upload_key"])
+            return
+
+        try:
+            s3_client.abort_multipart_upload(
+                Bucket=bucket, Key=checkpoint["upload_key"], UploadId=checkpoint["upload_id"]
+            )
+        except s3_client.exceptions.NoSuchUpload:  # already aborted
+            pass
 
     def delete(self):
         # detach us from our rollups
@@ -245,6 +467,7 @@ class Archive(models.Model):
         if self.url:
             bucket, key = self.get_storage_location()
             s3.client().delete_object(Bucket=bucket, Key=key)
+            s3.client().delete_object(Bucket=bucket, Key=key + ArchiveIndex.KEY_SUFFIX)
 
         # and lastly delete ourselves
         super().delete()
@@ -253,38 +476,412 @@ class Archive(models.Model):
         unique_together = ("org", "archive_type", "start_date", "period")
 
 
-def jsonlgz_iterate(in_file):
+class ArchiveIndex:
     """
-    Iterates over a records in a gzipped JSONL stream
+    Summary of the records in an archive, stored as a JSON sidecar next to the archive file, which lets us skip
+    archives which can't contain any records matching a query without opening them.
+    """
+
+    KEY_SUFFIX = ".index.json"
+    VERSION = 1
+
+    # the S3 select conditions which we can check against an index, besides the raw label condition below
+    FILTER_KEYS = (
+        "created_on__gte",
+        "created_on__lte",
+        "flow__uuid",
+        "flow__uuid__in",
+        "contact__uuid",
+        "contact__uuid__in",
+    )
+
+    # the raw S3 select condition used to query messages by label
+    LABEL_CONDITION = re.compile(r"^'(?P<uuid>[0-9a-f-]{36})' IN s\.labels\[\*\]\.uuid\[\*\]$")
+
+    def __init__(
+        self,
+        *,
+        record_count: int,
+        min_created_on: datetime,
+        max_created_on: datetime,
+        flows: set,
+        labels: set,
+        contacts,
+    ):
+        self.record_count = record_count
+        self.min_created_on = min_created_on
+        self.max_created_on = max_created_on
+        self.flows = flows
+        self.labels = labels
+        self.contacts = contacts
+
+    class Builder:
+        def __init__(self, capacity: int):
+            self.record_count = 0
+            self.min_created_on = None
+            self.max_created_on = None
+            self.flows = set()
+            self.labels = set()
+            self.contacts = BloomFilter.for_capacity(capacity)
+
+        def add(self, record: dict):
+            self.record_count += 1
+
+            created_on = iso8601.parse_date(record["created_on"])
+            if self.min_created_on is None or created_on < self.min_created_on:
+                self.min_created_on = created_on
+            if self.max_created_on is None or created_on > self.max_created_on:
+                self.max_created_on = created_on
+
+            flow, contact = record.get("flow"), record.get("contact")
+
+            if flow and flow.get("uuid"):
+                self.flows.add(flow["uuid"])
+            for label in record.get("labels") or ():
+                self.labels.add(label["uuid"])
+            if contact and contact.get("uuid"):
+                self.contacts.add(contact["uuid"])
+
+        def finish(self):
+            return ArchiveIndex(
+                record_count=self.record_count,
+                min_created_on=self.min_created_on,
+                max_created_on=self.max_created_on,
+                flows=self.flows,
+                labels=self.labels,
+                contacts=self.contacts,
+            )
+
+    @classmethod
+    def build(cls, records, capacity: int):
+        builder = cls.Builder(capacity)
+        for record in records:
+            builder.add(record)
+        return builder.finish()
+
+    @classmethod
+    def can_filter(cls, where: dict) -> bool:
+        """
+        Checks whether any of the given S3 select conditions are ones that an index can rule archives out by
+        """
+        for key, val in where.items():
+            if key in cls.FILTER_KEYS or (key == "__raw__" and cls.LABEL_CONDITION.match(val)):
+                return True
+
+        return False
+
+    def may_match(self, where: dict) -> bool:
+        """
+        Checks whether any records in the archive could match the given S3 select conditions. Conditions that the
+        index doesn't know about are assumed to match.
+        """
+        if self.record_count == 0:
+            return False
+
+        for key, val in where.items():
+            if key == "created_on__gte":
+                if self.max_created_on < val:
+                    return False
+            elif key == "created_on__lte":
+                if self.min_created_on > val:
+                    return False
+            elif key in ("flow__uuid", "flow__uuid__in"):
+                uuids = {str(u) for u in val} if key.endswith("__in") else {str(val)}
+                if not uuids & self.flows:
+                    return False
+            elif key in ("contact__uuid", "contact__uuid__in"):
+                uuids = {str(u) for u in val} if key.endswith("__in") else {str(val)}
+                if not any(u in self.contacts for u in uuids):
+                    return False
+            elif key == "__raw__":
+                match = self.LABEL_CONDITION.match(val)
+                if match and match.group("uuid") not in self.labels:
+                    return False
+
+        return True
+
+    def as_json(self) -> dict:
+        return {
+            "version": self.VERSION,
+            "record_count": self.record_count,
+            "min_created_on": self.min_created_on.isoformat() if self.min_created_on else None,
+            "max_created_on": self.max_created_on.isoformat() if self.max_created_on else None,
+            "flows": sorted(self.flows),
+            "labels": sorted(self.labels),
+            "contacts": self.contacts.as_json(),
+        }
+
+    @classmethod
+    def from_json(cls, data: dict):
+        return cls(
+            record_count=data["record_count"],
+            min_created_on=iso8601.parse_date(data["min_created_on"]) if data["min_created_on"] else None,
+            max_created_on=iso8601.parse_date(data["max_created_on"]) if data["max_created_on"] else None,
+            flows=set(data["flows"]),
+            labels=set(data["labels"]),
+            contacts=BloomFilter.from_json(data["contacts"]),
+        )
+
+
+class BloomFilter:
+    """
+    Compact probabilistic set used to record which contacts appear in an archive. Membership tests can return false
+    positives but never false negatives.
+    """
+
+    def __init__(self, num_bits: int, num_hashes: int, bits: bytearray = None):
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.bits = bits if bits is not None else bytearray((num_bits + 7) // 8)
+
+    @classmethod
+    def for_capacity(cls, capacity: int, error_rate: float = 0.01):
+        capacity = max(capacity, 1)
+        num_bits = max(int(-capacity * math.log(error_rate) / (math.log(2) ** 2)), 8)
+        num_hashes = max(int(round(num_bits / capacity * math.log(2))), 1)
+        return cls(num_bits, num_hashes)
+
+    def _positions(self, value: str):
+        digest = hashlib.blake2b(value.encode("utf-8"), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], "big"), int.from_bytes(digest[8:], "big")
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, value: str):
+        for pos in self._positions(value):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, value: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(value))
+
+    def as_json(self) -> dict:
+        return {
+            "bits": self.num_bits,
+            "hashes": self.num_hashes,
+            "data": base64.standard_b64encode(zlib.compress(bytes(self.bits))).decode(),
+        }
+
+    @classmethod
+    def from_json(cls, data: dict):
+        return cls(data["bits"], data["hashes"], bytearray(zlib.decompress(base64.standard_b64decode(data["data"]))))
+
+
+class PrefetchingReader:
+    """
+    Reads the records of a sequence of archives in order, whilst fetching and decompressing up to `concurrency`
+    archives at a time on a pool of threads. Each archive being read ahead buffers at most `buffer_size` records so
+    memory use is bounded by roughly `concurrency * buffer_size` records.
+    """
+
+    _END = object()
+
+    class _Failure:
+        def __init__(self, error):
+            self.error = error
+
+    def __init__(
+        self,
+        archives,
+        *,
+        where: dict = None,
+        use_indexes: bool = False,
+        concurrency: int = 4,
+        buffer_size: int = 1000,
+    ):
+        self.archives = archives
+        self.where = where
+        self.concurrency = concurrency
+        self.buffer_size = buffer_size
+
+        # indexes are only worth loading if they could rule out archives for these conditions
+        self.use_indexes = use_indexes and bool(where) and ArchiveIndex.can_filter(where)
+
+    def _iter_archive(self, archive):
+        # if we have an index for this archive which says no records can match, skip it without opening it
+        if self.use_indexes and archive.has_index:
+            index = archive.load_index()
+            if index and not index.may_match(self.where):
+                return iter(())
+
+        return archive.iter_records(where=self.where)
+
+    def __iter__(self):
+        if self.concurrency <= 1 or len(self.archives) <= 1:
+            for archive in self.archives:
+                yield from self._iter_archive(archive)
+            return
+
+        stop = threading.Event()
+        queues = [queue.Queue(maxsize=self.buffer_size) for _ in self.archives]
+
+        def put(q, item) -> bool:
+            # blocks until there's room in the queue, giving up if the reader has been closed
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def fetch(archive, q):
+            try:
+                for record in self._iter_archive(archive):
+                    if not put(q, record):
+                        return
+                put(q, self._END)
+            except Exception as e:
+                put(q, self._Failure(e))
+
+        # tasks are started in submission order, so the archive currently being consumed always has a worker
+        executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="archive-reader")
+        try:
+            for archive, q in zip(self.archives, queues):
+                executor.submit(fetch, archive, q)
+
+            for q in queues:
+                while True:
+                    item = q.get()
+                    if item is self._END:
+                        break
+                    if isinstance(item, self._Failure):
+                        raise item.error
+                    yield item
+        finally:
+            stop.set()
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+def jsonlgz_iterate(in_file, *, lazy: bool = False):
+    """
+    Iterates over a records in a gzipped JSONL stream. In lazy mode records are returned as LazyRecord instances which
+    are only decoded when accessed.
     """
     in_stream = gzip.GzipFile(fileobj=in_file, mode="r")
 
     def generator():
-        for line in in_stream:
-            record = json.loads(line.decode("utf-8"))
-            yield record
+        for line in jsonlgz_lines(in_stream):
+            yield LazyRecord(line) if lazy else json.loads(line)
 
     return generator()
 
 
-def jsonlgz_rewrite(in_file, out_file, transform) -> tuple:
+def jsonlgz_lines(in_stream, block_size: int = JSONLGZ_BLOCK_SIZE):
+    """
+    Iterates over the raw lines (without line endings) of a decompressed stream, reading it in large blocks
+    """
+    remainder = b""
+
+    while True:
+        block = in_stream.read(block_size)
+        if not block:
+            break
+
+        lines = (remainder + block).split(b"\n") if remainder else block.split(b"\n")
+        remainder = lines.pop()  # last line is either empty or incomplete
+
+        for line in lines:
+            if line:
+                yield line
+
+    if remainder:
+        yield remainder
+
+
+def jsonlgz_rewrite(in_file, out_file, transform, *, lazy: bool = False) -> tuple:
     """
-    Rewrites a stream of gzipped JSONL using a transformation function and returns the new MD5 hash and size
+    Rewrites a stream of gzipped JSONL using a transformation function and returns the new MD5 hash and size. In lazy
+    mode the transform is given LazyRecord instances and records it doesn't change are written out as-is without being
+    re-encoded.
     """
     out_wrapped = FileAndHash(out_file)
     out_stream = gzip.GzipFile(fileobj=out_wrapped, mode="w")
 
-    for record in jsonlgz_iterate(in_file):
+    for record in jsonlgz_iterate(in_file, lazy=lazy):
         record = transform(record)
-        if record is not None:
-            new_line = (json.dumps(record) + "\n").encode("utf-8")
-            out_stream.write(new_line)
+        if record is None:
+            continue
+
+        if isinstance(record, LazyRecord):
+            new_line = record.encode()
+        else:
+            new_line = json.dumps(record).encode("utf-8")
+
+        out_stream.write(new_line)
+        out_stream.write(b"\n")
 
     out_stream.close()
 
     return out_wrapped.hash, out_wrapped.size
 
 
+def _fast_loads(raw: bytes):
+    return orjson.loads(raw) if orjson else stdlib_json.loads(raw)
+
+
+class LazyRecord(MutableMapping):
+    """
+    A record from a JSONL stream which is only decoded if one of its keys is accessed. Decoding uses orjson if it's
+    installed, so unlike regular records, floats are decoded as floats rather than decimals. Records are re-encoded
+    only if they've been changed. We can't see changes to nested values, so if a dict or list value has been read
+    through the record, it's compared with the original to check whether it's been changed.
+    """
+
+    __slots__ = ("raw", "_data", "_changed", "_nested_read")
+
+    def __init__(self, raw: bytes):
+        self.raw = raw
+        self._data = None
+        self._changed = False
+        self._nested_read = False
+
+    @property
+    def data(self) -> dict:
+        """
+        The decoded record, which can be read without marking the record as changed
+        """
+        if self._data is None:
+            self._data = _fast_loads(self.raw)
+        return self._data
+
+    def is_decoded(self) -> bool:
+        return self._data is not None
+
+    def is_changed(self) -> bool:
+        if not self._changed and self._nested_read:
+            self._changed = self._data != _fast_loads(self.raw)
+            self._nested_read = False
+        return self._changed
+
+    def encode(self) -> bytes:
+        """
+        Encodes this record as JSON, reusing the original bytes if it hasn't been changed
+        """
+        return json.dumps(self._data).encode("utf-8") if self.is_changed() else self.raw
+
+    def __getitem__(self, key):
+        value = self.data[key]
+        if isinstance(value, (dict, list)):
+            self._nested_read = True
+        return value
+
+    def __setitem__(self, key, value):
+        self.data[key] = value
+        self._changed = True
+
+    def __delitem__(self, key):
+        del self.data[key]
+        self._changed = True
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __repr__(self):
+        return f"LazyRecord({self.raw!r})"
+
+
 class FileAndHash:
     """
     Stream which writes to both a child stream and a MD5 hash
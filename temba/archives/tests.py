@@ -3,15 +3,19 @@ import gzip
 import hashlib
 import io
 from datetime import date, datetime, timezone as tzone
+from decimal import Decimal
 from unittest.mock import call, patch
 
+from django_redis import get_redis_connection
+
 from django.urls import reverse
 from django.utils import timezone
 
 from temba.tests import CRUDLTestMixin, TembaTest
 from temba.tests.s3 import MockS3Client
+from temba.utils import json
 
-from .models import Archive, jsonlgz_rewrite
+from .models import Archive, ArchiveIndex, LazyRecord, jsonlgz_iterate, jsonlgz_lines, jsonlgz_rewrite
 
 
 class ArchiveTest(TembaTest):
@@ -92,7 +96,7 @@ class ArchiveTest(TembaTest):
             rollup_of=(d1,),
             s3=mock_s3,
         )
-        self.create_archive(
+        d3 = self.create_archive(
             Archive.TYPE_MSG,
             "D",
             date(2020, 8, 1),
@@ -155,6 +159,137 @@ class ArchiveTest(TembaTest):
             [4, 5],
         )
 
+        # same results regardless of how many archives we read ahead or how much we buffer
+        assert_records(Archive.iter_all_records(self.org, Archive.TYPE_MSG, concurrency=1), [1, 2, 3, 4, 5, 6])
+        assert_records(
+            Archive.iter_all_records(self.org, Archive.TYPE_MSG, concurrency=2, buffer_size=1), [1, 2, 3, 4, 5, 6]
+        )
+        assert_records(
+            Archive.iter_all_records(self.org, Archive.TYPE_MSG, concurrency=10, buffer_size=1), [1, 2, 3, 4, 5, 6]
+        )
+
+        # can stop reading early
+        records_iter = Archive.iter_all_records(self.org, Archive.TYPE_MSG, concurrency=2, buffer_size=1)
+        self.assertEqual(1, next(records_iter)["id"])
+        records_iter.close()
+
+        # errors reading an archive are raised to the consumer once they reach that archive
+        _, key = d3.get_storage_location()
+        del mock_s3.objects[("s3-bucket", key)]
+
+        records_iter = Archive.iter_all_records(self.org, Archive.TYPE_MSG, concurrency=3)
+        self.assertEqual([1, 2], [next(records_iter)["id"], next(records_iter)["id"]])
+        with self.assertRaises(mock_s3.exceptions.NoSuchKey):
+            list(records_iter)
+
+    @patch("temba.utils.s3.client")
+    def test_indexes(self, mock_s3_client):
+        mock_s3 = MockS3Client()
+        mock_s3_client.return_value = mock_s3
+
+        flow1_uuid, flow2_uuid = "2ac5b5b0-4dc7-4a3b-9a3c-1a5b2a8f3f0e", "d0e0e8c1-5b2a-4f7d-a5b3-e1e4b0a36a1d"
+        label_uuid = "1ccf09f6-3fe8-4c0d-a073-981632be5a30"
+        contact1_uuid, contact2_uuid = "6fbf3d32-3f5b-4b0c-9c3f-1f8c3c5e0b1a", "f5a5b7c8-0d9e-4f1a-8b2c-3d4e5f6a7b8c"
+
+        archive1 = self.create_archive(
+            Archive.TYPE_MSG,
+            "D",
+            date(2020, 8, 1),
+            [
+                {
+                    "id": 1,
+                    "created_on": "2020-08-01T10:00:00Z",
+                    "flow": {"uuid": flow1_uuid, "name": "Color"},
+                    "contact": {"uuid": contact1_uuid, "name": "Bob"},
+                    "labels": [{"uuid": label_uuid, "name": "Spam"}],
+                },
+                {
+                    "id": 2,
+                    "created_on": "2020-08-01T15:00:00Z",
+                    "flow": None,
+                    "contact": {"uuid": contact1_uuid, "name": "Bob"},
+                    "labels": [],
+                },
+            ],
+            s3=mock_s3,
+        )
+        archive2 = self.create_archive(
+            Archive.TYPE_MSG,
+            "D",
+            date(2020, 8, 2),
+            [
+                {
+                    "id": 3,
+                    "created_on": "2020-08-02T10:00:00Z",
+                    "flow": {"uuid": flow2_uuid, "name": "Age"},
+                    "contact": {"uuid": contact2_uuid, "name": "Jim"},
+                    "labels": [],
+                }
+            ],
+            s3=mock_s3,
+        )
+
+        # no indexes yet
+        self.assertFalse(archive1.has_index)
+        self.assertIsNone(archive1.load_index())
+
+        index1 = archive1.build_index()
+        archive2.build_index()
+
+        archive1.refresh_from_db()
+        self.assertTrue(archive1.has_index)
+
+        self.assertEqual(index1.as_json(), archive1.load_index().as_json())
+        self.assertEqual(2, index1.record_count)
+        self.assertEqual({flow1_uuid}, index1.flows)
+        self.assertEqual({label_uuid}, index1.labels)
+        self.assertIn(contact1_uuid, index1.contacts)
+
+        self.assertTrue(index1.may_match({"visibility": "visible"}))
+        self.assertTrue(index1.may_match({"flow__uuid__in": [flow1_uuid, flow2_uuid]}))
+        self.assertFalse(index1.may_match({"flow__uuid__in": [flow2_uuid]}))
+        self.assertTrue(index1.may_match({"contact__uuid": contact1_uuid}))
+        self.assertTrue(index1.may_match({"__raw__": f"'{label_uuid}' IN s.labels[*].uuid[*]"}))
+        self.assertFalse(index1.may_match({"__raw__": "'f7f4d3b1-5c5a-4c86-8a8f-9d2a6c3a1b2e' IN s.labels[*].uuid[*]"}))
+        self.assertTrue(index1.may_match({"__raw__": "s.id < 3"}))
+        self.assertTrue(index1.may_match({"created_on__gte": datetime(2020, 8, 1, 12, 0, 0, 0, tzone.utc)}))
+        self.assertFalse(index1.may_match({"created_on__gte": datetime(2020, 8, 1, 16, 0, 0, 0, tzone.utc)}))
+        self.assertFalse(index1.may_match({"created_on__lte": datetime(2020, 8, 1, 9, 0, 0, 0, tzone.utc)}))
+
+        self.assertTrue(ArchiveIndex.can_filter({"visibility": "visible", "flow__uuid": flow1_uuid}))
+        self.assertTrue(ArchiveIndex.can_filter({"__raw__": f"'{label_uuid}' IN s.labels[*].uuid[*]"}))
+        self.assertFalse(ArchiveIndex.can_filter({"visibility": "visible", "__raw__": "s.id < 3"}))
+
+        def assert_records(record_iter, ids):
+            self.assertEqual(ids, [r["id"] for r in list(record_iter)])
+
+        # archives which can't contain matching records are skipped without being opened
+        num_selects = len(mock_s3.calls["select_object_content"])
+
+        assert_records(
+            Archive.iter_all_records(self.org, Archive.TYPE_MSG, where={"flow__uuid__in": [flow2_uuid]}), [3]
+        )
+        self.assertEqual(num_selects + 1, len(mock_s3.calls["select_object_content"]))
+
+        assert_records(
+            Archive.iter_all_records(
+                self.org, Archive.TYPE_MSG, where={"__raw__": f"'{label_uuid}' IN s.labels[*].uuid[*]"}
+            ),
+            [1],
+        )
+        self.assertEqual(num_selects + 2, len(mock_s3.calls["select_object_content"]))
+
+        # indexes aren't loaded for conditions they can't rule archives out by
+        num_gets = len(mock_s3.calls["get_object"])
+
+        assert_records(Archive.iter_all_records(self.org, Archive.TYPE_MSG, where={"contact__name": "Bob"}), [1, 2])
+        self.assertEqual(num_gets, len(mock_s3.calls["get_object"]))
+
+        # deleting an archive deletes its index too
+        archive1.delete()
+
+        self.assertEqual({archive2.get_storage_location(), archive2.get_index_location()}, set(mock_s3.objects.keys()))
+
     def test_end_date(self):
         daily = self.create_archive(Archive.TYPE_FLOWRUN, "D", date(2018, 2, 1), [], needs_deletion=True)
         monthly = self.create_archive(Archive.TYPE_FLOWRUN, "M", date(2018, 1, 1), [])
@@ -193,7 +328,7 @@ class ArchiveTest(TembaTest):
 
         bucket, new_key = archive.get_storage_location()
         self.assertNotEqual(key, new_key)
-        self.assertEqual({(bucket, new_key)}, set(mock_s3.objects.keys()))
+        self.assertEqual({(bucket, new_key), (bucket, new_key + ".index.json")}, set(mock_s3.objects.keys()))
 
         self.assertEqual(32, len(archive.hash))
         self.assertEqual(
@@ -201,14 +336,170 @@ class ArchiveTest(TembaTest):
         )
 
         hash_b64 = base64.standard_b64encode(bytes.fromhex(archive.hash)).decode()
+        upload_key = f"{self.org.id}/run_{archive.id}_rewrite.jsonl.gz"
+
+        # new file was uploaded in a single part and then copied to its final location
+        self.assertEqual(1, len(mock_s3.calls["upload_part"]))
+        self.assertEqual(
+            [
+                call(
+                    CopySource={"Bucket": "s3-bucket", "Key": upload_key},
+                    Bucket="s3-bucket",
+                    Key=f"{self.org.id}/run_D20200801_{archive.hash}.jsonl.gz",
+                    ExtraArgs={
+                        "ContentType": "application/json",
+                        "ContentEncoding": "gzip",
+                        "ACL": "private",
+                        "Metadata": {"md5chksum": hash_b64},
+                        "MetadataDirective": "REPLACE",
+                    },
+                )
+            ],
+            mock_s3.calls["copy"],
+        )
+        self.assertEqual(
+            [
+                call(Bucket="s3-bucket", Key=upload_key),
+                call(Bucket="s3-bucket", Key=key),
+                call(Bucket="s3-bucket", Key=key + ".index.json"),
+            ],
+            mock_s3.calls["delete_object"],
+        )
+
+        new_body = mock_s3.objects[(bucket, new_key)].getvalue()
+        self.assertEqual(hashlib.md5(new_body).hexdigest(), archive.hash)
+        self.assertEqual(len(new_body), archive.size)
+        self.assertEqual([1, 3], [r["id"] for r in archive.iter_records()])
+
+        # rewriting also indexes the remaining records
+        index = archive.load_index()
+        self.assertEqual(2, index.record_count)
+        self.assertEqual(datetime(2020, 8, 1, 9, 0, 0, 0, tzone.utc), index.min_created_on)
+        self.assertEqual(datetime(2020, 8, 1, 15, 0, 0, 0, tzone.utc), index.max_created_on)
+
+        # in lazy mode, records which aren't changed are written out as they were, and the index is built afterwards
+        old_lines = gzip.decompress(new_body).splitlines()
+
+        archive.rewrite(lambda r: None if r["id"] == 3 else r, lazy=True)
+
+        bucket, new_key = archive.get_storage_location()
+        self.assertEqual(old_lines[:1], gzip.decompress(mock_s3.objects[(bucket, new_key)].getvalue()).splitlines())
+        self.assertEqual(1, archive.load_index().record_count)
+
+    @patch("temba.utils.s3.client")
+    def test_rewrite_resume(self, mock_s3_client):
+        mock_s3 = MockS3Client()
+        mock_s3_client.return_value = mock_s3
+
+        # use records with some incompressible content so that compressed output is emitted steadily
+        records = [
+            {
+                "id": i,
+                "uuid": hashlib.sha512(str(i).encode()).hexdigest(),
+                "created_on": "2020-08-01T09:00:00Z",
+                "contact": {"name": "Bob" if i % 3 else "Jim"},
+            }
+            for i in range(1, 1001)
+        ]
+        archive = self.create_archive(Archive.TYPE_FLOWRUN, "D", date(2020, 8, 1), records, s3=mock_s3)
+        bucket, key = archive.get_storage_location()
+
+        def purge_jim(record):
+            return record if record["contact"]["name"] != "Jim" else None
+
+        def purge_jim_then_crash(record):
+            if record["id"] == 700:
+                raise ValueError("boom")
+            return purge_jim(record)
+
+        # use a tiny part size so that we upload parts before crashing
+        with self.assertRaises(ValueError):
+            archive.rewrite(purge_jim_then_crash, part_size=5000)
+
+        self.assertGreaterEqual(len(mock_s3.calls["upload_part"]), 1)
+        self.assertEqual(1, len(mock_s3.calls["create_multipart_upload"]))
+
+        # archive itself is unchanged
+        archive.refresh_from_db()
+        self.assertEqual(key, archive.get_storage_location()[1])
+
+        # resuming continues the same upload from the last checkpoint
+        archive.rewrite(purge_jim, part_size=5000, delete_old=True)
+
+        self.assertEqual(1, len(mock_s3.calls["create_multipart_upload"]))
+        self.assertEqual(1, len(mock_s3.calls["complete_multipart_upload"]))
+
+        bucket, new_key = archive.get_storage_location()
+        new_body = mock_s3.objects[(bucket, new_key)].getvalue()
+
+        self.assertEqual(hashlib.md5(new_body).hexdigest(), archive.hash)
+        self.assertEqual(len(new_body), archive.size)
+        self.assertEqual([r["id"] for r in records if r["id"] % 3], [r["id"] for r in archive.iter_records()])
+        self.assertEqual(667, archive.load_index().record_count)
+
+        # checkpoint has been cleared so rewriting again starts a new upload
+        archive.rewrite(purge_jim, part_size=5000)
+
+        self.assertEqual(2, len(mock_s3.calls["create_multipart_upload"]))
+
+    @patch("temba.utils.s3.client")
+    def test_rewrite_abort(self, mock_s3_client):
+        mock_s3 = MockS3Client()
+        mock_s3_client.return_value = mock_s3
+        r = get_redis_connection()
+
+        records = [{"id": i, "created_on": "2020-08-01T09:00:00Z", "contact": {"name": "Bob"}} for i in range(1, 11)]
+        archive = self.create_archive(Archive.TYPE_FLOWRUN, "D", date(2020, 8, 1), records, s3=mock_s3)
+        bucket, key = archive.get_storage_location()
+        checkpoint_key = f"archive_rewrite:{archive.id}"
+
+        def crash(record):
+            raise ValueError("boom")
+
+        # checkpoint is saved as soon as the upload is created, even if we crash before uploading any parts
+        with self.assertRaises(ValueError):
+            archive.rewrite(crash)
+
+        self.assertEqual(0, len(mock_s3.calls["upload_part"]))
+        self.assertEqual("upload1", json.loads(r.get(checkpoint_key))["upload_id"])
+        self.assertEqual(-1, r.ttl(checkpoint_key))  # and doesn't expire
+
+        # so the next attempt resumes that upload rather than starting another
+        with self.assertRaises(ValueError):
+            archive.rewrite(crash)
+
+        self.assertEqual(1, len(mock_s3.calls["create_multipart_upload"]))
+
+        # a checkpoint for a previous version of the archive has its upload aborted
+        new_key = key.replace("run_D", "run_M")
+        mock_s3.objects[(bucket, new_key)] = mock_s3.objects[(bucket, key)]
+        archive.url = f"https://{bucket}.s3.amazonaws.com/{new_key}"
+        archive.save(update_fields=("url",))
+
+        with self.assertRaises(ValueError):
+            archive.rewrite(crash)
+
+        self.assertEqual(
+            [call(Bucket=bucket, Key=f"{self.org.id}/run_{archive.id}_rewrite.jsonl.gz", UploadId="upload1")],
+            mock_s3.calls["abort_multipart_upload"],
+        )
+        self.assertEqual({"upload2"}, set(mock_s3.uploads.keys()))
+        self.assertEqual("upload2", json.loads(r.get(checkpoint_key))["upload_id"])
+
+        # if the upload has gone, e.g. aborted by a lifecycle rule, the rewrite can't be resumed so it's abandoned
+        del mock_s3.uploads["upload2"]
+
+        with self.assertRaises(mock_s3.exceptions.NoSuchUpload):
+            archive.rewrite(lambda rec: rec)
+
+        self.assertIsNone(r.get(checkpoint_key))
 
-        self.assertEqual(2, len(mock_s3.calls["put_object"]))
+        # and the next attempt starts afresh
+        archive.rewrite(lambda rec: rec)
 
-        kwargs = mock_s3.calls["put_object"][1][2]
-        self.assertEqual("s3-bucket", kwargs["Bucket"])
-        self.assertEqual(f"{self.org.id}/run_D20200801_{archive.hash}.jsonl.gz", kwargs["Key"])
-        self.assertEqual(hash_b64, kwargs["ContentMD5"])
-        self.assertEqual([call(Bucket="s3-bucket", Key=key)], mock_s3.calls["delete_object"])
+        self.assertEqual(3, len(mock_s3.calls["create_multipart_upload"]))
+        self.assertIsNone(r.get(checkpoint_key))
+        self.assertEqual([1, 2, 3, 4, 5, 6, 7, 8, 9, 10], [rec["id"] for rec in archive.iter_records()])
 
 
 class ArchiveCRUDLTest(TembaTest, CRUDLTestMixin):
@@ -308,3 +599,83 @@ class JSONLGZTest(TembaTest):
         self.assertEqual(b'{"id": 123, "name": "Jim"}\n{"id": 345, "name": "Ann"}\n', gzip.decompress(data4))
         self.assertEqual(hashlib.md5(data4).hexdigest(), hash4)
         self.assertEqual(58, size4)
+
+    def test_jsonlgz_iterate(self):
+        data = b'{"id": 123, "amount": 1.5}\n{"id":234,"contact":{"name":"Bob"}}\n\n{"id": 345}'
+        gzipped = gzip.compress(data)
+
+        self.assertEqual(
+            [{"id": 123, "amount": Decimal("1.5")}, {"id": 234, "contact": {"name": "Bob"}}, {"id": 345}],
+            list(jsonlgz_iterate(io.BytesIO(gzipped))),
+        )
+
+        # lines can span blocks and empty lines are ignored
+        self.assertEqual(
+            [b'{"id": 123, "amount": 1.5}', b'{"id":234,"contact":{"name":"Bob"}}', b'{"id": 345}'],
+            list(jsonlgz_lines(io.BytesIO(data), block_size=7)),
+        )
+
+        # in lazy mode records aren't decoded until they're accessed
+        records = list(jsonlgz_iterate(io.BytesIO(gzipped), lazy=True))
+
+        self.assertEqual(3, len(records))
+        self.assertIsInstance(records[0], LazyRecord)
+        self.assertFalse(records[0].is_decoded())
+        self.assertEqual(123, records[0]["id"])
+        self.assertTrue(records[0].is_decoded())
+        self.assertFalse(records[0].is_changed())
+        self.assertEqual({"id": 234, "contact": {"name": "Bob"}}, dict(records[1]))
+
+        # reading nested values doesn't count as a change unless they're modified
+        self.assertEqual("Bob", records[1]["contact"]["name"])
+        self.assertFalse(records[1].is_changed())
+
+        records[1]["contact"]["name"] = "Robert"
+        self.assertTrue(records[1].is_changed())
+
+    def test_jsonlgz_rewrite_lazy(self):
+        def rewrite(b: bytes, transform):
+            in_file = io.BytesIO(b)
+            out_file = io.BytesIO()
+            md5, size = jsonlgz_rewrite(in_file, out_file, transform, lazy=True)
+            return gzip.decompress(out_file.getvalue())
+
+        data = b'{"id":123,"contact":{"name":"Jim"}}\n{"id":234,"contact":{"name":"Bob"}}\n{"id":345,"contact":null}\n'
+        gzipped = gzip.compress(data)
+
+        # records which aren't changed are written as they were
+        self.assertEqual(data, rewrite(gzipped, lambda r: r))
+        self.assertEqual(data, rewrite(gzipped, lambda r: r if r["id"] > 0 else None))
+
+        # records which are changed are re-encoded
+        def rename_345(record):
+            if record["id"] == 345:
+                record["contact"] = {"name": "Ann"}
+            return record
+
+        self.assertEqual(
+            b'{"id":123,"contact":{"name":"Jim"}}\n{"id":234,"contact":{"name":"Bob"}}\n'
+            b'{"id": 345, "contact": {"name": "Ann"}}\n',
+            rewrite(gzipped, rename_345),
+        )
+
+        # reading nested values isn't a change, but modifying them is
+        self.assertEqual(data, rewrite(gzipped, lambda r: r if r["contact"] is None or r["contact"]["name"] else None))
+
+        def rename_bob(record):
+            if record["id"] == 234 and record["contact"]["name"] == "Bob":
+                record["contact"]["name"] = "Robert"
+            return record
+
+        self.assertEqual(
+            b'{"id":123,"contact":{"name":"Jim"}}\n{"id": 234, "contact": {"name": "Robert"}}\n{"id":345,"contact":null}\n',
+            rewrite(gzipped, rename_bob),
+        )
+
+        # records can be replaced or removed
+        def replace_and_remove(record):
+            if record["id"] == 123:
+                return {"id": 123}
+            return None if record["id"] == 234 else record
+
+        self.assertEqual(b'{"id": 123}\n{"id":345,"contact":null}\n', rewrite(gzipped, replace_and_remove))
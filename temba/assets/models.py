@@ -79,7 +79,7 @@ class BaseAssetStore:
             raise AssetFileNotFound()
 
         # create a more friendly download filename
-        remainder, extension = path.rsplit(".", 1)
+        extension = os.path.basename(path).split(".", 1)[1]  # keep multi-part extensions like csv.gz
         filename = f"{self.key}_{pk}_{slugify(asset.org.name)}.{extension}"
 
         # if our storage backend is S3
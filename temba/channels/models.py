@@ -786,35 +786,6 @@ class ChannelCount(SquashableModel):
         counts = cls.objects.filter(channel=channel, count_type=count_type, day=day).order_by("day", "count_type")
         return cls.sum(counts)
 
-    @classmethod
-    def get_squash_query(cls, distinct_set):
-        if distinct_set.day:
-            sql = """
-            WITH removed as (
-                DELETE FROM %(table)s WHERE "channel_id" = %%s AND "count_type" = %%s AND "day" = %%s RETURNING "count"
-            )
-            INSERT INTO %(table)s("channel_id", "count_type", "day", "count", "is_squashed")
-            VALUES (%%s, %%s, %%s, GREATEST(0, (SELECT SUM("count") FROM removed)), TRUE);
-            """ % {
-                "table": cls._meta.db_table
-            }
-
-            params = (distinct_set.channel_id, distinct_set.count_type, distinct_set.day) * 2
-        else:
-            sql = """
-            WITH removed as (
-                DELETE FROM %(table)s WHERE "channel_id" = %%s AND "count_type" = %%s AND "day" IS NULL RETURNING "count"
-            )
-            INSERT INTO %(table)s("channel_id", "count_type", "day", "count", "is_squashed")
-            VALUES (%%s, %%s, NULL, GREATEST(0, (SELECT SUM("count") FROM removed)), TRUE);
-            """ % {
-                "table": cls._meta.db_table
-            }
-
-            params = (distinct_set.channel_id, distinct_set.count_type) * 2
-
-        return sql, params
-
     class Meta:
         indexes = [
             models.Index(fields=("channel", "count_type", "day", "is_squashed")),
@@ -123,7 +123,7 @@ def trim_channel_logs():
 
 @cron_task(lock_timeout=7200)
 def squash_channel_counts():
-    ChannelCount.squash()
+    return {"ChannelCount": ChannelCount.squash_all()}
 
 
 @cron_task(lock_timeout=7200)
@@ -0,0 +1,152 @@
+import random
+import time
+from datetime import datetime, timedelta, timezone as tzone
+from uuid import uuid4
+
+from django.core.management.base import BaseCommand
+
+from temba.contacts.models import Contact, ContactField, ContactURN, ExportContactsTask
+from temba.orgs.models import Org
+
+# the URN columns to export as scheme and max number of URNs of that scheme per contact
+URN_COLUMNS = {"tel": 3, "whatsapp": 1}
+
+
+class Command(BaseCommand):  # pragma: no cover
+    help = "Benchmarks extracting column values from contacts for contact exports"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--org", type=int, help="ID of org to use for formatting (defaults to first org)")
+        parser.add_argument("--contacts", type=int, default=100_000, help="Number of contacts to export")
+        parser.add_argument("--cols", type=int, default=80, help="Number of columns per contact")
+
+    def handle(self, org: int, contacts: int, cols: int, **options):
+        org = Org.objects.get(id=org) if org else Org.objects.order_by("id").first()
+        rand = random.Random(123)
+
+        task = ExportContactsTask(org=org)
+        fields = self._generate_fields(org, cols)
+        contact_templates = [self._generate_contact(rand, org, i, fields) for i in range(1000)]
+
+        def generate_contacts():
+            for c in range(contacts):
+                yield contact_templates[c % len(contact_templates)]
+
+        def legacy():
+            for contact in generate_contacts():
+                [self._legacy_field_value(task, f, contact) for f in fields]
+
+        def compiled():
+            extractors = task._get_value_extractors(fields)
+            for contact in generate_contacts():
+                urns_by_scheme = task._bucket_urns(contact)
+                [extract(contact, urns_by_scheme) for extract in extractors]
+
+        self.stdout.write(f"Extracting {contacts} contacts x {len(fields)} columns...")
+
+        self._bench("legacy", contacts, legacy)
+        self._bench("compiled", contacts, compiled)
+
+    def _bench(self, name: str, num: int, fn):
+        start = time.perf_counter()
+        fn()
+        time_taken = time.perf_counter() - start
+
+        self.stdout.write(f" > {name}: {time_taken:.2f}s ({int(num / time_taken)} contacts/s)")
+
+    def _generate_fields(self, org, cols: int) -> list:
+        fields = [
+            dict(label="Contact UUID", key="uuid", field=None, urn_scheme=None),
+            dict(label="Name", key="name", field=None, urn_scheme=None),
+            dict(label="Language", key="language", field=None, urn_scheme=None),
+            dict(label="Status", key="status", field=None, urn_scheme=None),
+            dict(label="Created On", key="created_on", field=None, urn_scheme=None),
+            dict(label="Last Seen On", key="last_seen_on", field=None, urn_scheme=None),
+        ]
+        for scheme, max_urns in URN_COLUMNS.items():
+            for i in range(max_urns):
+                fields.append(
+                    dict(label=f"URN:{scheme.capitalize()}", key=None, field=None, urn_scheme=scheme, position=i)
+                )
+
+        value_types = (
+            ContactField.TYPE_TEXT,
+            ContactField.TYPE_TEXT,
+            ContactField.TYPE_NUMBER,
+            ContactField.TYPE_DATETIME,
+        )
+        for i in range(max(cols - len(fields), 0)):
+            field = ContactField(
+                org=org, uuid=uuid4(), key=f"field_{i}", name=f"Field {i}", value_type=value_types[i % len(value_types)]
+            )
+            fields.append(dict(label=f"Field:{field.name}", key=field.key, field=field, urn_scheme=None))
+
+        return fields
+
+    def _generate_contact(self, rand, org, num: int, fields: list) -> Contact:
+        created_on = datetime(2024, 1, 1, tzinfo=tzone.utc) + timedelta(minutes=num)
+        contact = Contact(
+            org=org,
+            id=num + 1,
+            uuid=uuid4(),
+            name=f"Contact {num}" if rand.random() < 0.9 else None,
+            language="eng",
+            status=Contact.STATUS_ACTIVE,
+            created_on=created_on,
+            last_seen_on=created_on,
+            fields={},
+        )
+
+        for f in fields:
+            field = f["field"]
+            if not field or rand.random() < 0.3:
+                continue
+
+            if field.value_type == ContactField.TYPE_TEXT:
+                value = {"text": f"Value {num}"}
+            elif field.value_type == ContactField.TYPE_NUMBER:
+                value = {"text": str(num), "number": num}
+            else:
+                value = {"text": created_on.isoformat(), "datetime": created_on.isoformat()}
+            contact.fields[str(field.uuid)] = value
+
+        urns = []
+        for scheme, max_urns in URN_COLUMNS.items():
+            for i in range(rand.randint(0, max_urns)):
+                path = f"+2507{rand.randint(10000000, 99999999)}"
+                urns.append(
+                    ContactURN(org=org, scheme=scheme, path=path, identity=f"{scheme}:{path}", priority=1000 - i)
+                )
+
+        contact._urns_cache = urns
+        return contact
+
+    def _legacy_field_value(self, task, field: dict, contact):
+        """
+        The per-cell key comparisons that exports used before columns were compiled into extractors
+        """
+        if field["key"] == "name":
+            return contact.name
+        elif field["key"] == "uuid":
+            return contact.uuid
+        elif field["key"] == "language":
+            return contact.language
+        elif field["key"] == "status":
+            return contact.get_status_display()
+        elif field["key"] == "created_on":
+            return contact.created_on
+        elif field["key"] == "last_seen_on":
+            return contact.last_seen_on
+        elif field["key"] == "id":
+            return str(contact.id)
+        elif field["key"] == "scheme":
+            contact_urns = contact.get_urns()
+            return contact_urns[0].scheme if contact_urns else ""
+        elif field["urn_scheme"] is not None:
+            scheme_urns = [u for u in contact.get_urns() if u.scheme == field["urn_scheme"]]
+            position = field["position"]
+            if len(scheme_urns) > position:
+                return scheme_urns[position].get_display(org=task.org, formatted=False)
+            return ""
+        else:
+            return contact.get_field_display(field["field"])
@@ -0,0 +1,68 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from temba.contacts.models import URN
+from temba.utils import chunk_list
+
+# prefixes of local numbers for a few countries and how those numbers are formatted in the wild
+COUNTRIES = {"RW": ("078", "+25078"), "KE": ("07", "+2547"), "US": ("(206) ", "+1206"), "EC": ("09", "+5939")}
+
+
+class Command(BaseCommand):  # pragma: no cover
+    help = "Benchmarks URN normalization with and without the normalization caches"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--numbers", type=int, default=1_000_000, help="Number of URNs to normalize")
+        parser.add_argument("--unique", type=int, default=200_000, help="Number of distinct URNs in the corpus")
+
+    def handle(self, numbers: int, unique: int, **options):
+        rand = random.Random(123)
+        distinct = [self._generate_urn(rand) for _ in range(unique)]
+        corpus = [distinct[rand.randrange(unique)] for _ in range(numbers)]
+
+        self.stdout.write(f"Normalizing {numbers} URNs ({unique} distinct)...")
+
+        def uncached():
+            for urn, country in corpus:
+                URN.clear_caches()
+                URN.normalize(urn, country)
+
+        def cached():
+            for urn, country in corpus:
+                URN.normalize(urn, country)
+
+        def many():
+            for batch in chunk_list(corpus, 1000):
+                by_country = {}
+                for urn, country in batch:
+                    by_country.setdefault(country, []).append(urn)
+                for country, urns in by_country.items():
+                    URN.normalize_many(urns, country)
+
+        self._bench("uncached", numbers, uncached)
+        self._bench("cached", numbers, cached)
+        self._bench("normalize_many", numbers, many)
+
+    def _bench(self, name: str, num: int, fn):
+        URN.clear_caches()
+
+        start = time.perf_counter()
+        fn()
+        time_taken = time.perf_counter() - start
+
+        hit_rate = URN.get_cache_stats()["normalize"]["hit_rate"]
+
+        self.stdout.write(
+            f" > {name}: {time_taken:.2f}s ({int(num / time_taken)} URNs/s, {time_taken * 1_000_000 / num:.1f}µs/URN, "
+            f"hit rate {hit_rate:.0%})"
+        )
+
+    def _generate_urn(self, rand) -> tuple[str, str]:
+        country = rand.choice(tuple(COUNTRIES.keys()))
+        local_prefix, intl_prefix = COUNTRIES[country]
+        digits = "".join(rand.choice("0123456789") for _ in range(7))
+        number = (local_prefix if rand.random() < 0.5 else intl_prefix) + digits
+
+        return URN.from_tel(number), country
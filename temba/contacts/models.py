@@ -1,8 +1,13 @@
+import functools
+import heapq
 import logging
+import threading
 import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, datetime, timedelta, timezone as tzone
 from decimal import Decimal
-from itertools import chain
+from itertools import islice
 from pathlib import Path
 from typing import Any
 
@@ -17,7 +22,7 @@ from smartmin.models import SmartModel
 from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.core.validators import validate_email
-from django.db import IntegrityError, models, transaction
+from django.db import IntegrityError, close_old_connections, connection, models, transaction
 from django.db.models import Count, F, Max, Q, Sum, Value
 from django.db.models.functions import Concat, Lower
 from django.utils import timezone
@@ -29,9 +34,9 @@ from temba.channels.models import Channel, ChannelEvent
 from temba.locations.models import AdminBoundary
 from temba.mailroom import ContactSpec, modifiers, queue_populate_dynamic_group
 from temba.orgs.models import DependencyMixin, Org, OrgRole
-from temba.utils import chunk_list, format_number, on_transaction_commit
-from temba.utils.export import BaseExport, BaseExportAssetStore, MultiSheetExporter
-from temba.utils.models import JSONField, LegacyUUIDMixin, SquashableModel, TembaModel
+from temba.utils import chunk_list, format_number, json, on_transaction_commit, read_ahead
+from temba.utils.export import BaseExport, BaseExportAssetStore
+from temba.utils.models import CountCache, JSONField, LegacyUUIDMixin, SquashableModel, TembaModel
 from temba.utils.text import decode_stream, unsnakify
 from temba.utils.urns import ParsedURN, parse_number, parse_urn
 from temba.utils.uuid import uuid4
@@ -40,6 +45,35 @@ from .search import SearchException, elastic, parse_query
 
 logger = logging.getLogger(__name__)
 
+# redis key prefix for cached events of ended sessions
+SESSION_EVENTS_KEY = "session_events"
+
+_history_executor = None
+_history_executor_lock = threading.Lock()
+
+
+def fetch_history_sources(sources: list) -> list:
+    """
+    Fetches the items of the given contact history sources, concurrently if history workers are enabled. Sources are
+    always read from the default database so that history includes anything just created.
+    """
+    global _history_executor
+
+    if not settings.CONTACT_HISTORY_WORKERS:
+        return [source() for source in sources]
+
+    with _history_executor_lock:
+        if _history_executor is None:
+            _history_executor = ThreadPoolExecutor(
+                max_workers=settings.CONTACT_HISTORY_WORKERS, thread_name_prefix="contact-history"
+            )
+
+    def fetch(source) -> list:
+        close_old_connections()  # worker threads don't get the request cycle's connection cleanup
+        return source()
+
+    return [f.result() for f in [_history_executor.submit(fetch, s) for s in sources]]
+
 
 class URN:
     """
@@ -99,6 +133,9 @@ class URN:
 
     FACEBOOK_PATH_REF_PREFIX = "ref:"
 
+    # size of the LRU caches of normalized and validated URNs, as parsing phone numbers is expensive
+    CACHE_SIZE = 50_000
+
     def __init__(self):  # pragma: no cover
         raise ValueError("Class shouldn't be instantiated")
 
@@ -156,10 +193,15 @@ class URN:
         return path
 
     @classmethod
-    def validate(cls, urn, country_code=None):
+    def validate(cls, urn, country_code=None) -> bool:
         """
         Validates a normalized URN
         """
+        return cls._validate(urn, country_code or None)
+
+    @classmethod
+    @functools.lru_cache(maxsize=CACHE_SIZE)
+    def _validate(cls, urn, country_code) -> bool:
         try:
             scheme, path, query, display = cls.to_parts(urn)
         except ValueError:
@@ -174,13 +216,13 @@ class URN:
 
         # validate twitter URNs look like handles
         elif scheme == cls.TWITTER_SCHEME:
-            return regex.match(r"^[a-zA-Z0-9_]{1,15}$", path, regex.V0)
+            return bool(regex.match(r"^[a-zA-Z0-9_]{1,15}$", path, regex.V0))
 
         # validate path is a number and display is a handle if present
         elif scheme == cls.TWITTERID_SCHEME:
             valid = path.isdigit()
             if valid and display:
-                valid = regex.match(r"^[a-zA-Z0-9_]{1,15}$", display, regex.V0)
+                valid = bool(regex.match(r"^[a-zA-Z0-9_]{1,15}$", display, regex.V0))
 
             return valid
 
@@ -207,18 +249,20 @@ class URN:
 
         # telegram, whatsapp and instagram use integer ids
         elif scheme in [cls.TELEGRAM_SCHEME, cls.WHATSAPP_SCHEME, cls.INSTAGRAM_SCHEME]:
-            return regex.match(r"^[0-9]+$", path, regex.V0)
+            return bool(regex.match(r"^[0-9]+$", path, regex.V0))
 
         # validate Viber URNS look right (this is a guess)
         elif scheme == cls.VIBER_SCHEME:  # pragma: needs cover
-            return regex.match(r"^[a-zA-Z0-9_=+/]{1,24}$", path, regex.V0)
+            return bool(regex.match(r"^[a-zA-Z0-9_=+/]{1,24}$", path, regex.V0))
 
         # validate Freshchat URNS look right (this is a guess)
         elif scheme == cls.FRESHCHAT_SCHEME:  # pragma: needs cover
-            return regex.match(
-                r"^[0-9a-fA-F]{8}\-[0-9a-fA-F]{4}\-[0-9a-fA-F]{4}\-[0-9a-fA-F]{4}\-[0-9a-fA-F]{12}/[0-9a-fA-F]{8}\-[0-9a-fA-F]{4}\-[0-9a-fA-F]{4}\-[0-9a-fA-F]{4}\-[0-9a-fA-F]{12}$",
-                path,
-                regex.V0,
+            return bool(
+                regex.match(
+                    r"^[0-9a-fA-F]{8}\-[0-9a-fA-F]{4}\-[0-9a-fA-F]{4}\-[0-9a-fA-F]{4}\-[0-9a-fA-F]{12}/[0-9a-fA-F]{8}\-[0-9a-fA-F]{4}\-[0-9a-fA-F]{4}\-[0-9a-fA-F]{4}\-[0-9a-fA-F]{12}$",
+                    path,
+                    regex.V0,
+                )
             )
         # Discord IDs are snowflakes, which are int64s internally
         elif scheme == cls.DISCORD_SCHEME:
@@ -236,9 +280,31 @@ class URN:
         """
         Normalizes the path of a URN string. Should be called anytime looking for a URN match.
         """
-        scheme, path, query, display = cls.to_parts(urn)
+        return cls._normalize(urn, str(country_code) if country_code else "")
 
+    @classmethod
+    def normalize_many(cls, urns, country_code=None) -> list:
+        """
+        Normalizes a list of URN strings, only normalizing each distinct URN once. URNs which can't be parsed are
+        returned unchanged.
+        """
         country_code = str(country_code) if country_code else ""
+        normalized = {}
+
+        for urn in urns:
+            if urn not in normalized:
+                try:
+                    normalized[urn] = cls._normalize(urn, country_code)
+                except ValueError:
+                    normalized[urn] = urn
+
+        return [normalized[urn] for urn in urns]
+
+    @classmethod
+    @functools.lru_cache(maxsize=CACHE_SIZE)
+    def _normalize(cls, urn, country_code: str):
+        scheme, path, query, display = cls.to_parts(urn)
+
         norm_path = str(path).strip()
 
         if scheme == cls.TEL_SCHEME:
@@ -266,7 +332,11 @@ class URN:
         Normalizes the passed in number, they should be only digits, some backends prepend + and
         maybe crazy users put in dashes or parentheses in the console.
         """
+        return cls._normalize_number(number, country_code or "")
 
+    @classmethod
+    @functools.lru_cache(maxsize=CACHE_SIZE)
+    def _normalize_number(cls, number: str, country_code: str):
         number = number.strip()
         normalized = number.lower()
 
@@ -291,6 +361,33 @@ class URN:
 
         return formatted
 
+    @classmethod
+    def get_cache_stats(cls) -> dict:
+        """
+        Gets the hits, misses and sizes of our normalization and validation caches
+        """
+        stats = {}
+        for name, func in (
+            ("normalize", cls._normalize),
+            ("normalize_number", cls._normalize_number),
+            ("validate", cls._validate),
+        ):
+            info = func.cache_info()
+            lookups = info.hits + info.misses
+            stats[name] = {
+                "hits": info.hits,
+                "misses": info.misses,
+                "size": info.currsize,
+                "hit_rate": info.hits / lookups if lookups else 0.0,
+            }
+        return stats
+
+    @classmethod
+    def clear_caches(cls):
+        cls._normalize.cache_clear()
+        cls._normalize_number.cache_clear()
+        cls._validate.cache_clear()
+
     @classmethod
     def identity(cls, urn):
         scheme, path, query, display = URN.to_parts(urn)
@@ -767,90 +864,112 @@ class Contact(LegacyUUIDMixin, SmartModel):
         """
         Gets this contact's history of messages, calls, runs etc in the given time window
         """
+        from temba.mailroom.events import get_event_time
+
+        sources = self._get_history_sources(after, before, include_event_types, ticket, limit)
+
+        # each source is already ordered by event time so we can merge them, and stop once we have enough items
+        merged = heapq.merge(*fetch_history_sources(sources), key=get_event_time, reverse=True)
+        return list(islice(merged, limit))
+
+    def has_history(self, after: datetime, before: datetime, include_event_types: set, ticket) -> bool:
+        """
+        Gets whether this contact has any history in the given time window, querying sources until one has an item
+        """
+        for source in self._get_history_sources(after, before, include_event_types, ticket, 1):
+            if source():
+                return True
+
+        return False
+
+    def _get_history_sources(self, after: datetime, before: datetime, include_event_types: set, ticket, limit: int):
+        """
+        Gets the sources of history items as functions which return at most limit items, ordered by event time (newest
+        first). Items with the same event time keep their source order, and sources are ordered to break ties in the
+        same way.
+        """
         from temba.flows.models import FlowExit
         from temba.ivr.models import Call
         from temba.mailroom.events import get_event_time
         from temba.msgs.models import Msg
         from temba.tickets.models import TicketEvent
 
-        msgs = (
-            self.msgs.filter(created_on__gte=after, created_on__lt=before)
-            .exclude(status=Msg.STATUS_PENDING)
-            .order_by("-created_on", "-id")
-            .select_related("channel", "contact_urn", "broadcast", "optin")[:limit]
-        )
+        def msgs() -> list:
+            return list(
+                self.msgs.filter(created_on__gte=after, created_on__lt=before)
+                .exclude(status=Msg.STATUS_PENDING)
+                .order_by("-created_on", "-id")
+                .select_related("channel", "contact_urn", "broadcast", "optin")[:limit]
+            )
 
-        # get all runs start started or ended in this period
-        runs = (
-            self.runs.filter(
-                Q(created_on__gte=after, created_on__lt=before)
-                | Q(exited_on__isnull=False, exited_on__gte=after, exited_on__lt=before)
+        def runs() -> list:
+            # get all runs start started or ended in this period
+            runs = (
+                self.runs.filter(
+                    Q(created_on__gte=after, created_on__lt=before)
+                    | Q(exited_on__isnull=False, exited_on__gte=after, exited_on__lt=before)
+                )
+                .exclude(flow__is_system=True)
+                .order_by("-created_on", "-id")
+                .select_related("flow")[:limit]
             )
-            .exclude(flow__is_system=True)
-            .order_by("-created_on")
-            .select_related("flow")[:limit]
-        )
-        started_runs = [r for r in runs if after <= r.created_on < before]
-        exited_runs = [FlowExit(r) for r in runs if r.exited_on and after <= r.exited_on < before]
+            started_runs = [r for r in runs if after <= r.created_on < before]
+            exited_runs = [FlowExit(r) for r in runs if r.exited_on and after <= r.exited_on < before]
 
-        channel_events = (
-            self.channel_events.filter(created_on__gte=after, created_on__lt=before)
-            .order_by("-created_on")
-            .select_related("channel", "optin")[:limit]
-        )
+            return sorted(started_runs + exited_runs, key=get_event_time, reverse=True)
 
-        campaign_events = (
-            self.campaign_fires.filter(fired__gte=after, fired__lt=before)
-            .exclude(fired=None)
-            .order_by("-fired")
-            .select_related("event__campaign", "event__relative_to")[:limit]
-        )
+        def ticket_events() -> list:
+            events = (
+                self.ticket_events.filter(created_on__gte=after, created_on__lt=before)
+                .select_related("ticket__topic", "assignee", "created_by")
+                .order_by("-created_on", "-id")
+            )
 
-        calls = (
-            Call.objects.filter(contact=self, created_on__gte=after, created_on__lt=before)
-            .exclude(status__in=[Call.STATUS_PENDING, Call.STATUS_WIRED])
-            .order_by("-created_on")
-            .select_related("channel")[:limit]
-        )
+            if ticket:
+                # if we have a ticket this is for the ticket UI, so we want *all* events for *only* that ticket
+                events = events.filter(ticket=ticket)
+            else:
+                # if not then this for the contact read page so only show ticket opened/closed/reopened events
+                events = events.filter(
+                    event_type__in=[TicketEvent.TYPE_OPENED, TicketEvent.TYPE_CLOSED, TicketEvent.TYPE_REOPENED]
+                )
 
-        ticket_events = (
-            self.ticket_events.filter(created_on__gte=after, created_on__lt=before)
-            .select_related("ticket__topic", "assignee", "created_by")
-            .order_by("-created_on")
-        )
+            return list(events[:limit])
 
-        if ticket:
-            # if we have a ticket this is for the ticket UI, so we want *all* events for *only* that ticket
-            ticket_events = ticket_events.filter(ticket=ticket)
-        else:
-            # if not then this for the contact read page so only show ticket opened/closed/reopened events
-            ticket_events = ticket_events.filter(
-                event_type__in=[TicketEvent.TYPE_OPENED, TicketEvent.TYPE_CLOSED, TicketEvent.TYPE_REOPENED]
+        def channel_events() -> list:
+            return list(
+                self.channel_events.filter(created_on__gte=after, created_on__lt=before)
+                .order_by("-created_on", "-id")
+                .select_related("channel", "optin")[:limit]
             )
 
-        ticket_events = ticket_events[:limit]
+        def campaign_events() -> list:
+            return list(
+                self.campaign_fires.filter(fired__gte=after, fired__lt=before)
+                .exclude(fired=None)
+                .order_by("-fired", "-id")
+                .select_related("event__campaign", "event__relative_to")[:limit]
+            )
 
-        transfers = self.airtime_transfers.filter(created_on__gte=after, created_on__lt=before).order_by("-created_on")[
-            :limit
-        ]
+        def calls() -> list:
+            return list(
+                Call.objects.filter(contact=self, created_on__gte=after, created_on__lt=before)
+                .exclude(status__in=[Call.STATUS_PENDING, Call.STATUS_WIRED])
+                .order_by("-created_on", "-id")
+                .select_related("channel")[:limit]
+            )
 
-        session_events = self.get_session_events(after, before, include_event_types)
-
-        # chain all items together, sort by their event time, and slice
-        items = chain(
-            msgs,
-            started_runs,
-            exited_runs,
-            ticket_events,
-            channel_events,
-            campaign_events,
-            calls,
-            transfers,
-            session_events,
-        )
+        def transfers() -> list:
+            return list(
+                self.airtime_transfers.filter(created_on__gte=after, created_on__lt=before)
+                .order_by("-created_on", "-id")[:limit]
+            )
+
+        def session_events() -> list:
+            events = self.get_session_events(after, before, include_event_types)
+            return sorted(events, key=get_event_time, reverse=True)[:limit]
 
-        # sort and slice
-        return sorted(items, key=get_event_time, reverse=True)[:limit]
+        return [msgs, runs, ticket_events, channel_events, campaign_events, calls, transfers, session_events]
 
     def get_session_events(self, after: datetime, before: datetime, types: set) -> list:
         """
@@ -860,18 +979,55 @@ class Contact(LegacyUUIDMixin, SmartModel):
         # limit to 100 sessions at a time to prevent melting when a contact has a lot of sessions
         sessions = self.sessions.filter(
             Q(created_on__gte=after, created_on__lt=before) | Q(ended_on__gte=after, ended_on__lt=before)
-        ).order_by("-created_on")[:100]
+        ).order_by("-created_on", "-id")[:100]
+
+        if settings.SESSION_EVENTS_CACHE_TTL:
+            sessions = list(sessions.defer("output"))
+            events_by_session = self._get_cached_session_events(sessions)
+        else:
+            events_by_session = {s.uuid: s.get_events() for s in sessions}
+
         events = []
         for session in sessions:
-            for run in session.output_json.get("runs", []):
-                for event in run.get("events", []):
-                    event["session_uuid"] = str(session.uuid)
-                    event_time = iso8601.parse_date(event["created_on"])
-                    if event["type"] in types and after <= event_time < before:
-                        events.append(event)
+            for event in events_by_session[session.uuid]:
+                if event["type"] in types and after <= iso8601.parse_date(event["created_on"]) < before:
+                    events.append(event)
 
         return events
 
+    def _get_cached_session_events(self, sessions: list) -> dict:
+        """
+        Gets the events of the given sessions (fetched without their output) by session UUID, using the events cached
+        for ended sessions and caching the events of any ended sessions we have to extract from their outputs
+        """
+        from temba.flows.models import FlowSession
+
+        r = get_redis_connection()
+        ended = [s for s in sessions if s.status != FlowSession.STATUS_WAITING]
+        cached = r.mget([f"{SESSION_EVENTS_KEY}:{s.uuid}" for s in ended]) if ended else []
+
+        events_by_session = {s.uuid: json.loads(v) for s, v in zip(ended, cached) if v}
+        misses = [s for s in sessions if s.uuid not in events_by_session]
+
+        # fetch the outputs of any sessions which don't have their output stored on S3
+        outputs = dict(
+            FlowSession.objects.filter(id__in=[s.id for s in misses if not s.output_url]).values_list("id", "output")
+        )
+
+        pipe = r.pipeline()
+        for session in misses:
+            if not session.output_url:
+                session.output = outputs[session.id]
+
+            events_by_session[session.uuid] = session.get_events()
+
+            if session.status != FlowSession.STATUS_WAITING:
+                key = f"{SESSION_EVENTS_KEY}:{session.uuid}"
+                pipe.set(key, json.dumps(events_by_session[session.uuid]), ex=settings.SESSION_EVENTS_CACHE_TTL)
+        pipe.execute()
+
+        return events_by_session
+
     def get_field_json(self, field):
         """
         Returns the JSON (as a dict) value for this field, or None if there is no value
@@ -1016,6 +1172,8 @@ class Contact(LegacyUUIDMixin, SmartModel):
             logger.error(f"Contact update failed: {str(e)}", exc_info=True)
             raise e
 
+        CountCache.invalidate(org.id)
+
         def modified(contact):
             c = response.get("modified", {}).get(contact.id, {}) or response.get(contact.id, {})
             return len(c.get("events", [])) > 0
@@ -1356,6 +1514,10 @@ class ContactURN(models.Model):
     ANON_MASK = "*" * 8  # Returned instead of URN values for anon orgs
     ANON_MASK_HTML = "•" * 8  # Pretty HTML version of anon mask
 
+    # tel URNs are normalized in ranges of ids which can be handled in parallel, and within those in batches
+    NORMALIZE_RANGE_SIZE = 50_000
+    NORMALIZE_BATCH_SIZE = 1000
+
     org = models.ForeignKey(Org, related_name="urns", on_delete=models.PROTECT)
     contact = models.ForeignKey(Contact, on_delete=models.PROTECT, null=True, related_name="urns")
 
@@ -1433,6 +1595,80 @@ class ContactURN(models.Model):
             event.release()
         self.delete()
 
+    @classmethod
+    def get_unnormalized_tels(cls, org):
+        """
+        Gets the tel URNs of the given org which don't start with + and so might need normalizing
+        """
+        return cls.objects.filter(org=org, scheme=URN.TEL_SCHEME).exclude(path__startswith="+")
+
+    @classmethod
+    def get_normalize_ranges(cls, org) -> list:
+        """
+        Splits the unnormalized tel URNs of the given org into (start_id, end_id) ranges of up to NORMALIZE_RANGE_SIZE
+        URNs, where the end of the last range is None. Boundaries are computed in the database so only the ids which
+        start ranges are fetched.
+        """
+        sql = f"""
+        SELECT id FROM (
+            SELECT id, row_number() OVER (ORDER BY id) AS num FROM {cls._meta.db_table}
+            WHERE org_id = %s AND scheme = %s AND path NOT LIKE '+%%'
+        ) u WHERE (u.num - 1) %% %s = 0 ORDER BY id"""
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [org.id, URN.TEL_SCHEME, cls.NORMALIZE_RANGE_SIZE])
+            starts = [row[0] for row in cursor.fetchall()]
+
+        return list(zip(starts, starts[1:] + [None]))
+
+    @classmethod
+    def bulk_normalize_numbers(cls, org, country_code: str, urns: list) -> int:
+        """
+        Normalizes the numbers of the given (id, path) tel URNs with a single UPDATE, skipping URNs whose normalized
+        identity belongs to another URN. Returns the number of URNs updated.
+        """
+        identities = [URN.from_tel(path) for urn_id, path in urns]
+        normalized = URN.normalize_many(identities, country_code)
+
+        # keyed by normalized identity so that if several URNs normalize to the same identity, only the first gets it
+        updates = {}
+        for (urn_id, path), identity, norm_identity in zip(urns, identities, normalized):
+            if norm_identity != identity and norm_identity not in updates:
+                updates[norm_identity] = (urn_id, URN.to_parts(norm_identity)[1])
+
+        if not updates:
+            return 0
+
+        table = cls._meta.db_table
+        values = ", ".join(["(%s::bigint, %s, %s)"] * len(updates))
+        sql = f"""
+        UPDATE {table} u SET identity = v.identity, path = v.path
+        FROM (VALUES {values}) AS v(id, identity, path)
+        WHERE u.id = v.id AND u.org_id = %s AND NOT EXISTS (
+            SELECT 1 FROM {table} e WHERE e.org_id = %s AND e.identity = v.identity AND e.id != u.id
+        )"""
+        params = [p for identity, (urn_id, path) in updates.items() for p in (urn_id, identity, path)]
+        params += [org.id, org.id]
+
+        try:
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    cursor.execute(sql, params)
+                    return cursor.rowcount
+        except IntegrityError:
+            # another process took one of these identities since we checked, so fall back to one URN at a time
+            num_updated = 0
+            for urn in cls.objects.filter(id__in=[urn_id for urn_id, path in updates.values()]):
+                path = urn.path
+                try:
+                    with transaction.atomic():
+                        urn.ensure_number_normalization(country_code)
+                except IntegrityError:  # pragma: no cover
+                    continue
+                if urn.path != path:
+                    num_updated += 1
+            return num_updated
+
     def ensure_number_normalization(self, country_code):
         """
         Tries to normalize our phone number from a possible 10 digit (0788 383 383) to a 12 digit number
@@ -1806,29 +2042,23 @@ class ContactGroupCount(SquashableModel):
     group = models.ForeignKey(ContactGroup, on_delete=models.PROTECT, related_name="counts", db_index=True)
     count = models.IntegerField(default=0)
 
-    @classmethod
-    def get_squash_query(cls, distinct_set):
-        sql = """
-        WITH deleted as (
-            DELETE FROM %(table)s WHERE "group_id" = %%s RETURNING "count"
-        )
-        INSERT INTO %(table)s("group_id", "count", "is_squashed")
-        VALUES (%%s, GREATEST(0, (SELECT SUM("count") FROM deleted)), TRUE);
-        """ % {
-            "table": cls._meta.db_table
-        }
-
-        return sql, (distinct_set.group_id,) * 2
-
     @classmethod
     def get_totals(cls, groups) -> dict:
         """
         Gets total counts for all the given groups
         """
-        counts = cls.objects.filter(group__in=groups)
-        counts = counts.values("group").order_by("group").annotate(count_sum=Sum("count"))
-        counts_by_group_id = {c["group"]: c["count_sum"] for c in counts}
-        return {g: counts_by_group_id.get(g.id, 0) for g in groups}
+        groups = list(groups)
+        if not groups:
+            return {}
+
+        def fetch(group_ids):
+            counts = cls.objects.filter(group_id__in=group_ids)
+            counts = counts.values("group").order_by("group").annotate(count_sum=Sum("count"))
+            counts_by_group_id = {c["group"]: c["count_sum"] for c in counts}
+            return {gid: counts_by_group_id.get(gid, 0) for gid in group_ids}
+
+        totals = CountCache.get_totals(cls, groups[0].org_id, [g.id for g in groups], fetch)
+        return {g: totals[g.id] for g in groups}
 
     @classmethod
     def populate_for_group(cls, group):
@@ -1839,7 +2069,10 @@ class ContactGroupCount(SquashableModel):
         count = group.contacts.all().count()
 
         # insert updated count, returning it
-        return ContactGroupCount.objects.create(group=group, count=count)
+        count = ContactGroupCount.objects.create(group=group, count=count)
+
+        CountCache.invalidate(group.org_id)
+        return count
 
     class Meta:
         indexes = [
@@ -1851,6 +2084,8 @@ class ExportContactsTask(BaseExport):
     analytics_key = "contact_export"
     notification_export_type = "contact"
 
+    BATCH_SIZE = 1000
+
     group = models.ForeignKey(
         ContactGroup,
         on_delete=models.PROTECT,
@@ -1864,8 +2099,10 @@ class ExportContactsTask(BaseExport):
     search = models.TextField(null=True, blank=True, help_text=_("The search query"))
 
     @classmethod
-    def create(cls, org, user, group=None, search=None, group_memberships=()):
-        export = cls.objects.create(org=org, group=group, search=search, created_by=user, modified_by=user)
+    def create(cls, org, user, group=None, search=None, group_memberships=(), format=BaseExport.FORMAT_XLSX):
+        export = cls.objects.create(
+            org=org, group=group, search=search, format=format, created_by=user, modified_by=user
+        )
         export.group_memberships.add(*group_memberships)
         return export
 
@@ -1937,47 +2174,57 @@ class ExportContactsTask(BaseExport):
     def write_export(self):
         fields, scheme_counts, group_fields = self.get_export_fields_and_schemes()
         group = self.group or self.org.active_contacts_group
-
-        include_group_memberships = bool(self.group_memberships.exists())
+        group_ids = [g["group_id"] for g in group_fields]
 
         if self.search:
-            contact_ids = elastic.query_contact_ids(self.org, self.search, group=group)
+            num_contacts, contact_ids = elastic.iter_contact_ids(self.org, self.search, group=group)
+
+            # fetch the next page of ids from elastic while we're writing the current batch
+            id_batches = read_ahead(chunk_list(contact_ids, self.BATCH_SIZE))
         else:
-            contact_ids = group.contacts.order_by("name", "id").values_list("id", flat=True)
+            num_contacts = None
+
+            # stream ids with a server-side cursor rather than loading them all at once
+            contact_ids = (
+                group.contacts.using("readonly")
+                .order_by("name", "id")
+                .values_list("id", flat=True)
+                .iterator(chunk_size=self.BATCH_SIZE)
+            )
+            id_batches = chunk_list(contact_ids, self.BATCH_SIZE)
+
+        # work out how to get each column's value once rather than for every cell
+        extractors = self._get_value_extractors(fields)
+        has_urn_columns = any(f["urn_scheme"] is not None for f in fields)
+        num_groups = len(group_ids)
 
         # create our exporter
-        exporter = MultiSheetExporter(
-            "Contact", [f["label"] for f in fields] + [g["label"] for g in group_fields], self.org.timezone
-        )
+        exporter = self._get_exporter("Contact", [f["label"] for f in fields] + [g["label"] for g in group_fields])
 
         total_exported_contacts = 0
         start = time.time()
 
         # write out contacts in batches to limit memory usage
-        for batch_ids in chunk_list(contact_ids, 1000):
+        for batch_ids in id_batches:
             # fetch all the contacts for our batch
-            batch_contacts = (
-                Contact.objects.filter(id__in=batch_ids).prefetch_related("org", "groups").using("readonly")
-            )
+            batch_contacts = Contact.objects.filter(id__in=batch_ids).prefetch_related("org").using("readonly")
 
             # to maintain our sort, we need to lookup by id, create a map of our id->contact to aid in that
             contact_by_id = {c.id: c for c in batch_contacts}
 
             Contact.bulk_urn_cache_initialize(batch_contacts, using="readonly")
 
+            memberships = self._get_group_memberships(batch_ids, group_ids) if group_ids else {}
+
             for contact_id in batch_ids:
                 contact = contact_by_id[contact_id]
 
-                values = []
-                for field in fields:
-                    values.append(self.get_field_value(field, contact))
+                urns_by_scheme = self._bucket_urns(contact) if has_urn_columns else None
+                values = [extract(contact, urns_by_scheme) for extract in extractors]
 
-                group_values = []
-                if include_group_memberships:
-                    contact_groups_ids = [g.id for g in contact.groups.all()]
-                    for col in range(len(group_fields)):
-                        field = group_fields[col]
-                        group_values.append(field["group_id"] in contact_groups_ids)
+                # group memberships are a bitmap with a bit for each group column
+                membership = memberships.get(contact_id, 0)
+                group_values = [bool(membership & (1 << i)) for i in range(num_groups)]
 
                 # write this contact's values
                 exporter.write_row(values + group_values)
@@ -1985,16 +2232,19 @@ class ExportContactsTask(BaseExport):
 
                 # output some status information every 10,000 contacts
                 if total_exported_contacts % ExportContactsTask.LOG_PROGRESS_PER_ROWS == 0:
+                    if num_contacts is None:
+                        num_contacts = group.contacts.using("readonly").count()
+
                     elapsed = time.time() - start
-                    predicted = elapsed // (total_exported_contacts / len(contact_ids))
+                    predicted = elapsed // (total_exported_contacts / num_contacts)
 
                     logger.info(
                         "Export of %s contacts - %d%% (%s/%s) complete in %0.2fs (predicted %0.0fs)"
                         % (
                             self.org.name,
-                            total_exported_contacts * 100 // len(contact_ids),
+                            total_exported_contacts * 100 // num_contacts,
                             "{:,}".format(total_exported_contacts),
-                            "{:,}".format(len(contact_ids)),
+                            "{:,}".format(num_contacts),
                             time.time() - start,
                             predicted,
                         )
@@ -2005,38 +2255,91 @@ class ExportContactsTask(BaseExport):
 
         return exporter.save_file()
 
-    def get_field_value(self, field: dict, contact: Contact):
-        if field["key"] == "name":
-            return contact.name
-        elif field["key"] == "uuid":
-            return contact.uuid
-        elif field["key"] == "language":
-            return contact.language
-        elif field["key"] == "status":
-            return contact.get_status_display()
-        elif field["key"] == "created_on":
-            return contact.created_on
-        elif field["key"] == "last_seen_on":
-            return contact.last_seen_on
-        elif field["key"] == "id":
-            return str(contact.id)
-        elif field["key"] == "scheme":
+    @staticmethod
+    def _get_group_memberships(contact_ids: list, group_ids: list) -> dict:
+        """
+        Gets the memberships of the given contacts in the given groups as a map of contact id to a bitmap with a bit set
+        for each group they belong to
+        """
+        bits = {group_id: 1 << i for i, group_id in enumerate(group_ids)}
+        memberships = defaultdict(int)
+
+        rows = (
+            Contact.objects.filter(id__in=contact_ids, groups__in=group_ids)
+            .values_list("id", "groups")
+            .using("readonly")
+        )
+        for contact_id, group_id in rows:
+            memberships[contact_id] |= bits[group_id]
+
+        return memberships
+
+    def _get_value_extractors(self, fields: list) -> list:
+        """
+        Compiles the given export fields into a list of functions which each extract a column value from a contact and
+        its URNs bucketed by scheme, so that we only work out how to get each column's value once per export
+        """
+        org = self.org
+
+        def attr(name):
+            return lambda contact, urns_by_scheme: getattr(contact, name)
+
+        def first_scheme(contact, urns_by_scheme):
             contact_urns = contact.get_urns()
             return contact_urns[0].scheme if contact_urns else ""
-        elif field["urn_scheme"] is not None:
-            contact_urns = contact.get_urns()
-            scheme_urns = []
-            for urn in contact_urns:
-                if urn.scheme == field["urn_scheme"]:
-                    scheme_urns.append(urn)
-            position = field["position"]
-            if len(scheme_urns) > position:
-                urn_obj = scheme_urns[position]
-                return urn_obj.get_display(org=self.org, formatted=False) if urn_obj else ""
+
+        def urn(scheme, position):
+            def extract(contact, urns_by_scheme):
+                scheme_urns = urns_by_scheme.get(scheme, ())
+                return (
+                    scheme_urns[position].get_display(org=org, formatted=False) if len(scheme_urns) > position else ""
+                )
+
+            return extract
+
+        def text_field(field_uuid):
+            def extract(contact, urns_by_scheme):
+                value = contact.fields.get(field_uuid) if contact.fields else None
+                return (value.get("text") or "") if value else ""
+
+            return extract
+
+        def other_field(field):
+            return lambda contact, urns_by_scheme: contact.get_field_display(field)
+
+        simple = {
+            "uuid": attr("uuid"),
+            "name": attr("name"),
+            "language": attr("language"),
+            "created_on": attr("created_on"),
+            "last_seen_on": attr("last_seen_on"),
+            "status": lambda contact, urns_by_scheme: contact.get_status_display(),
+            "id": lambda contact, urns_by_scheme: str(contact.id),
+            "scheme": first_scheme,
+        }
+
+        extractors = []
+        for field in fields:
+            if field["key"] in simple and not field["field"]:
+                extractors.append(simple[field["key"]])
+            elif field["urn_scheme"] is not None:
+                extractors.append(urn(field["urn_scheme"], field["position"]))
+            elif field["field"].value_type == ContactField.TYPE_TEXT:
+                extractors.append(text_field(str(field["field"].uuid)))
             else:
-                return ""
-        else:
-            return contact.get_field_display(field["field"])
+                extractors.append(other_field(field["field"]))
+
+        return extractors
+
+    @staticmethod
+    def _bucket_urns(contact: Contact) -> dict:
+        """
+        Buckets the URNs of the given contact by scheme, keeping them in priority order
+        """
+        urns_by_scheme = defaultdict(list)
+        for urn in contact.get_urns():
+            urns_by_scheme[urn.scheme].append(urn)
+        return urns_by_scheme
 
 
 def get_import_upload_path(instance: Any, filename: str):
@@ -2047,6 +2350,7 @@ def get_import_upload_path(instance: Any, filename: str):
 class ContactImport(SmartModel):
     MAX_RECORDS = 25_000
     BATCH_SIZE = 100
+    BATCH_INSERT_SIZE = 50  # number of batches to buffer before inserting them
     EXPLICIT_CLEAR = "--"
 
     # how many sequential URNs triggers flagging
@@ -2154,13 +2458,8 @@ class ContactImport(SmartModel):
             if mapping["type"] == "attribute" and mapping["name"] == "uuid":
                 uuid = value.lower()
             elif mapping["type"] == "scheme" and value:
-                urn = URN.from_parts(mapping["scheme"], value)
-                try:
-                    urn = URN.normalize(urn)
-                except ValueError:
-                    pass
-                urns.append(urn)
-        return uuid, urns
+                urns.append(URN.from_parts(mapping["scheme"], value))
+        return uuid, URN.normalize_many(urns)
 
     @classmethod
     def _auto_mappings(cls, org: Org, headers: list[str]) -> list:
@@ -2289,27 +2588,52 @@ class ContactImport(SmartModel):
         # parse each row, creating batch tasks for mailroom
         data = pyexcel.iget_array(file_stream=file, file_type=file_type, start_row=1)
 
-        urns = []
+        # check imported URNs for spamminess as we go rather than holding onto them all
+        sequential_urns = SequentialURNCounter(self.SEQUENTIAL_URNS_THRESHOLD) if not self.org.is_verified else None
+
         batches = []
+        to_insert = []
 
         for batch_specs, batch_start, batch_end in self._batches_generator(data):
-            batches.append(self.batches.create(specs=batch_specs, record_start=batch_start, record_end=batch_end))
+            to_insert.append(
+                ContactImportBatch(
+                    contact_import=self, specs=batch_specs, record_start=batch_start, record_end=batch_end
+                )
+            )
 
-            for spec in batch_specs:
-                urns.extend(spec.get("urns", []))
+            if sequential_urns:
+                for spec in batch_specs:
+                    sequential_urns.add_all(spec.get("urns", []))
+
+            if len(to_insert) == self.BATCH_INSERT_SIZE:
+                batches.extend(self._insert_batches(to_insert))
+                to_insert = []
+
+        batches.extend(self._insert_batches(to_insert))
 
         # set redis key which mailroom batch tasks can decrement to know when import has completed
         r = get_redis_connection()
         r.set(f"contact_import_batches_remaining:{self.id}", len(batches), ex=24 * 60 * 60)
 
-        # start each batch...
-        for batch in batches:
-            batch.import_async()
+        # start all the batches...
+        mailroom.queue_contact_import_batches(batches)
 
         # flag org if the set of imported URNs looks suspicious
-        if not self.org.is_verified and self._detect_spamminess(urns):
+        if sequential_urns and sequential_urns.detected:
             self.org.flag()
 
+    @staticmethod
+    def _insert_batches(batches: list) -> list:
+        """
+        Inserts the given batches, dropping their specs afterwards as we only need their ids to queue them
+        """
+        ContactImportBatch.objects.bulk_create(batches)
+
+        for batch in batches:
+            batch.specs = None
+
+        return batches
+
     def _batches_generator(self, row_iter):
         """
         Generator which takes an iterable of raw rows and returns tuples of 1. a batches of specs, 2. the record index
@@ -2330,12 +2654,25 @@ class ContactImport(SmartModel):
                 record += 1
 
             if len(batch_specs) == ContactImport.BATCH_SIZE:
-                yield batch_specs, batch_start, record
+                yield self._normalize_urns(batch_specs), batch_start, record
                 batch_specs = []
                 batch_start = record
 
         if batch_specs:
-            yield batch_specs, batch_start, record
+            yield self._normalize_urns(batch_specs), batch_start, record
+
+    def _normalize_urns(self, specs: list) -> list:
+        """
+        Normalizes the URNs of the given specs together, so that URNs repeated within a batch are only normalized once
+        """
+        urns = [urn for spec in specs for urn in spec.get("urns", ())]
+        normalized = iter(URN.normalize_many(urns, self.org.default_country_code))
+
+        for spec in specs:
+            if "urns" in spec:
+                spec["urns"] = [next(normalized) for _ in spec["urns"]]
+
+        return specs
 
     def get_info(self):
         """
@@ -2416,12 +2753,7 @@ class ContactImport(SmartModel):
                 if value:
                     if "urns" not in spec:
                         spec["urns"] = []
-                    urn = URN.from_parts(scheme, value)
-                    try:
-                        urn = URN.normalize(urn, country_code=self.org.default_country_code)
-                    except ValueError:
-                        pass
-                    spec["urns"].append(urn)
+                    spec["urns"].append(URN.from_parts(scheme, value))  # normalized per batch
 
             elif mapping["type"] in ("field", "new_field"):
                 if "fields" not in spec:
@@ -2468,30 +2800,9 @@ class ContactImport(SmartModel):
         Takes the list of URNs that have been imported and tries to detect spamming
         """
 
-        # extract all numerical URN paths
-        numerical_paths = []
-        for urn in urns:
-            scheme, path, query, display = URN.to_parts(urn)
-            try:
-                numerical_paths.append(int(path))
-            except ValueError:
-                pass
-
-        if len(numerical_paths) < cls.SEQUENTIAL_URNS_THRESHOLD:
-            return False
-
-        numerical_paths = sorted(numerical_paths)
-        last_path = numerical_paths[0]
-        num_sequential = 1
-        for path in numerical_paths[1:]:
-            if path == last_path + 1:
-                num_sequential += 1
-            last_path = path
-
-            if num_sequential >= cls.SEQUENTIAL_URNS_THRESHOLD:
-                return True
-
-        return False
+        sequential_urns = SequentialURNCounter(cls.SEQUENTIAL_URNS_THRESHOLD)
+        sequential_urns.add_all(urns)
+        return sequential_urns.detected
 
     def get_default_group_name(self):
         name = Path(self.original_filename).stem.title()
@@ -2506,6 +2817,38 @@ class ContactImport(SmartModel):
         return ContactGroup.get_unique_name(self.org, name)
 
 
+class SequentialURNCounter:
+    """
+    Incrementally counts how many numerical URN paths directly follow another, so that a stream of imported URNs can be
+    checked for sequential numbers without keeping the URNs themselves or sorting them. Only the distinct numerical
+    paths are kept, and nothing more is added once the threshold is reached.
+    """
+
+    def __init__(self, threshold: int):
+        self.threshold = threshold
+        self.paths = set()
+        self.num_sequential = 1
+
+    def add_all(self, urns: list[str]):
+        for urn in urns:
+            if self.detected:
+                return
+
+            scheme, path, query, display = URN.to_parts(urn)
+            try:
+                path = int(path)
+            except ValueError:
+                continue
+
+            if path not in self.paths:
+                self.paths.add(path)
+                self.num_sequential += (path - 1 in self.paths) + (path + 1 in self.paths)
+
+    @property
+    def detected(self) -> bool:
+        return self.num_sequential >= self.threshold
+
+
 class ContactImportBatch(models.Model):
     """
     A batch of contact records to be handled by mailroom
@@ -2543,4 +2886,4 @@ class ContactExportAssetStore(BaseExportAssetStore):
     key = "contact_export"
     directory = "contact_exports"
     permission = "contacts.contact_export"
-    extensions = ("xlsx", "csv")
+    extensions = ("xlsx", "csv", "csv.gz", "jsonl.gz")
@@ -20,6 +20,19 @@ def query_contact_ids(org, query, *, group=None):
     return [int(r.id) for r in results.scan()]
 
 
+def iter_contact_ids(org, query, *, group=None) -> tuple:
+    """
+    Returns the total number of contacts for the given query, and an iterator over their ids which scrolls through the
+    results a page at a time rather than loading them all
+    """
+    parsed = parse_query(org, query, group=group)
+    search = (
+        es_Search(index="contacts").source(include=["id"]).params(routing=org.id).using(ES).query(parsed.elastic_query)
+    )
+
+    return search.count(), (int(r.id) for r in search.scan())
+
+
 def get_last_modified():
     """
     Gets the last modified contact if there are any contacts
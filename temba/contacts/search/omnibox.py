@@ -1,7 +1,12 @@
 import json
 import operator
+import re
+import time
 from functools import reduce
 
+from django_redis import get_redis_connection
+
+from django.conf import settings
 from django.db.models import Q
 from django.db.models.functions import Upper
 
@@ -14,10 +19,61 @@ SEARCH_ALL_GROUPS = "g"
 SEARCH_STATIC_GROUPS = "s"
 SEARCH_CONTACTS = "c"
 
+# max number of results of each type
+PER_TYPE_LIMIT = 25
+
 
-def omnibox_query(org, **kwargs):
+class OmniboxCache:
     """
-    Performs a omnibox query based on the given arguments
+    Short lived cache of serialized omnibox search results for a user in an org, with a hash in redis for each user and
+    an entry in it for each type of result and query. Entries for queries whose results weren't limited are complete,
+    and can be filtered locally to answer a longer query which extends them, e.g. as the user types, if a match
+    function which reproduces the search semantics for that query is given.
+    """
+
+    KEY_BASE = "omnibox"
+
+    def __init__(self, org, user):
+        self.key = f"{self.KEY_BASE}:{org.id}:{user.id}"
+
+    def get(self, result_type: str, query: str, matches) -> list:
+        """
+        Gets the cached items for the given result type and query, either directly or by filtering the items of a
+        complete cached prefix of the query with the given match function. Returns None if nothing usable is cached.
+        """
+        prefixes = [query[:i] for i in range(len(query), -1, -1)] if matches else [query]
+        values = get_redis_connection().hmget(self.key, [f"{result_type}:{p}" for p in prefixes])
+        now = time.time()
+
+        for prefix, value in zip(prefixes, values):
+            if not value:
+                continue
+
+            entry = json.loads(value)
+            if entry["expires_on"] <= now:
+                continue
+
+            if prefix == query:
+                return entry["items"]
+            elif entry["complete"]:
+                return [item for item in entry["items"] if matches(item["match"])]
+
+        return None
+
+    def set(self, result_type: str, query: str, items: list, complete: bool):
+        ttl = settings.OMNIBOX_CACHE_TTL
+        entry = {"expires_on": time.time() + ttl, "complete": complete, "items": items}
+
+        pipe = get_redis_connection().pipeline()
+        pipe.hset(self.key, f"{result_type}:{query}", json.dumps(entry))
+        pipe.expire(self.key, ttl)
+        pipe.execute()
+
+
+def omnibox_query(org, user=None, **kwargs):
+    """
+    Performs a omnibox query based on the given arguments. If a user is provided, searches use the omnibox cache and
+    return serialized results.
     """
     # determine what type of group/contact/URN lookup is being requested
     contact_uuids = kwargs.get("c", None)  # contacts with ids
@@ -32,6 +88,9 @@ def omnibox_query(org, **kwargs):
     elif group_uuids:
         return ContactGroup.get_groups(org).filter(uuid__in=group_uuids.split(",")).order_by("name")
 
+    if user and settings.OMNIBOX_CACHE_TTL:
+        return omnibox_cached_search(org, user, search, types)
+
     # searching returns something which acts enough like a queryset to be paged
     return omnibox_mixed_search(org, search, types)
 
@@ -51,47 +110,126 @@ def omnibox_mixed_search(org, query, types):
     """
     Performs a mixed group and contact search, returning the first N matches of each type.
     """
-    query_terms = query.split(" ") if query else None
     search_types = types or (SEARCH_ALL_GROUPS, SEARCH_CONTACTS)
-    per_type_limit = 25
     results = []
 
     if SEARCH_ALL_GROUPS in search_types or SEARCH_STATIC_GROUPS in search_types:
-        groups = ContactGroup.get_groups(org, ready_only=True)
+        results += _search_groups(org, query, SEARCH_ALL_GROUPS in search_types)[0]
+
+    if SEARCH_CONTACTS in search_types:
+        results += _search_contacts(org, query)[0]
+
+    return results
+
+
+def omnibox_cached_search(org, user, query, types) -> list:
+    """
+    Performs a mixed group and contact search like omnibox_mixed_search, but returns serialized results and uses the
+    user's omnibox cache for each type of result
+    """
+    search_types = types or (SEARCH_ALL_GROUPS, SEARCH_CONTACTS)
+    cache = OmniboxCache(org, user)
+    cache_query = query or ""
+    results = []
+
+    if SEARCH_ALL_GROUPS in search_types or SEARCH_STATIC_GROUPS in search_types:
+        all_groups = SEARCH_ALL_GROUPS in search_types
+        terms = cache_query.upper().split(" ")
+        group_type = SEARCH_ALL_GROUPS if all_groups else SEARCH_STATIC_GROUPS
 
-        # exclude dynamic groups if not searching all groups
-        if SEARCH_ALL_GROUPS not in search_types:
-            groups = groups.filter(query=None)
+        def group_matches(match):
+            return all(t in match[0].upper() for t in terms)
 
-        if query:
-            groups = term_search(groups, ("name__icontains",), query_terms)
+        items = cache.get(group_type, cache_query, group_matches)
+        if items is None:
+            groups, complete = _search_groups(org, query, all_groups)
+            items = [{"result": r, "match": [g.name]} for g, r in zip(groups, omnibox_results_to_dict(org, groups))]
+            cache.set(group_type, cache_query, items, complete)
 
-        results += list(groups.order_by(Upper("name"))[:per_type_limit])
+        results += [item["result"] for item in items]
 
     if SEARCH_CONTACTS in search_types:
-        try:
-            if org.is_anon:
-                search_query = f"name ~ {json.dumps(query)}"
-            else:
-                search_query = f"name ~ {json.dumps(query)} OR urn ~ {json.dumps(query)}"
-            search_results = search_contacts(org, search_query, group=org.active_contacts_group, sort="name")
-            contacts = IDSliceQuerySet(
-                Contact,
-                search_results.contact_ids,
-                offset=0,
-                total=len(search_results.contact_ids),
-                only=("id", "uuid", "name", "org_id"),
-            ).prefetch_related("org")
-
-            results += list(contacts[:per_type_limit])
-            Contact.bulk_urn_cache_initialize(contacts=results)
-
-        except SearchException:
-            pass
+        lowered = cache_query.lower()
+
+        def contact_matches(match):
+            # names are matched by token prefix and URNs by substring, same as the contact search in mailroom
+            name, paths = match[0], match[1:]
+            return any(t.startswith(lowered) for t in _name_tokens(name)) or any(lowered in p.lower() for p in paths)
+
+        # the results of a prefix are only a superset of the results of a query which is a single word, e.g. "bob s"
+        # also matches names with a word starting with "s" which "bob" doesn't
+        if not re.fullmatch(r"\w+", cache_query):
+            contact_matches = None
+
+        items = cache.get(SEARCH_CONTACTS, cache_query, contact_matches)
+        if items is None:
+            contacts, complete = _search_contacts(org, query)
+            items = []
+            for contact, result in zip(contacts, omnibox_results_to_dict(org, contacts)):
+                match = [contact.name or ""]
+                if not org.is_anon:
+                    match += [urn.path for urn in contact.get_urns()]
+                items.append({"result": result, "match": match})
+
+            cache.set(SEARCH_CONTACTS, cache_query, items, complete)
+
+        results += [item["result"] for item in items]
 
     return results
 
 
+def _name_tokens(text: str) -> list:
+    """
+    Splits the given text into lowercase word tokens, like the tokenizing of contact names for searching
+    """
+    return re.findall(r"\w+", text.lower())
+
+
+def _search_groups(org, query, all_groups: bool) -> tuple:
+    """
+    Searches for groups by name, returning the first N matches and whether those are all the matches
+    """
+    groups = ContactGroup.get_groups(org, ready_only=True)
+
+    # exclude dynamic groups if not searching all groups
+    if not all_groups:
+        groups = groups.filter(query=None)
+
+    if query:
+        groups = term_search(groups, ("name__icontains",), query.split(" "))
+
+    groups = list(groups.order_by(Upper("name"))[: PER_TYPE_LIMIT + 1])
+
+    return groups[:PER_TYPE_LIMIT], len(groups) <= PER_TYPE_LIMIT
+
+
+def _search_contacts(org, query) -> tuple:
+    """
+    Searches for contacts by name or URN, returning the first N matches and whether those are all the matches
+    """
+    try:
+        if org.is_anon:
+            search_query = f"name ~ {json.dumps(query)}"
+        else:
+            search_query = f"name ~ {json.dumps(query)} OR urn ~ {json.dumps(query)}"
+        search_results = search_contacts(org, search_query, group=org.active_contacts_group, sort="name")
+        contacts = IDSliceQuerySet(
+            Contact,
+            search_results.contact_ids,
+            offset=0,
+            total=len(search_results.contact_ids),
+            only=("id", "uuid", "name", "org_id"),
+        ).prefetch_related("org")
+
+        contacts = list(contacts[:PER_TYPE_LIMIT])
+        Contact.bulk_urn_cache_initialize(contacts=contacts)
+
+        return contacts, search_results.total <= PER_TYPE_LIMIT
+
+    except SearchException:
+        return [], False
+
+
 def omnibox_serialize(org, groups, contacts, *, json_encode=False):
     """
     Shortcut for proper way to serialize a queryset of groups and contacts for omnibox component
@@ -124,7 +262,9 @@ def omnibox_results_to_dict(org, results):
     group_counts = ContactGroupCount.get_totals(groups) if groups else {}
 
     for obj in results:
-        if isinstance(obj, ContactGroup):
+        if isinstance(obj, dict):  # already serialized, e.g. from the omnibox cache
+            result = obj
+        elif isinstance(obj, ContactGroup):
             result = {"id": str(obj.uuid), "name": obj.name, "type": "group", "count": group_counts[obj]}
         elif isinstance(obj, Contact):
             if org.is_anon:
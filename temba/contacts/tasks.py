@@ -59,7 +59,7 @@ def squash_group_counts():
     """
     Squashes our ContactGroupCounts into single rows per ContactGroup
     """
-    ContactGroupCount.squash()
+    return {"ContactGroupCount": ContactGroupCount.squash_all()}
 
 
 @shared_task
@@ -1,4 +1,5 @@
 import io
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, datetime, timedelta, timezone as tzone
 from decimal import Decimal
 from unittest.mock import PropertyMock, call, patch
@@ -7,10 +8,12 @@ from zoneinfo import ZoneInfo
 
 import iso8601
 import xlrd
+from django_redis import get_redis_connection
 from openpyxl import load_workbook
 
 from django.conf import settings
 from django.core.validators import ValidationError
+from django.db import connections
 from django.db.models import Value as DbValue
 from django.db.models.functions import Concat, Substr
 from django.db.utils import IntegrityError
@@ -50,6 +53,7 @@ from .models import (
     ContactImportBatch,
     ContactURN,
     ExportContactsTask,
+    fetch_history_sources,
 )
 from .tasks import check_elasticsearch_lag, squash_group_counts
 from .templatetags.contacts import contact_field, msg_status_badge
@@ -2175,6 +2179,78 @@ class ContactTest(TembaTest, CRUDLTestMixin):
         # lookup by contact uuids
         self.assertEqual(omnibox_request("c=%s,%s" % (self.joe.uuid, self.frank.uuid)), [])
 
+    @override_settings(OMNIBOX_CACHE_TTL=30)
+    @patch("temba.contacts.search.omnibox.search_contacts")
+    def test_omnibox_cache(self, mock_search_contacts):
+        joe_and_frank = self.create_group("Joe and Frank", [self.joe, self.frank])
+        open_tickets = self.org.groups.get(name="Open Tickets")
+
+        def omnibox_request(query):
+            response = self.client.get(reverse("contacts.contact_omnibox") + f"?{query}")
+            return response.json()["results"]
+
+        self.login(self.admin)
+
+        mock_search_contacts.return_value = SearchResults(
+            query="", total=2, contact_ids=[self.frank.id, self.joe.id], metadata=QueryMetadata()
+        )
+        frank_urn = self.frank.get_urn_display()
+
+        # first search hits the database and mailroom
+        self.assertEqual(
+            [
+                {"id": str(joe_and_frank.uuid), "name": "Joe and Frank", "type": "group", "count": 2},
+                {"id": str(open_tickets.uuid), "name": "Open Tickets", "type": "group", "count": 0},
+                {"id": str(self.frank.uuid), "name": "Frank Smith", "type": "contact", "urn": frank_urn},
+                {"id": str(self.joe.uuid), "name": "Joe Blow", "type": "contact", "urn": "blow80"},
+            ],
+            omnibox_request("search="),
+        )
+        self.assertEqual(1, mock_search_contacts.call_count)
+
+        # repeating it is answered from the cache
+        self.assertEqual(4, len(omnibox_request("search=")))
+        self.assertEqual(1, mock_search_contacts.call_count)
+
+        # as are longer single word queries, by filtering the complete results of their prefix, on name or URN
+        self.assertEqual(
+            [
+                {"id": str(joe_and_frank.uuid), "name": "Joe and Frank", "type": "group", "count": 2},
+                {"id": str(self.joe.uuid), "name": "Joe Blow", "type": "contact", "urn": "blow80"},
+            ],
+            omnibox_request("search=jo"),
+        )
+        self.assertEqual(
+            [{"id": str(self.joe.uuid), "name": "Joe Blow", "type": "contact", "urn": "blow80"}],
+            omnibox_request("search=ow8"),
+        )
+        self.assertEqual(
+            [
+                {"id": str(self.frank.uuid), "name": "Frank Smith", "type": "contact", "urn": frank_urn},
+                {"id": str(self.joe.uuid), "name": "Joe Blow", "type": "contact", "urn": "blow80"},
+            ],
+            omnibox_request("search=25078"),
+        )
+        self.assertEqual([], omnibox_request("search=xyz"))
+        self.assertEqual(1, mock_search_contacts.call_count)
+
+        # names are matched by word prefix rather than substring
+        self.assertEqual([], omnibox_request("search=mith"))
+        self.assertEqual(1, mock_search_contacts.call_count)
+
+        # but queries of more than one word always go to mailroom
+        omnibox_request("search=joe%20b")
+        self.assertEqual(2, mock_search_contacts.call_count)
+
+        # cached results are per user, and prefixes whose results were limited can't be filtered
+        self.login(self.editor)
+        mock_search_contacts.return_value = SearchResults(
+            query="", total=30, contact_ids=[self.frank.id, self.joe.id], metadata=QueryMetadata()
+        )
+        omnibox_request("search=bl")
+        omnibox_request("search=blo")
+        self.assertEqual(4, mock_search_contacts.call_count)
+
     def test_history(self):
         url = reverse("contacts.contact_history", args=[self.joe.uuid])
 
@@ -2514,6 +2590,121 @@ class ContactTest(TembaTest, CRUDLTestMixin):
             [e["type"] for e in resp_json["events"]],
         )
 
+    def test_history_cursor(self):
+        history_url = reverse("contacts.contact_history", args=[self.joe.uuid])
+
+        # create 7 messages, several of which have the same time
+        now = timezone.now()
+        times = [now - timedelta(minutes=m) for m in (1, 2, 2, 2, 2, 3, 4)]
+        msgs = [self.create_incoming_msg(self.joe, f"Message {i}", created_on=t) for i, t in enumerate(times)]
+
+        self.login(self.admin)
+
+        response = self.client.get(history_url + "?limit=3")
+        resp_json = response.json()
+        self.assertEqual(["Message 0", "Message 4", "Message 3"], [e["msg"]["text"] for e in resp_json["events"]])
+
+        # following the cursor resumes exactly where we left off, even part way through items with the same time
+        seen = [e["msg"]["id"] for e in resp_json["events"]]
+        cursor = resp_json["next_cursor"]
+        while cursor:
+            resp_json = self.client.get(history_url + f"?limit=3&cursor={cursor}").json()
+            seen += [e["msg"]["id"] for e in resp_json["events"]]
+            cursor = resp_json["next_cursor"]
+
+        self.assertEqual([msgs[i].id for i in (0, 4, 3, 2, 1, 5, 6)], seen)
+
+        # invalid cursors are 404s
+        response = self.client.get(history_url + "?cursor=xyz")
+        self.assertEqual(404, response.status_code)
+
+    def test_history_cursor_across_windows(self):
+        history_url = reverse("contacts.contact_history", args=[self.joe.uuid])
+
+        now = timezone.now()
+        Contact.objects.filter(id=self.joe.id).update(created_on=now - timedelta(days=200))
+
+        # create 7 recent messages and 2 which are in the previous 90 day window
+        times = [now - timedelta(minutes=m) for m in range(1, 8)] + [now - timedelta(days=d) for d in (100, 101)]
+        msgs = [self.create_incoming_msg(self.joe, f"Message {i}", created_on=t) for i, t in enumerate(times)]
+
+        self.login(self.admin)
+
+        # page through with a limit small enough that a page can fill up part way through a window, which mustn't
+        # move on to the next window and leave a gap
+        resp_json = self.client.get(history_url + "?limit=3").json()
+        pages = [[e["msg"]["id"] for e in resp_json["events"]]]
+        while resp_json["next_cursor"]:
+            resp_json = self.client.get(history_url + f"?limit=3&cursor={resp_json['next_cursor']}").json()
+            pages.append([e["msg"]["id"] for e in resp_json["events"]])
+
+        self.assertEqual([m.id for m in msgs], [i for page in pages for i in page])
+        self.assertTrue(all(len(page) <= 3 for page in pages))
+
+    def test_history_concurrent_sources(self):
+        self.create_incoming_msg(self.joe, "Hello")
+        self.create_outgoing_msg(self.joe, "Hi there")
+        self.create_incoming_msg(self.joe, "Goodbye")
+
+        history_url = reverse("contacts.contact_history", args=[self.joe.uuid])
+        self.login(self.admin)
+
+        with override_settings(CONTACT_HISTORY_WORKERS=0):
+            expected = self.client.get(history_url).json()["events"]
+
+        self.assertEqual(3, len(expected))
+
+        # worker threads would normally get their own database connections which can't see data created inside this
+        # test's transaction, so have them use this thread's connection
+        conn = connections["default"]
+        conn.inc_thread_sharing()
+        executor = ThreadPoolExecutor(max_workers=2, initializer=lambda: connections.__setitem__("default", conn))
+
+        try:
+            with override_settings(CONTACT_HISTORY_WORKERS=2), patch(
+                "temba.contacts.models._history_executor", executor
+            ), patch("temba.contacts.models.close_old_connections"):
+                self.assertEqual(expected, self.client.get(history_url).json()["events"])
+                self.assertEqual(
+                    [[1, 2], [], ["a"]], fetch_history_sources([lambda: [1, 2], lambda: [], lambda: ["a"]])
+                )
+        finally:
+            executor.shutdown()
+            conn.dec_thread_sharing()
+
+    @override_settings(SESSION_EVENTS_CACHE_TTL=60)
+    def test_history_session_events_cache(self):
+        flow = self.get_flow("color_v13")
+        nodes = flow.get_definition()["nodes"]
+        (
+            MockSessionWriter(self.joe, flow)
+            .visit(nodes[0])
+            .set_contact_name("Joe")
+            .set_result("Color", "red", "Red", "it's red")
+            .fail("this is a failure")
+            .save()
+        )
+        session = FlowSession.objects.get(contact=self.joe)
+        after, before = session.created_on - timedelta(days=1), timezone.now() + timedelta(days=1)
+        types = {"contact_name_changed", "run_result_changed", "failure"}
+
+        def event_types():
+            return [e["type"] for e in self.joe.get_session_events(after, before, types)]
+
+        # session has ended so its events are cached on first read
+        self.assertEqual(["contact_name_changed", "run_result_changed", "failure"], event_types())
+        self.assertTrue(get_redis_connection().exists(f"session_events:{session.uuid}"))
+
+        # and subsequent reads don't need to load the session output
+        with self.assertNumQueries(1):
+            self.assertEqual(["contact_name_changed", "run_result_changed", "failure"], event_types())
+
+        # events are still filtered by type and time
+        types = {"failure"}
+        self.assertEqual(["failure"], event_types())
+        before = session.created_on - timedelta(hours=1)
+        self.assertEqual([], event_types())
+
     def test_msg_status_badge(self):
         msg = self.create_outgoing_msg(self.joe, "This is an outgoing message")
 
@@ -3058,6 +3249,68 @@ class ContactURNTest(TembaTest):
         self.assertEqual("+250788111111", contact1.urns.get().path)
         self.assertEqual("+250788222222", contact2.urns.get().path)
 
+    @patch("temba.contacts.models.ContactURN.NORMALIZE_RANGE_SIZE", 2)
+    @patch("temba.contacts.models.ContactURN.NORMALIZE_BATCH_SIZE", 1)
+    def test_normalize_contact_tels(self):
+        contact = self.create_contact("Bob")
+
+        def create_urn(path, org=self.org):
+            return ContactURN.objects.create(
+                org=org, contact=contact if org == self.org else None, scheme="tel", path=path, identity=f"tel:{path}"
+            )
+
+        urn1 = create_urn("0788111111")
+        urn2 = create_urn("+250788111111")  # already normalized version of urn1
+        urn3 = create_urn("0788222222")
+        urn4 = create_urn("788222222")  # normalizes to the same number as urn3
+        urn5 = create_urn("0788333333")
+        urn6 = create_urn("MTN")  # can't be normalized
+        urn7 = create_urn("0788444444", org=self.org2)
+
+        self.assertEqual(
+            [(urn1.id, urn4.id), (urn4.id, urn6.id), (urn6.id, None)], ContactURN.get_normalize_ranges(self.org)
+        )
+
+        # a retried range task resumes from its last completed batch
+        r = get_redis_connection()
+        r.hset(f"normalize_contact_tels:{self.org.id}", urn6.id, urn6.id)
+
+        self.org.normalize_contact_tels()
+
+        def path(urn):
+            urn.refresh_from_db()
+            return urn.path
+
+        self.assertEqual("0788111111", path(urn1))  # would collide with urn2
+        self.assertEqual("+250788111111", path(urn2))
+        self.assertEqual("+250788222222", path(urn3))
+        self.assertEqual("788222222", path(urn4))  # would collide with urn3
+        self.assertEqual("+250788333333", path(urn5))
+        self.assertEqual("MTN", path(urn6))  # skipped because its range was already marked as done
+        self.assertEqual("0788444444", path(urn7))  # other org not touched
+        self.assertEqual({}, r.hgetall(f"normalize_contact_tels:{self.org.id}"))
+
+        # collisions within a batch only let the first URN take the identity
+        urn8 = create_urn("0788555555")
+        urn9 = create_urn("788555555")
+
+        self.assertEqual(
+            1, ContactURN.bulk_normalize_numbers(self.org, "RW", [(urn8.id, urn8.path), (urn9.id, urn9.path)])
+        )
+        self.assertEqual("+250788555555", path(urn8))
+        self.assertEqual("788555555", path(urn9))
+
+        # if an identity is taken during the update, we fall back to updating URNs one at a time
+        urn10 = create_urn("0788666666")
+
+        with patch("temba.contacts.models.connection") as mock_connection:
+            mock_cursor = mock_connection.cursor.return_value.__enter__.return_value
+            mock_cursor.execute.side_effect = IntegrityError("duplicate key")
+
+            self.assertEqual(1, ContactURN.bulk_normalize_numbers(self.org, "RW", [(urn10.id, urn10.path)]))
+
+        self.assertEqual("+250788666666", path(urn10))
+
 
 class ContactFieldTest(TembaTest):
     def setUp(self):
@@ -4451,6 +4704,36 @@ class URNTest(TembaTest):
         # external ids are case sensitive
         self.assertEqual(URN.normalize("ext: eXterNAL123 "), "ext:eXterNAL123")
 
+    def test_normalize_many(self):
+        self.assertEqual([], URN.normalize_many([], "RW"))
+        self.assertEqual(
+            ["tel:+250788383383", "xxxx", "twitter:jimmyjo", "tel:+250788383383"],
+            URN.normalize_many(["tel:0788383383", "xxxx", "twitter: @jimmyJO", "tel:0788383383"], "RW"),
+        )
+
+    def test_caches(self):
+        URN.clear_caches()
+
+        self.assertEqual({"hits": 0, "misses": 0, "size": 0, "hit_rate": 0.0}, URN.get_cache_stats()["normalize"])
+
+        self.assertEqual("tel:+250788383383", URN.normalize("tel:0788383383", "RW"))
+        self.assertEqual("tel:+250788383383", URN.normalize("tel:0788383383", country_code="RW"))
+        self.assertTrue(URN.validate("tel:+250788383383"))
+        self.assertTrue(URN.validate("tel:+250788383383", None))
+        self.assertFalse(URN.validate("tel:MTN", "RW"))
+
+        stats = URN.get_cache_stats()
+        self.assertEqual({"hits": 1, "misses": 1, "size": 1, "hit_rate": 0.5}, stats["normalize"])
+        self.assertEqual({"hits": 1, "misses": 2, "size": 2, "hit_rate": 1 / 3}, stats["validate"])
+
+        # errors aren't cached
+        self.assertRaises(ValueError, URN.normalize, "xxxx")
+        self.assertEqual(1, URN.get_cache_stats()["normalize"]["size"])
+
+        URN.clear_caches()
+
+        self.assertEqual(0, URN.get_cache_stats()["normalize"]["size"])
+
     def test_validate(self):
         self.assertFalse(URN.validate("xxxx", None))  # un-parseable URNs don't validate
 
@@ -4705,6 +4988,20 @@ class ContactImportTest(TembaTest):
         self.assertEqual(2, batches[1].record_start)
         self.assertEqual(3, batches[1].record_end)
 
+        # batches are inserted in chunks but still queued in order
+        with patch("temba.contacts.models.ContactImport.BATCH_SIZE", 1):
+            with patch("temba.contacts.models.ContactImport.BATCH_INSERT_SIZE", 2):
+                imp2 = self.create_contact_import("media/test_imports/simple.xlsx")
+                imp2.start()
+
+        batches2 = list(imp2.batches.order_by("id"))
+        self.assertEqual([(0, 1), (1, 2), (2, 3)], [(b.record_start, b.record_end) for b in batches2])
+        self.assertEqual(
+            [b.id for b in batches2],
+            [t["task"]["contact_import_batch_id"] for t in mr_mocks.queued_batch_tasks[-3:]],
+        )
+        self.assertEqual(["tel:+250788383385"], batches2[2].specs[0]["urns"])
+
         # info is calculated across all batches
         self.assertEqual(
             {
@@ -1,6 +1,7 @@
+import base64
 import logging
 from collections import OrderedDict
-from datetime import timedelta
+from datetime import datetime, timedelta, timezone as tzone
 from urllib.parse import quote_plus
 
 import iso8601
@@ -33,7 +34,7 @@ from django.views import View
 
 from temba.archives.models import Archive
 from temba.channels.models import Channel
-from temba.mailroom.events import Event
+from temba.mailroom.events import Event, get_event_time
 from temba.notifications.views import NotificationTargetMixin
 from temba.orgs.models import User
 from temba.orgs.views import (
@@ -91,6 +92,24 @@ HISTORY_INCLUDE_EVENTS = {
 }
 
 
+def encode_history_cursor(last_time: datetime, num_at_time: int) -> str:
+    """
+    Encodes an opaque cursor for the history page after one which ended with num_at_time items at last_time
+    """
+    return base64.urlsafe_b64encode(f"{datetime_to_timestamp(last_time)}:{num_at_time}".encode()).decode()
+
+
+def decode_history_cursor(cursor: str) -> tuple:
+    """
+    Decodes a history cursor into the time and number of items at that time which have already been returned
+    """
+    try:
+        timestamp, num_at_time = base64.urlsafe_b64decode(cursor.encode()).decode().split(":")
+        return datetime(1970, 1, 1, tzinfo=tzone.utc) + timedelta(microseconds=int(timestamp)), int(num_at_time)
+    except (ValueError, UnicodeDecodeError):
+        raise Http404("Invalid history cursor")
+
+
 class ContactGroupForm(forms.ModelForm):
     preselected_contacts = forms.CharField(required=False, widget=forms.HiddenInput)
     group_query = forms.CharField(required=False, widget=forms.HiddenInput)
@@ -449,6 +468,13 @@ class UpdateContactForm(ContactForm):
 
 
 class ExportForm(Form):
+    format = forms.ChoiceField(
+        choices=ExportContactsTask.FORMAT_CHOICES,
+        initial=ExportContactsTask.FORMAT_XLSX,
+        required=False,
+        label=_("Format"),
+        widget=SelectWidget(),
+    )
     group_memberships = forms.ModelMultipleChoiceField(
         queryset=ContactGroup.objects.none(),
         required=False,
@@ -469,6 +495,9 @@ class ExportForm(Form):
             "Include group membership only for these groups. " "(Leave blank to ignore group memberships)."
         )
 
+    def clean_format(self):
+        return self.cleaned_data["format"] or ExportContactsTask.FORMAT_XLSX
+
 
 class ContactCRUDL(SmartCRUDL):
     model = Contact
@@ -629,7 +658,9 @@ class ContactCRUDL(SmartCRUDL):
                 ):  # pragma: needs cover
                     analytics.track(self.request.user, "temba.contact_exported")
 
-                export = ExportContactsTask.create(org, user, group, search, group_memberships)
+                export = ExportContactsTask.create(
+                    org, user, group, search, group_memberships, format=form.cleaned_data["format"]
+                )
 
                 # schedule the export job
                 on_transaction_commit(lambda: export_contacts_task.delay(export.pk))
@@ -666,7 +697,8 @@ class ContactCRUDL(SmartCRUDL):
 
         def get_queryset(self, **kwargs):
             org = self.derive_org()
-            return omnibox_query(org, **{k: v for k, v in self.request.GET.items()})
+            params = {k: v for k, v in self.request.GET.items() if k != "user"}
+            return omnibox_query(org, user=self.request.user, **params)
 
         def render_to_response(self, context, **response_kwargs):
             org = self.derive_org()
@@ -755,13 +787,20 @@ class ContactCRUDL(SmartCRUDL):
             before = int(self.request.GET.get("before", 0))
             after = int(self.request.GET.get("after", 0))
             limit = int(self.request.GET.get("limit", 50))
+            cursor = self.request.GET.get("cursor")
 
             ticket_uuid = self.request.GET.get("ticket")
             ticket = contact.org.tickets.filter(uuid=ticket_uuid).first()
 
+            # a cursor resumes from the time of the last item of the previous page, skipping the items at that time
+            # which were already returned
+            cursor_time, skip = decode_history_cursor(cursor) if cursor else (None, 0)
+
             # if we want an expanding window, or just all the recent activity
             recent_only = False
-            if not before:
+            if cursor_time:
+                before = cursor_time + timedelta(microseconds=1)
+            elif not before:
                 recent_only = True
                 before = timezone.now()
             else:
@@ -775,9 +814,19 @@ class ContactCRUDL(SmartCRUDL):
             # keep looking further back until we get at least 20 items
             history = []
             fetch_before = before
+            fetch_skip = skip
             while True:
-                history += contact.get_history(after, fetch_before, HISTORY_INCLUDE_EVENTS, ticket=ticket, limit=limit)
-                if recent_only or len(history) >= 20 or after == contact_creation:
+                fetch_limit = limit - len(history) + fetch_skip
+                items = contact.get_history(
+                    after, fetch_before, HISTORY_INCLUDE_EVENTS, ticket=ticket, limit=fetch_limit
+                )
+                history += items[fetch_skip:]
+                fetch_skip = 0
+
+                # if this window was truncated, it may have more items which we'd skip over by looking further back
+                truncated = len(items) == fetch_limit
+
+                if recent_only or truncated or len(history) >= 20 or after == contact_creation:
                     break
                 else:
                     fetch_before = after
@@ -792,9 +841,16 @@ class ContactCRUDL(SmartCRUDL):
             # check if there are more pages to fetch
             context["has_older"] = False
             if not recent_only and before > contact.created_on:
-                context["has_older"] = bool(
-                    contact.get_history(contact_creation, after, HISTORY_INCLUDE_EVENTS, ticket=ticket, limit=1)
-                )
+                context["has_older"] = contact.has_history(contact_creation, after, HISTORY_INCLUDE_EVENTS, ticket)
+
+            context["next_cursor"] = None
+            if history:
+                last_time = get_event_time(history[-1])
+                num_at_time = len([i for i in history if get_event_time(i) == last_time])
+                if last_time == cursor_time and num_at_time == len(history):
+                    num_at_time += skip
+
+                context["next_cursor"] = encode_history_cursor(last_time, num_at_time)
 
             context["recent_only"] = recent_only
             context["next_before"] = datetime_to_timestamp(after)
@@ -810,6 +866,7 @@ class ContactCRUDL(SmartCRUDL):
                     "recent_only": context["recent_only"],
                     "next_before": context["next_before"],
                     "next_after": context["next_after"],
+                    "next_cursor": context["next_cursor"],
                     "start_date": context["start_date"],
                     "events": context["events"],
                 }
@@ -1,9 +1,10 @@
 from django.urls import reverse
 
-from temba.tests import TembaTest
+from temba.mailroom import HIGH_PRIORITY, interrupt_task, queue_batch_tasks
+from temba.tests import CRUDLTestMixin, TembaTest
 
 
-class DashboardTest(TembaTest):
+class DashboardTest(CRUDLTestMixin, TembaTest):
     def setUp(self):
         super().setUp()
 
@@ -100,3 +101,30 @@ class DashboardTest(TembaTest):
         self.assertEqual("Android", response.context["channel_types"][0]["channel__name"])
         self.assertEqual(7, len(response.context["channel_types"]))
         self.assertEqual("Other", response.context["channel_types"][6]["channel__name"])
+
+    def test_queues(self):
+        url = reverse("dashboard.dashboard_queues")
+
+        response = self.assertStaffOnly(url)
+        self.assertEqual([], response.context["queues"])
+        self.assertContains(response, "No active queues")
+
+        flow = self.create_flow("Test")
+        jim = self.create_contact("Jim", phone="+12065551212")
+        queue_batch_tasks(
+            [
+                interrupt_task(self.org, contacts=[jim]),
+                interrupt_task(self.org, flow=flow),
+                interrupt_task(self.org2, flow=flow),
+            ],
+            HIGH_PRIORITY,
+        )
+
+        response = self.requestView(url, self.customer_support)
+        self.assertEqual(
+            [(self.org, "batch", 2), (self.org2, "batch", 1)],
+            [(q["org"], q["queue"], q["size"]) for q in response.context["queues"]],
+        )
+        self.assertEqual(3, response.context["total_size"])
+        self.assertEqual(0, response.context["num_hidden"])
+        self.assertContains(response, "Trileet Inc.")
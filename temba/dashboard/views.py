@@ -9,9 +9,10 @@ from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 from temba.channels.models import Channel, ChannelCount
+from temba.mailroom.queue import get_queue_stats
 from temba.orgs.models import Org
 from temba.orgs.views import OrgPermsMixin
-from temba.utils.views import SpaMixin
+from temba.utils.views import SpaMixin, StaffOnlyMixin
 
 flattened_colors = [
     "#335c81",
@@ -46,6 +47,30 @@ class Home(SpaMixin, OrgPermsMixin, SmartTemplateView):
     menu_path = "/settings/dashboard"
 
 
+class Queues(StaffOnlyMixin, SpaMixin, SmartTemplateView):
+    """
+    Staff view of the mailroom task queues of each active org
+    """
+
+    MAX_QUEUES = 100
+
+    title = _("Queues")
+    template_name = "dashboard/queues.html"
+    menu_path = "/staff/queues"
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+
+        stats = get_queue_stats()
+        shown = stats[: self.MAX_QUEUES]
+        orgs_by_id = Org.objects.filter(id__in=[s["org_id"] for s in shown]).in_bulk()
+
+        context["queues"] = [{**s, "org": orgs_by_id.get(s["org_id"])} for s in shown]
+        context["num_hidden"] = len(stats) - len(shown)
+        context["total_size"] = sum(s["size"] for s in stats)
+        return context
+
+
 class MessageHistory(OrgPermsMixin, SmartTemplateView):
     """
     Endpoint to expose message history since the dawn of time by day as JSON blob
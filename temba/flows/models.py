@@ -1,18 +1,19 @@
 import logging
+import os
 from array import array
 from collections import defaultdict
-from datetime import datetime, timezone as tzone
+from datetime import datetime, timedelta, timezone as tzone
 
 import iso8601
 from django_redis import get_redis_connection
 from packaging.version import Version
-from xlsxlite.writer import XLSXBook
 
 from django.conf import settings
 from django.contrib.postgres.fields import ArrayField
-from django.core.files.temp import NamedTemporaryFile
+from django.core.files import File
+from django.core.files.storage import default_storage
 from django.db import models, transaction
-from django.db.models import Max, Prefetch, Q, Sum
+from django.db.models import Max, Prefetch, Q, Sum, prefetch_related_objects
 from django.db.models.functions import Lower, TruncDate
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
@@ -29,7 +30,7 @@ from temba.orgs.models import DependencyMixin, Org, User
 from temba.templates.models import Template
 from temba.tickets.models import Topic
 from temba.utils import analytics, chunk_list, json, on_transaction_commit, s3
-from temba.utils.export import BaseExportAssetStore, BaseItemWithContactExport
+from temba.utils.export import BaseExport, BaseExportAssetStore, BaseItemWithContactExport, PartExporter
 from temba.utils.models import JSONAsTextField, LegacyUUIDMixin, SquashableModel, TembaModel, delete_in_batches
 from temba.utils.uuid import uuid4
 
@@ -601,8 +602,27 @@ class Flow(LegacyUUIDMixin, TembaModel, DependencyMixin):
 
         self.save_revision(user, definition)
 
+    @classmethod
+    def prefetch_run_stats_and_labels(cls, flows, *, using: str = "default"):
+        """
+        Bulk loads the run status totals and labels of the given flows for listing, in a single query each
+        """
+        flows = list(flows)
+        totals = FlowRunStatusCount.get_bulk_totals(flows, using=using)
+
+        for flow in flows:
+            flow._run_totals_cache = totals[flow]
+
+        prefetch_related_objects(
+            flows, Prefetch("labels", queryset=FlowLabel.objects.using(using).only("uuid", "name").order_by("id"))
+        )
+
     def get_run_stats(self):
-        totals_by_status = FlowRunStatusCount.get_totals(self)
+        if hasattr(self, "_run_totals_cache"):
+            totals_by_status = self._run_totals_cache
+        else:
+            totals_by_status = FlowRunStatusCount.get_totals(self)
+
         total_runs = sum(totals_by_status.values())
         completed = totals_by_status.get(FlowRun.STATUS_COMPLETED, 0)
 
@@ -1050,6 +1070,17 @@ class FlowSession(models.Model):
         else:
             return self.output
 
+    def get_events(self) -> list:
+        """
+        Gets the events of all runs in this session, tagged with this session's UUID
+        """
+        events = []
+        for run in self.output_json.get("runs", []):
+            for event in run.get("events", []):
+                event["session_uuid"] = str(self.uuid)
+                events.append(event)
+        return events
+
     def delete(self):
         for run in self.runs.all():
             run.delete()
@@ -1444,31 +1475,6 @@ class FlowCategoryCount(SquashableModel):
     # the number of results with this category
     count = models.IntegerField(default=0)
 
-    @classmethod
-    def get_squash_query(cls, distinct_set):
-        sql = """
-        WITH removed as (
-          DELETE FROM %(table)s WHERE "id" IN (
-            SELECT "id" FROM %(table)s
-              WHERE "flow_id" = %%s AND "node_uuid" = %%s AND "result_key" = %%s AND "result_name" = %%s AND "category_name" = %%s
-              LIMIT 10000
-          ) RETURNING "count"
-        )
-        INSERT INTO %(table)s("flow_id", "node_uuid", "result_key", "result_name", "category_name", "count", "is_squashed")
-        VALUES (%%s, %%s, %%s, %%s, %%s, GREATEST(0, (SELECT SUM("count") FROM removed)), TRUE);
-        """ % {
-            "table": cls._meta.db_table
-        }
-
-        params = (
-            distinct_set.flow_id,
-            distinct_set.node_uuid,
-            distinct_set.result_key,
-            distinct_set.result_name,
-            distinct_set.category_name,
-        ) * 2
-        return sql, params
-
     def __str__(self):
         return "%s: %s" % (self.category_name, self.count)
 
@@ -1503,21 +1509,6 @@ class FlowPathCount(SquashableModel):
     # the number of runs that tooks this path segment in that period
     count = models.IntegerField(default=0)
 
-    @classmethod
-    def get_squash_query(cls, distinct_set):
-        sql = """
-        WITH removed as (
-            DELETE FROM %(table)s WHERE "flow_id" = %%s AND "from_uuid" = %%s AND "to_uuid" = %%s AND "period" = date_trunc('hour', %%s) RETURNING "count"
-        )
-        INSERT INTO %(table)s("flow_id", "from_uuid", "to_uuid", "period", "count", "is_squashed")
-        VALUES (%%s, %%s, %%s, date_trunc('hour', %%s), GREATEST(0, (SELECT SUM("count") FROM removed)), TRUE);
-        """ % {
-            "table": cls._meta.db_table
-        }
-
-        params = (distinct_set.flow_id, distinct_set.from_uuid, distinct_set.to_uuid, distinct_set.period) * 2
-        return sql, params
-
     @classmethod
     def get_totals(cls, flow):
         counts = cls.objects.filter(flow=flow)
@@ -1540,6 +1531,7 @@ class FlowNodeCount(SquashableModel):
     """
 
     squash_over = ("node_uuid",)
+    squash_carry = ("flow_id",)
 
     flow = models.ForeignKey(Flow, on_delete=models.PROTECT, related_name="node_counts")
 
@@ -1549,20 +1541,6 @@ class FlowNodeCount(SquashableModel):
     # the number of contacts/runs currently at that node
     count = models.IntegerField(default=0)
 
-    @classmethod
-    def get_squash_query(cls, distinct_set):
-        sql = """
-        WITH removed as (
-            DELETE FROM %(table)s WHERE "node_uuid" = %%s RETURNING "count"
-        )
-        INSERT INTO %(table)s("flow_id", "node_uuid", "count", "is_squashed")
-        VALUES (%%s, %%s, GREATEST(0, (SELECT SUM("count") FROM removed)), TRUE);
-        """ % {
-            "table": cls._meta.db_table
-        }
-
-        return sql, (distinct_set.node_uuid, distinct_set.flow_id, distinct_set.node_uuid)
-
     @classmethod
     def get_totals(cls, flow):
         totals = list(cls.objects.filter(flow=flow).values_list("node_uuid").annotate(replies=Sum("count")))
@@ -1587,23 +1565,33 @@ class FlowRunStatusCount(SquashableModel):
     status = models.CharField(max_length=1, choices=FlowRun.STATUS_CHOICES)
     count = models.IntegerField(default=0)
 
-    @classmethod
-    def get_squash_query(cls, distinct_set):
-        sql = r"""
-        WITH removed as (
-            DELETE FROM flows_flowrunstatuscount WHERE "flow_id" = %s AND "status" = %s RETURNING "count"
-        )
-        INSERT INTO flows_flowrunstatuscount("flow_id", "status", "count", "is_squashed")
-        VALUES (%s, %s, GREATEST(0, (SELECT SUM("count") FROM removed)), TRUE);
-        """
-
-        return sql, (distinct_set.flow_id, distinct_set.status) * 2
-
     @classmethod
     def get_totals(cls, flow):
         totals = list(cls.objects.filter(flow=flow).values_list("status").annotate(total=Sum("count")))
         return {t[0]: t[1] for t in totals}
 
+    @classmethod
+    def get_bulk_totals(cls, flows, *, using: str = "default") -> dict:
+        """
+        Gets the totals by status of each of the given flows in a single query
+        """
+        flows = list(flows)
+        if not flows:
+            return {}
+
+        counts = (
+            cls.objects.using(using)
+            .filter(flow_id__in=[f.id for f in flows])
+            .values_list("flow_id", "status")
+            .annotate(total=Sum("count"))
+        )
+
+        totals_by_flow_id = defaultdict(dict)
+        for flow_id, status, total in counts:
+            totals_by_flow_id[flow_id][status] = total
+
+        return {f: totals_by_flow_id[f.id] for f in flows}
+
     class Meta:
         indexes = [
             models.Index(fields=("flow", "status")),
@@ -1622,6 +1610,12 @@ class ExportFlowResultsTask(BaseItemWithContactExport):
 
     RESPONDED_ONLY = "responded_only"
     EXTRA_URNS = "extra_urns"
+    SHARDS = "shards"
+
+    # exports spanning at least twice this many days are split by date range into shards which are written in parallel
+    SHARD_MIN_DAYS = 30
+    MAX_SHARDS = 8
+    MAX_SHARD_ATTEMPTS = 3
 
     flows = models.ManyToManyField(Flow, related_name="exports", help_text=_("The flows to export"))
 
@@ -1632,11 +1626,29 @@ class ExportFlowResultsTask(BaseItemWithContactExport):
     config = JSONAsTextField(null=True, default=dict, help_text=_("Any configuration options for this flow export"))
 
     @classmethod
-    def create(cls, org, user, start_date, end_date, flows, with_fields, with_groups, responded_only, extra_urns):
+    def create(
+        cls,
+        org,
+        user,
+        start_date,
+        end_date,
+        flows,
+        with_fields,
+        with_groups,
+        responded_only,
+        extra_urns,
+        format=BaseExport.FORMAT_XLSX,
+    ):
         config = {ExportFlowResultsTask.RESPONDED_ONLY: responded_only, ExportFlowResultsTask.EXTRA_URNS: extra_urns}
 
         export = cls.objects.create(
-            org=org, created_by=user, start_date=start_date, end_date=end_date, modified_by=user, config=config
+            org=org,
+            created_by=user,
+            start_date=start_date,
+            end_date=end_date,
+            format=format,
+            modified_by=user,
+            config=config,
         )
         export.flows.add(*flows)
         export.with_fields.add(*with_fields)
@@ -1667,15 +1679,10 @@ class ExportFlowResultsTask(BaseItemWithContactExport):
 
         return columns
 
-    def _add_runs_sheet(self, book, columns):
-        name = "Runs (%d)" % (book.num_runs_sheets + 1) if book.num_runs_sheets > 0 else "Runs"
-        sheet = book.add_sheet(name, index=book.num_runs_sheets)
-        book.num_runs_sheets += 1
-
-        self.append_row(sheet, columns)
-        return sheet
-
-    def write_export(self):
+    def _get_export_params(self) -> tuple:
+        """
+        Gets the flows, result fields and URN columns which determine the layout of this export
+        """
         config = self.config
         responded_only = config.get(ExportFlowResultsTask.RESPONDED_ONLY, True)
         extra_urns = config.get(ExportFlowResultsTask.EXTRA_URNS, [])
@@ -1701,35 +1708,189 @@ class ExportFlowResultsTask(BaseItemWithContactExport):
                 label = f"URN:{extra_urn.capitalize()}"
                 extra_urn_columns.append(dict(label=label, scheme=extra_urn))
 
-        runs_columns = self._get_runs_columns(extra_urn_columns, result_fields, show_submitted_by=show_submitted_by)
+        return flows, responded_only, extra_urn_columns, show_submitted_by, result_fields
 
-        book = XLSXBook()
-        book.num_runs_sheets = 0
-        book.num_msgs_sheets = 0
+    def perform(self):
+        """
+        Performs this export. Exports with large date ranges are split into shards which are written in parallel by
+        separate tasks, and the export is only generated from them once every shard has completed.
+        """
+        shards = self.config.get(self.SHARDS)
+        if shards is None:
+            shards = self._get_shard_ranges()
+            if shards:
+                self.config[self.SHARDS] = [
+                    {
+                        "start": s.isoformat(),
+                        "end": e.isoformat(),
+                        "status": self.STATUS_PENDING,
+                        "attempts": 0,
+                        "runs": 0,
+                    }
+                    for s, e in shards
+                ]
+                self.save(update_fields=("config",))
 
-        # the current sheets
-        book.current_runs_sheet = self._add_runs_sheet(book, runs_columns)
-        book.current_msgs_sheet = None
+        if shards and not self._shards_complete():
+            self._start_shards()
+        else:
+            super().perform()
+
+    def _get_shard_ranges(self) -> list:
+        """
+        Splits the date range of this export into shards, returning an empty list if it's too small to be worth it
+        """
+        flows = list(self.flows.filter(is_active=True))
+        if not flows:
+            return []
 
         start_date, end_date = self._get_date_range()
+        start_date = max(start_date, min(f.created_on for f in flows))
+
+        num_shards = min((end_date - start_date).days // self.SHARD_MIN_DAYS, self.MAX_SHARDS)
+        if num_shards < 2:
+            return []
+
+        # shards don't overlap, so a run created on a boundary is only exported by the shard which starts with it
+        step = (end_date - start_date) / num_shards
+        starts = [start_date + step * i for i in range(num_shards)]
+        ends = [s - timedelta(microseconds=1) for s in starts[1:]] + [end_date]
+
+        return list(zip(starts, ends))
+
+    def _shards_complete(self) -> bool:
+        return all(s["status"] == self.STATUS_COMPLETE for s in self.config[self.SHARDS])
+
+    def _start_shards(self):
+        """
+        Queues tasks for all the shards of this export which haven't completed, failing the export if any of them
+        have already used up their attempts
+        """
+        from .tasks import export_flow_results_shard_task
+
+        with transaction.atomic():
+            export = ExportFlowResultsTask.objects.select_for_update().get(id=self.id)
+            shards = export.config[self.SHARDS]
+            to_start = [i for i, s in enumerate(shards) if s["status"] != self.STATUS_COMPLETE]
+
+            if any(shards[i]["attempts"] >= self.MAX_SHARD_ATTEMPTS for i in to_start):
+                export.status = self.STATUS_FAILED
+                to_start = []
+            else:
+                export.status = self.STATUS_PROCESSING
+                for i in to_start:
+                    shards[i].update(status=self.STATUS_PENDING, attempts=shards[i]["attempts"] + 1, runs=0)
+
+            export.modified_on = timezone.now()
+            export.save(update_fields=("status", "config", "modified_on"))
+
+        self.status, self.config = export.status, export.config
+
+        if self.status == self.STATUS_FAILED:
+            logger.error(f"Results export #{self.id} for org #{self.org.id}: shards failed too many times")
+
+        for i in to_start:
+            export_flow_results_shard_task.delay(self.id, i)
+
+    def perform_shard(self, shard: int):
+        """
+        Writes a single shard of this export, and if it's the last shard to complete, queues generation of the export
+        """
+        from .tasks import export_flow_results_task
+
+        try:
+            num_runs = self._write_shard(shard)
+        except Exception as e:
+            logger.error(f"Unable to write results export shard: {str(e)}", exc_info=True)
+            self._update_shard(shard, status=self.STATUS_FAILED)
+
+            raise e  # log the error to sentry
+        else:
+            if self._update_shard(shard, status=self.STATUS_COMPLETE, runs=num_runs):
+                export_flow_results_task.delay(self.id)
+
+    def _write_shard(self, shard: int) -> int:
+        """
+        Writes the rows of the given shard to storage, returning the number of runs written
+        """
+        flows, responded_only, extra_urn_columns, show_submitted_by, result_fields = self._get_export_params()
+        runs_columns = self._get_runs_columns(extra_urn_columns, result_fields, show_submitted_by=show_submitted_by)
+        shard_config = self.config[self.SHARDS][shard]
+        start_date = iso8601.parse_date(shard_config["start"])
+        end_date = iso8601.parse_date(shard_config["end"])
+        num_runs = 0
+
+        exporter = PartExporter(runs_columns, self.org.timezone)
 
         for batch in self._get_run_batches(start_date, end_date, flows, responded_only):
-            self._write_runs(
-                book,
-                batch,
-                extra_urn_columns,
-                show_submitted_by,
-                runs_columns,
-                result_fields,
-            )
+            self._write_runs(exporter, batch, extra_urn_columns, show_submitted_by, result_fields)
 
-            self.modified_on = timezone.now()
-            self.save(update_fields=("modified_on",))
+            num_runs += len(batch)
+            self._update_shard(shard, runs=num_runs)
 
-        temp = NamedTemporaryFile(delete=True)
-        book.finalize(to_file=temp)
-        temp.flush()
-        return temp, "xlsx"
+        temp_file, extension = exporter.save_file()
+        path = self._get_shard_path(shard)
+
+        # a retried shard replaces what was written by its previous attempt
+        default_storage.delete(path)
+        default_storage.save(path, File(temp_file))
+
+        temp_file.close()
+        os.unlink(temp_file.name)
+
+        return num_runs
+
+    def _update_shard(self, shard: int, **kwargs) -> bool:
+        """
+        Updates the state of the given shard, returning whether all shards are now complete
+        """
+        with transaction.atomic():
+            export = ExportFlowResultsTask.objects.select_for_update().get(id=self.id)
+            export.config[self.SHARDS][shard].update(**kwargs)
+            export.modified_on = timezone.now()
+            export.save(update_fields=("config", "modified_on"))
+
+        self.config = export.config
+
+        return self._shards_complete()
+
+    def _get_shard_path(self, shard: int) -> str:
+        return (
+            f"{settings.STORAGE_ROOT_DIR}/{self.org.id}/{ResultsExportAssetStore.directory}/{self.uuid}/{shard}.json.gz"
+        )
+
+    def write_export(self):
+        flows, responded_only, extra_urn_columns, show_submitted_by, result_fields = self._get_export_params()
+        runs_columns = self._get_runs_columns(extra_urn_columns, result_fields, show_submitted_by=show_submitted_by)
+
+        exporter = self._get_exporter("Runs", runs_columns, number_first_sheet=False)
+
+        shards = self.config.get(self.SHARDS)
+        if shards:
+            # started, modified and exited come after the contact and extra URN columns
+            started_col = runs_columns.index("Started")
+            datetime_cols = (started_col, started_col + 1, started_col + 2)
+
+            for i in range(len(shards)):
+                with default_storage.open(self._get_shard_path(i), "rb") as shard_file:
+                    for row in PartExporter.read_rows(shard_file, datetime_cols):
+                        exporter.write_row(row)
+
+                self.modified_on = timezone.now()
+                self.save(update_fields=("modified_on",))
+
+            for i in range(len(shards)):
+                default_storage.delete(self._get_shard_path(i))
+        else:
+            start_date, end_date = self._get_date_range()
+
+            for batch in self._get_run_batches(start_date, end_date, flows, responded_only):
+                self._write_runs(exporter, batch, extra_urn_columns, show_submitted_by, result_fields)
+
+                self.modified_on = timezone.now()
+                self.save(update_fields=("modified_on",))
+
+        return exporter.save_file()
 
     def _get_run_batches(self, start_date, end_date, flows, responded_only: bool):
         logger.info(f"Results export #{self.id} for org #{self.org.id}: fetching runs from archives to export...")
@@ -1787,15 +1948,7 @@ class ExportFlowResultsTask(BaseItemWithContactExport):
             # convert this batch of runs to same format as records in our archives
             yield [run.as_archive_json() for run in run_batch if run.id not in seen]
 
-    def _write_runs(
-        self,
-        book,
-        runs,
-        extra_urn_columns,
-        show_submitted_by,
-        runs_columns,
-        result_fields,
-    ):
+    def _write_runs(self, exporter, runs, extra_urn_columns, show_submitted_by, result_fields):
         """
         Writes a batch of run JSON blobs to the export
         """
@@ -1840,9 +1993,6 @@ class ExportFlowResultsTask(BaseItemWithContactExport):
                 node_input = node_result.get("input", "")
                 result_values += [node_category, node_value, node_input]
 
-            if book.current_runs_sheet.num_rows >= self.MAX_EXCEL_ROWS:  # pragma: no cover
-                book.current_runs_sheet = self._add_runs_sheet(book, runs_columns)
-
             # build the whole row
             runs_sheet_row = []
 
@@ -1858,7 +2008,7 @@ class ExportFlowResultsTask(BaseItemWithContactExport):
             ]
             runs_sheet_row += result_values
 
-            self.append_row(book.current_runs_sheet, runs_sheet_row)
+            exporter.write_row(runs_sheet_row)
 
 
 @register_asset_store
@@ -1867,7 +2017,7 @@ class ResultsExportAssetStore(BaseExportAssetStore):
     key = "results_export"
     directory = "results_exports"
     permission = "flows.flow_export_results"
-    extensions = ("xlsx",)
+    extensions = ("xlsx", "csv.gz", "jsonl.gz")
 
 
 class FlowStart(models.Model):
@@ -2029,20 +2179,6 @@ class FlowStartCount(SquashableModel):
     start = models.ForeignKey(FlowStart, on_delete=models.PROTECT, related_name="counts", db_index=True)
     count = models.IntegerField(default=0)
 
-    @classmethod
-    def get_squash_query(cls, distinct_set):
-        sql = """
-        WITH deleted as (
-            DELETE FROM %(table)s WHERE "start_id" = %%s RETURNING "count"
-        )
-        INSERT INTO %(table)s("start_id", "count", "is_squashed")
-        VALUES (%%s, GREATEST(0, (SELECT SUM("count") FROM deleted)), TRUE);
-        """ % {
-            "table": cls._meta.db_table
-        }
-
-        return sql, (distinct_set.start_id,) * 2
-
     @classmethod
     def get_count(cls, start):
         return cls.sum(start.counts.all())
@@ -57,13 +57,26 @@ def export_flow_results_task(export_id):
     ).get(id=export_id).perform()
 
 
+@shared_task
+def export_flow_results_shard_task(export_id, shard):
+    """
+    Writes a single shard of a sharded flow results export
+    """
+    ExportFlowResultsTask.objects.select_related("org", "created_by").prefetch_related(
+        Prefetch("with_fields", ContactField.objects.order_by("name")),
+        Prefetch("with_groups", ContactGroup.objects.order_by("name")),
+    ).get(id=export_id).perform_shard(shard)
+
+
 @cron_task(lock_timeout=7200)
 def squash_flow_counts():
-    FlowNodeCount.squash()
-    FlowRunStatusCount.squash()
-    FlowCategoryCount.squash()
-    FlowStartCount.squash()
-    FlowPathCount.squash()
+    return {
+        "FlowNodeCount": FlowNodeCount.squash_all(),
+        "FlowRunStatusCount": FlowRunStatusCount.squash_all(),
+        "FlowCategoryCount": FlowCategoryCount.squash_all(),
+        "FlowStartCount": FlowStartCount.squash_all(),
+        "FlowPathCount": FlowPathCount.squash_all(),
+    }
 
 
 @cron_task()
@@ -105,11 +118,14 @@ def interrupt_flow_sessions():
     for session in sessions:
         by_org[session.org].append(session)
 
+    tasks = []
     for org, sessions in by_org.items():
         for batch in chunk_list(sessions, 100):
-            mailroom.queue_interrupt(org, sessions=batch)
+            tasks.append(mailroom.interrupt_task(org, sessions=batch))
             num_interrupted += len(sessions)
 
+    mailroom.queue_batch_tasks(tasks, mailroom.HIGH_PRIORITY)
+
     return {"interrupted": num_interrupted}
 
 
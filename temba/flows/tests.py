@@ -50,6 +50,7 @@ from .models import (
     FlowVersionConflictException,
 )
 from .tasks import (
+    export_flow_results_task,
     interrupt_flow_sessions,
     squash_flow_counts,
     trim_flow_revisions,
@@ -834,6 +835,37 @@ class FlowTest(TembaTest, CRUDLTestMixin):
             flow.get_run_stats(),
         )
 
+    def test_prefetch_run_stats_and_labels(self):
+        flow1 = self.create_flow("Test 1")
+        flow2 = self.create_flow("Test 2")
+        flow3 = self.create_flow("Test 3")
+        label = FlowLabel.create(self.org, self.admin, "Important")
+        flow1.labels.add(label)
+
+        contact = self.create_contact("Bob", phone="+1234567890")
+        MockSessionWriter(contact, flow1).wait().save()
+        MockSessionWriter(contact, flow2).complete().save()
+
+        flows = list(Flow.objects.filter(id__in=[flow1.id, flow2.id, flow3.id]).order_by("id"))
+
+        with self.assertNumQueries(2):
+            Flow.prefetch_run_stats_and_labels(flows)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                [
+                    (1, {"active": 0, "waiting": 1, "completed": 0, "expired": 0, "interrupted": 0, "failed": 0}),
+                    (1, {"active": 0, "waiting": 0, "completed": 1, "expired": 0, "interrupted": 0, "failed": 0}),
+                    (0, {"active": 0, "waiting": 0, "completed": 0, "expired": 0, "interrupted": 0, "failed": 0}),
+                ],
+                [(f.get_run_stats()["total"], f.get_run_stats()["status"]) for f in flows],
+            )
+            self.assertEqual([["Important"], [], []], [[lb.name for lb in f.labels.all()] for f in flows])
+
+        # no flows, no queries
+        with self.assertNumQueries(0):
+            Flow.prefetch_run_stats_and_labels([])
+
     def test_category_counts(self):
         def assertCount(counts, result_key, category_name, truth):
             found = False
@@ -5107,6 +5139,95 @@ class ExportFlowResultsTest(TembaTest):
         self.assertEqual(1, len(list(workbook.worksheets[0].rows)))
         self.assertEqual(11, len(list(workbook.worksheets[0].columns)))
 
+    def test_sharded_export(self):
+        today = timezone.now().astimezone(self.org.timezone).date()
+        flow = self.get_flow("color_v13")
+        contact = self.create_contact("Ann", phone="+1234567890")
+
+        # make the org and flow old enough for a 90 day export to be split into 3 shards
+        self.org.created_on = timezone.now() - timedelta(days=100)
+        self.org.save(update_fields=("created_on",))
+        Flow.objects.filter(id=flow.id).update(created_on=timezone.now() - timedelta(days=100))
+
+        runs = []
+        for days_ago in (85, 50, 45, 10, 1):
+            created_on = timezone.now() - timedelta(days=days_ago)
+            runs.append(
+                FlowRun.objects.create(
+                    uuid=uuid4(),
+                    org=self.org,
+                    flow=flow,
+                    contact=contact,
+                    status=FlowRun.STATUS_COMPLETED,
+                    created_on=created_on,
+                    modified_on=created_on,
+                    exited_on=created_on,
+                )
+            )
+
+        export = ExportFlowResultsTask.create(
+            self.org, self.admin, today - timedelta(days=90), today, [flow], [], [], False, []
+        )
+
+        write_shard = ExportFlowResultsTask._write_shard
+
+        def fail_second_shard(export, shard):
+            if shard == 1:
+                raise ValueError("boom")
+            return write_shard(export, shard)
+
+        # if a shard fails, the export stays processing with the other shards intact
+        with patch("temba.flows.models.ExportFlowResultsTask._write_shard", autospec=True) as mock_write:
+            mock_write.side_effect = fail_second_shard
+
+            with self.mockReadOnly(), self.assertRaises(ValueError):
+                export_flow_results_task(export.id)
+
+        export.refresh_from_db()
+        self.assertEqual(ExportFlowResultsTask.STATUS_PROCESSING, export.status)
+        self.assertEqual(
+            [("C", 1, 1), ("F", 1, 0), ("P", 1, 0)],
+            [(s["status"], s["attempts"], s["runs"]) for s in export.config["shards"]],
+        )
+
+        # resuming only restarts the shards which didn't complete, and then merges them all
+        with self.mockReadOnly():
+            export_flow_results_task(export.id)
+
+        export.refresh_from_db()
+        self.assertEqual(ExportFlowResultsTask.STATUS_COMPLETE, export.status)
+        self.assertEqual(
+            [("C", 1, 1), ("C", 2, 2), ("C", 2, 2)],
+            [(s["status"], s["attempts"], s["runs"]) for s in export.config["shards"]],
+        )
+
+        filename = "%s/test_orgs/%d/results_exports/%s.xlsx" % (settings.MEDIA_ROOT, self.org.id, export.uuid)
+        workbook = load_workbook(filename=filename)
+        rows = list(workbook.worksheets[0].rows)
+
+        self.assertEqual(6, len(rows))  # header + 5 runs
+        self.assertEqual([str(r.uuid) for r in runs], [row[7].value for row in rows[1:]])
+        self.assertFalse(
+            os.path.exists(f"{settings.MEDIA_ROOT}/test_orgs/{self.org.id}/results_exports/{export.uuid}/0.json.gz")
+        )
+
+        # shards which keep failing eventually fail the export
+        export = ExportFlowResultsTask.create(
+            self.org, self.admin, today - timedelta(days=90), today, [flow], [], [], False, []
+        )
+
+        with patch("temba.flows.models.ExportFlowResultsTask._write_shard") as mock_write:
+            mock_write.side_effect = ValueError("boom")
+
+            for i in range(ExportFlowResultsTask.MAX_SHARD_ATTEMPTS):
+                with self.assertRaises(ValueError):
+                    export_flow_results_task(export.id)
+
+            export_flow_results_task(export.id)
+
+        export.refresh_from_db()
+        self.assertEqual(ExportFlowResultsTask.STATUS_FAILED, export.status)
+
 
 class FlowLabelTest(TembaTest):
     def test_model(self):
@@ -5219,7 +5340,7 @@ class SimulationTest(TembaTest):
         url = reverse("flows.flow_simulate", args=[flow.id])
 
         with override_settings(MAILROOM_AUTH_TOKEN="sesame", MAILROOM_URL="https://mailroom.temba.io"):
-            with patch("requests.post") as mock_post:
+            with patch("requests.Session.post") as mock_post:
                 mock_post.return_value = MockResponse(200, '{"session": {}}')
                 response = self.client.post(url, payload, content_type="application/json")
 
@@ -5257,13 +5378,13 @@ class SimulationTest(TembaTest):
         url = reverse("flows.flow_simulate", args=[flow.pk])
 
         with override_settings(MAILROOM_AUTH_TOKEN="sesame", MAILROOM_URL="https://mailroom.temba.io"):
-            with patch("requests.post") as mock_post:
+            with patch("requests.Session.post") as mock_post:
                 mock_post.return_value = MockResponse(400, '{"session": {}}')
                 response = self.client.post(url, json.dumps(payload), content_type="application/json")
                 self.assertEqual(500, response.status_code)
 
             # start a flow
-            with patch("requests.post") as mock_post:
+            with patch("requests.Session.post") as mock_post:
                 mock_post.return_value = MockResponse(200, '{"session": {}}')
                 response = self.client.post(url, json.dumps(payload), content_type="application/json")
                 self.assertEqual(200, response.status_code)
@@ -5289,12 +5410,12 @@ class SimulationTest(TembaTest):
                 "flow": {},
             }
 
-            with patch("requests.post") as mock_post:
+            with patch("requests.Session.post") as mock_post:
                 mock_post.return_value = MockResponse(400, '{"session": {}}')
                 response = self.client.post(url, json.dumps(payload), content_type="application/json")
                 self.assertEqual(500, response.status_code)
 
-            with patch("requests.post") as mock_post:
+            with patch("requests.Session.post") as mock_post:
                 mock_post.return_value = MockResponse(200, '{"session": {}}')
                 response = self.client.post(url, json.dumps(payload), content_type="application/json")
                 self.assertEqual(200, response.status_code)
@@ -705,6 +705,7 @@ class FlowCRUDL(SmartCRUDL):
             context["request_url"] = self.request.path
 
             # decorate flow objects with their run activity stats
+            Flow.prefetch_run_stats_and_labels(context["object_list"])
             for flow in context["object_list"]:
                 flow.run_stats = flow.get_run_stats()
 
@@ -1246,6 +1247,7 @@ class FlowCRUDL(SmartCRUDL):
                     with_groups=form.cleaned_data["with_groups"],
                     responded_only=responded_only,
                     extra_urns=form.cleaned_data.get(ExportFlowResultsTask.EXTRA_URNS, []),
+                    format=form.cleaned_data["format"],
                 )
                 on_transaction_commit(lambda: export_flow_results_task.delay(export.pk))
 
@@ -1,9 +1,18 @@
+import asyncio
 import logging
+import random
+import time
 from dataclasses import asdict, dataclass, field
+from datetime import timedelta
+from threading import Lock
 
 import requests
+from django_redis import get_redis_connection
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from django.conf import settings
+from django.utils import timezone
 
 from temba.utils import json
 
@@ -108,6 +117,114 @@ class StartPreview:
     total: int
 
 
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """
+    HTTP adapter which applies a default timeout to requests that don't specify one
+    """
+
+    def __init__(self, *args, timeout=None, **kwargs):
+        self.timeout = timeout
+
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, timeout=None, **kwargs):
+        return super().send(request, timeout=timeout or self.timeout, **kwargs)
+
+
+def create_session() -> requests.Session:
+    """
+    Creates a session with a pool of keep-alive connections to mailroom. Connection failures and gateway errors are
+    retried with backoff, but POSTs are never retried once they've been sent because most aren't idempotent.
+    """
+    retries = settings.MAILROOM_RETRIES
+    retry = Retry(
+        total=retries,
+        connect=retries,
+        read=0,
+        status=retries,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset({"GET"}),
+        backoff_factor=settings.MAILROOM_RETRY_BACKOFF,
+        raise_on_status=False,
+    )
+    adapter = TimeoutHTTPAdapter(
+        timeout=(settings.MAILROOM_CONNECT_TIMEOUT, settings.MAILROOM_READ_TIMEOUT),
+        pool_connections=1,
+        pool_maxsize=settings.MAILROOM_POOL_SIZE,
+        max_retries=retry,
+    )
+
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class LatencyHistograms:
+    """
+    Per-endpoint histograms of mailroom request latencies, recorded in redis so they're aggregated across all web and
+    celery processes. Each day has its own hash with fields like flow/inspect|250 for the number of requests that took
+    up to 250ms, as well as count and total_ms fields for each endpoint. Only a sample of requests are recorded so that
+    most requests don't pay for a round trip to redis, and counts are scaled back up when read.
+    """
+
+    BUCKETS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)  # upper bounds in milliseconds
+    KEY_PREFIX = "mailroom_latency"
+    KEEP_DAYS = 7
+
+    @classmethod
+    def record(cls, endpoint: str, elapsed_ms: float):
+        sample_rate = settings.MAILROOM_LATENCY_SAMPLE
+        if not sample_rate or random.random() >= sample_rate:
+            return
+
+        bucket = next((b for b in cls.BUCKETS if elapsed_ms <= b), "inf")
+        key = cls._get_key(timezone.now().date())
+
+        try:
+            r = get_redis_connection()
+            with r.pipeline(transaction=False) as pipe:
+                pipe.hincrby(key, f"{endpoint}|{bucket}", 1)
+                pipe.hincrby(key, f"{endpoint}|count", 1)
+                pipe.hincrbyfloat(key, f"{endpoint}|total_ms", round(elapsed_ms, 3))
+                pipe.expire(key, timedelta(days=cls.KEEP_DAYS))
+                pipe.execute()
+        except Exception:  # pragma: no cover
+            logger.exception("error recording mailroom latency")
+
+    @classmethod
+    def get(cls, day=None) -> dict:
+        """
+        Gets the histograms for the given day (defaults to today) as a map of endpoint to estimated count, mean and
+        number of requests in each bucket
+        """
+        sample_rate = settings.MAILROOM_LATENCY_SAMPLE or 1.0
+        r = get_redis_connection()
+        raw = r.hgetall(cls._get_key(day or timezone.now().date()))
+
+        histograms = {}
+        for field_name, value in raw.items():
+            endpoint, stat = field_name.decode().rsplit("|", 1)
+            histogram = histograms.setdefault(
+                endpoint, {"count": 0, "total_ms": 0.0, "buckets": {b: 0 for b in (*cls.BUCKETS, "inf")}}
+            )
+            if stat == "count":
+                histogram["count"] = round(int(value) / sample_rate)
+            elif stat == "total_ms":
+                histogram["total_ms"] = float(value) / sample_rate
+            else:
+                histogram["buckets"][int(stat) if stat != "inf" else stat] = round(int(value) / sample_rate)
+
+        for histogram in histograms.values():
+            histogram["mean_ms"] = histogram["total_ms"] / histogram["count"] if histogram["count"] else 0.0
+
+        return histograms
+
+    @classmethod
+    def _get_key(cls, day) -> str:
+        return f"{cls.KEY_PREFIX}:{day.isoformat()}"
+
+
 class MailroomClient:
     """
     Basic web client for mailroom
@@ -115,12 +232,15 @@ class MailroomClient:
 
     default_headers = {"User-Agent": "Temba"}
 
-    def __init__(self, base_url, auth_token):
+    def __init__(self, base_url, auth_token, session=None):
         self.base_url = base_url
+        self.auth_token = auth_token
         self.headers = self.default_headers.copy()
         if auth_token:
             self.headers["Authorization"] = "Token " + auth_token
 
+        self.session = session or create_session()
+
     def version(self):
         return self._request("", post=False).get("version")
 
@@ -335,8 +455,12 @@ class MailroomClient:
         else:
             kwargs = dict(json=payload)
 
-        req_fn = requests.post if post else requests.get
-        response = req_fn("%s/mr/%s" % (self.base_url, endpoint), headers=headers, **kwargs)
+        req_fn = self.session.post if post else self.session.get
+        start = time.perf_counter()
+        try:
+            response = req_fn("%s/mr/%s" % (self.base_url, endpoint), headers=headers, **kwargs)
+        finally:
+            LatencyHistograms.record(endpoint, (time.perf_counter() - start) * 1000)
 
         return_val = response.json() if returns_json else response.content
 
@@ -355,5 +479,46 @@ class MailroomClient:
         return return_val
 
 
+class AsyncMailroomClient:
+    """
+    Asyncio client for mailroom with the same methods as MailroomClient, for making concurrent requests. Each call runs
+    the blocking client in a worker thread, so all calls share its connection pool and concurrency is limited by the
+    pool size.
+    """
+
+    def __init__(self, client: MailroomClient):
+        self.client = client
+
+    def __getattr__(self, name):
+        method = getattr(self.client, name)
+        if name.startswith("_") or not callable(method):
+            raise AttributeError(name)
+
+        async def call(*args, **kwargs):
+            return await asyncio.to_thread(method, *args, **kwargs)
+
+        return call
+
+
+_client = None
+_client_lock = Lock()
+
+
 def get_client() -> MailroomClient:
-    return MailroomClient(settings.MAILROOM_URL, settings.MAILROOM_AUTH_TOKEN)
+    """
+    Gets the mailroom client for this process, which is shared so that requests reuse its pooled connections
+    """
+    global _client
+
+    with _client_lock:
+        if not _client or (_client.base_url, _client.auth_token) != (
+            settings.MAILROOM_URL,
+            settings.MAILROOM_AUTH_TOKEN,
+        ):
+            _client = MailroomClient(settings.MAILROOM_URL, settings.MAILROOM_AUTH_TOKEN)
+
+        return _client
+
+
+def get_async_client() -> AsyncMailroomClient:
+    return AsyncMailroomClient(get_client())
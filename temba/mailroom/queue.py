@@ -1,11 +1,16 @@
+import random
 import time
+from collections import defaultdict
+from datetime import timedelta
 from enum import Enum
 
+import iso8601
 from django_redis import get_redis_connection
 
+from django.conf import settings
 from django.utils import timezone
 
-from temba.utils import json
+from temba.utils import chunk_list, json
 
 HIGH_PRIORITY = -10000000
 DEFAULT_PRIORITY = 0
@@ -19,6 +24,22 @@ BATCH_QUEUE = "batch"
 HANDLER_QUEUE = "handler"
 
 
+# sampled counts of enqueued tasks per queue and minute
+ENQUEUED_KEY = "mailroom_enqueued:%s:%d"
+RATE_WINDOW_MINUTES = 5
+
+# the payload of the last throttled task queued for each object is remembered for this many seconds, so that further
+# throttled tasks which are identical to it can be dropped while it's still waiting in the org's batch queue
+COALESCE_KEY = "mailroom_coalesce:%d:%s:%s"
+COALESCE_EXPIRES = 60 * 60
+
+# number of orgs to read at a time when reading queue stats
+STATS_BATCH_SIZE = 500
+
+# shared encoder for task payloads, which avoids creating an encoder for every task and omits whitespace
+_encoder = json.TembaEncoder(separators=(",", ":"))
+
+
 class HandlerTask(Enum):
     CONTACT_EVENT = "handle_contact_event"
 
@@ -38,6 +59,11 @@ class BatchTask(Enum):
     INTERRUPT_CHANNEL = "interrupt_channel"
 
 
+# batch tasks which can wait behind an org's other tasks when it has a large backlog, and the field of each which
+# identifies the object it acts on
+THROTTLED_TASKS = {BatchTask.POPULATE_DYNAMIC_GROUP: "group_id"}
+
+
 def queue_msg_handling(msg):
     """
     Queues the passed in message for handling in mailroom
@@ -150,9 +176,19 @@ def queue_contact_import_batch(batch):
     Queues a task to import a batch of contacts
     """
 
-    task = {"contact_import_batch_id": batch.id}
+    queue_contact_import_batches([batch])
 
-    _queue_batch_task(batch.contact_import.org.id, BatchTask.IMPORT_CONTACT_BATCH, task, DEFAULT_PRIORITY)
+
+def queue_contact_import_batches(batches):
+    """
+    Queues tasks to import the given batches of contacts
+    """
+
+    tasks = [
+        (b.contact_import.org_id, BatchTask.IMPORT_CONTACT_BATCH, {"contact_import_batch_id": b.id}) for b in batches
+    ]
+
+    queue_batch_tasks(tasks, DEFAULT_PRIORITY)
 
 
 def queue_interrupt_channel(org, channel):
@@ -170,6 +206,14 @@ def queue_interrupt(org, *, contacts=None, flow=None, sessions=None):
     Queues an interrupt task for handling by mailroom
     """
 
+    queue_batch_tasks([interrupt_task(org, contacts=contacts, flow=flow, sessions=sessions)], HIGH_PRIORITY)
+
+
+def interrupt_task(org, *, contacts=None, flow=None, sessions=None) -> tuple:
+    """
+    Creates an interrupt task which can be queued with other tasks using queue_batch_tasks
+    """
+
     assert contacts or flow or sessions, "must specify either a set of contacts or a flow or sessions"
 
     task = {}
@@ -180,72 +224,215 @@ def queue_interrupt(org, *, contacts=None, flow=None, sessions=None):
     if sessions:
         task["session_ids"] = [s.id for s in sessions]
 
-    _queue_batch_task(org.id, BatchTask.INTERRUPT_SESSIONS, task, HIGH_PRIORITY)
+    return org.id, BatchTask.INTERRUPT_SESSIONS, task
 
 
-def _queue_batch_task(org_id, task_type, task, priority):
+def queue_batch_tasks(tasks, priority):
     """
-    Adds the passed in task to the mailroom batch queue
+    Adds the passed in (org_id, task_type, task) tuples to the mailroom batch queue. Tasks are grouped by org and
+    added in a single transaction, so queueing many tasks only takes one round trip to redis.
     """
 
+    if not tasks:
+        return
+
     r = get_redis_connection("default")
+    tasks, throttled = _throttle_tasks(r, tasks)
+
     pipe = r.pipeline()
-    _queue_task(pipe, org_id, BATCH_QUEUE, task_type, task, priority)
+    _queue_tasks(pipe, BATCH_QUEUE, tasks, priority)
+    payloads = _queue_tasks(pipe, BATCH_QUEUE, throttled, DEFAULT_PRIORITY)
+
+    # remember the payload of each throttled task so that identical tasks can be dropped while it's still queued
+    for (org_id, task_type, task), payload in zip(throttled, payloads):
+        pipe.set(_coalesce_key(org_id, task_type, task), payload, ex=COALESCE_EXPIRES)
+
     pipe.execute()
 
 
+def _queue_batch_task(org_id, task_type, task, priority):
+    """
+    Adds the passed in task to the mailroom batch queue
+    """
+
+    queue_batch_tasks([(org_id, task_type, task)], priority)
+
+
 def _queue_handler_task(org_id, contact_id, task_type, task):
     """
     Adds the passed in task to the contact's queue for mailroom to process
     """
 
     contact_queue = CONTACT_QUEUE % (org_id, contact_id)
-    contact_task = _create_mailroom_task(org_id, task_type, task)
+    contact_task = _create_mailroom_task(org_id, task_type, task, timezone.now())
 
     r = get_redis_connection("default")
     pipe = r.pipeline()
 
     # push our concrete task to the contact's queue
-    pipe.rpush(contact_queue, json.dumps(contact_task))
+    pipe.rpush(contact_queue, _encoder.encode(contact_task))
 
     # then push a contact handling event to the org queue
     event_task = {"contact_id": contact_id}
-    _queue_task(pipe, org_id, HANDLER_QUEUE, HandlerTask.CONTACT_EVENT, event_task, HIGH_PRIORITY)
+    _queue_tasks(pipe, HANDLER_QUEUE, [(org_id, HandlerTask.CONTACT_EVENT, event_task)], HIGH_PRIORITY)
     pipe.execute()
 
 
-def _queue_task(pipe, org_id, queue, task_type, task, priority):
+def _throttle_tasks(r, tasks) -> tuple[list, list]:
+    """
+    Splits the given tasks into those to queue normally and low priority tasks for orgs whose batch queues have grown
+    past the throttle backlog. The latter are queued without high priority so they wait behind the backlog, and any
+    which are identical to a throttled task for the same object that is still waiting in the queue are dropped. Tasks
+    which differ are always queued, so the last one queued always wins.
+    """
+    threshold = settings.MAILROOM_THROTTLE_BACKLOG
+    low_priority = [t for t in tasks if t[1] in THROTTLED_TASKS]
+    if not threshold or not low_priority:
+        return tasks, []
+
+    org_ids = list({t[0] for t in low_priority})
+    with r.pipeline(transaction=False) as pipe:
+        for org_id in org_ids:
+            pipe.zcard(QUEUE_PATTERN % (BATCH_QUEUE, org_id))
+        backlogged = {org_id for org_id, size in zip(org_ids, pipe.execute()) if size >= threshold}
+
+    if not backlogged:
+        return tasks, []
+
+    normal, to_throttle = [], []
+    for task in tasks:
+        (to_throttle if task[1] in THROTTLED_TASKS and task[0] in backlogged else normal).append(task)
+
+    # get the payload of the last throttled task queued for each object, and whether it's still waiting in the queue
+    previous = r.mget([_coalesce_key(org_id, task_type, task) for org_id, task_type, task in to_throttle])
+    with r.pipeline(transaction=False) as pipe:
+        for (org_id, _, _), payload in zip(to_throttle, previous):
+            pipe.zscore(QUEUE_PATTERN % (BATCH_QUEUE, org_id), payload or "")
+        still_queued = pipe.execute()
+
+    throttled = []
+    for (org_id, task_type, task), payload, score in zip(to_throttle, previous, still_queued):
+        if score is None or not _is_same_task(json.loads(payload), task_type, task):
+            throttled.append((org_id, task_type, task))
+
+    return normal, throttled
+
+
+def _coalesce_key(org_id, task_type, task) -> str:
+    return COALESCE_KEY % (org_id, task_type.value, task[THROTTLED_TASKS[task_type]])
+
+
+def _is_same_task(payload: dict, task_type, task) -> bool:
+    return payload["type"] == task_type.value and payload["task"] == json.loads(_encoder.encode(task))
+
+
+def _queue_tasks(pipe, queue, tasks, priority):
     """
-    Queues a task to mailroom
+    Queues tasks to mailroom, returning the encoded payload of each task. Tasks within one call which are identical
+    have identical payloads and so are only queued once.
 
     Args:
         pipe: an open redis pipe
-        org_id: the id of the org for this task
-        queue: the queue the task should be added to
-        task_type: the type of the task
-        task: the task definition
-        priority: the priority of this task
+        queue: the queue the tasks should be added to
+        tasks: the (org_id, task_type, task) tuples to queue
+        priority: the priority of these tasks
 
     """
 
     # our score is the time in milliseconds since epoch + any priority modifier
     score = int(round(time.time() * 1000)) + priority
+    queued_on = timezone.now()
 
-    # create our payload
-    payload = _create_mailroom_task(org_id, task_type, task)
+    # create our payloads, grouped by org, with each org's tasks a millisecond apart so they keep their order
+    payloads_by_org = defaultdict(dict)
+    encoded = []
+    for org_id, task_type, task in tasks:
+        payloads = payloads_by_org[org_id]
+        payload = _encoder.encode(_create_mailroom_task(org_id, task_type, task, queued_on))
+        payloads.setdefault(payload, score + len(payloads))
+        encoded.append(payload)
 
-    org_queue = QUEUE_PATTERN % (queue, org_id)
     active_queue = ACTIVE_PATTERN % queue
 
-    # push onto our org queue
-    pipe.zadd(org_queue, {json.dumps(payload): score})
+    for org_id, payloads in payloads_by_org.items():
+        # push onto our org queue
+        pipe.zadd(QUEUE_PATTERN % (queue, org_id), payloads)
 
-    # and mark that org as active
-    pipe.zincrby(active_queue, 0, org_id)
+        # and mark that org as active
+        pipe.zincrby(active_queue, 0, org_id)
 
+    # record a sample of enqueues for measuring enqueue rates
+    sample_rate = settings.MAILROOM_QUEUE_RATE_SAMPLE
+    if payloads_by_org and sample_rate and random.random() < sample_rate:
+        enqueued_key = ENQUEUED_KEY % (queue, int(time.time() // 60))
+        for org_id, payloads in payloads_by_org.items():
+            pipe.hincrby(enqueued_key, org_id, len(payloads))
+        pipe.expire(enqueued_key, timedelta(minutes=RATE_WINDOW_MINUTES + 1))
 
-def _create_mailroom_task(org_id, task_type, task):
+    return encoded
+
+
+def _create_mailroom_task(org_id, task_type, task, queued_on):
     """
     Returns a mailroom format task job based on the task type and passed in task
     """
-    return {"type": task_type.value, "org_id": org_id, "task": task, "queued_on": timezone.now()}
+    return {"type": task_type.value, "org_id": org_id, "task": task, "queued_on": queued_on}
+
+
+def get_queue_stats(queues=(BATCH_QUEUE, HANDLER_QUEUE)) -> list[dict]:
+    """
+    Gets the size, age of the task at the head, and estimated enqueue rate per minute of each active org queue. Org
+    queues are read in pipelined batches to limit the number of round trips to redis.
+    """
+    r = get_redis_connection("default")
+    now = timezone.now()
+    sample_rate = settings.MAILROOM_QUEUE_RATE_SAMPLE
+    stats = []
+
+    for queue in queues:
+        org_ids = [int(o) for o in r.zrange(ACTIVE_PATTERN % queue, 0, -1)]
+        rates = _get_enqueue_rates(r, queue, sample_rate) if sample_rate else {}
+
+        for batch in chunk_list(org_ids, STATS_BATCH_SIZE):
+            with r.pipeline(transaction=False) as pipe:
+                for org_id in batch:
+                    pipe.zcard(QUEUE_PATTERN % (queue, org_id))
+                    pipe.zrange(QUEUE_PATTERN % (queue, org_id), 0, 0)
+                results = pipe.execute()
+
+            for i, org_id in enumerate(batch):
+                size, head = results[i * 2], results[i * 2 + 1]
+                head_age = None
+                if head:
+                    queued_on = iso8601.parse_date(json.loads(head[0])["queued_on"])
+                    head_age = max((now - queued_on).total_seconds(), 0.0)
+
+                stats.append(
+                    {
+                        "queue": queue,
+                        "org_id": org_id,
+                        "size": size,
+                        "head_age": head_age,
+                        "enqueue_rate": rates.get(org_id, 0.0) if sample_rate else None,
+                    }
+                )
+
+    return sorted(stats, key=lambda s: (-s["size"], s["queue"], s["org_id"]))
+
+
+def _get_enqueue_rates(r, queue: str, sample_rate: float) -> dict:
+    """
+    Estimates the number of tasks enqueued per minute for each org over the last few minutes from sampled counts
+    """
+    minute = int(time.time() // 60)
+    with r.pipeline(transaction=False) as pipe:
+        for m in range(minute - RATE_WINDOW_MINUTES, minute):
+            pipe.hgetall(ENQUEUED_KEY % (queue, m))
+        samples = pipe.execute()
+
+    totals = defaultdict(int)
+    for sample in samples:
+        for org_id, count in sample.items():
+            totals[int(org_id)] += int(count)
+
+    return {org_id: total / sample_rate / RATE_WINDOW_MINUTES for org_id, total in totals.items()}
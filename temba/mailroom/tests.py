@@ -1,9 +1,14 @@
+import asyncio
+import time
 from datetime import timedelta
 from decimal import Decimal
+from io import StringIO
 from unittest.mock import patch
 
 from django_redis import get_redis_connection
+from redis.client import Pipeline
 
+from django.core.management import call_command
 from django.test import override_settings
 from django.utils import timezone
 
@@ -12,20 +17,32 @@ from temba.channels.android import sync
 from temba.channels.models import ChannelEvent
 from temba.flows.models import FlowRun, FlowStart
 from temba.ivr.models import Call
-from temba.mailroom.client import ContactSpec, MailroomException, get_client
+from temba.mailroom.client import ContactSpec, LatencyHistograms, MailroomException, get_async_client, get_client
 from temba.msgs.models import Broadcast, Msg
 from temba.tests import MockResponse, TembaTest, matchers, mock_mailroom
 from temba.tests.engine import MockSessionWriter
 from temba.tickets.models import TicketEvent
 from temba.utils import json
 
-from . import BroadcastPreview, Exclusions, Inclusions, StartPreview, modifiers, queue_interrupt
+from . import (
+    HIGH_PRIORITY,
+    BroadcastPreview,
+    Exclusions,
+    Inclusions,
+    StartPreview,
+    get_queue_stats,
+    interrupt_task,
+    modifiers,
+    queue_batch_tasks,
+    queue_interrupt,
+    queue_populate_dynamic_group,
+)
 from .events import Event
 
 
 class MailroomClientTest(TembaTest):
     def test_version(self):
-        with patch("requests.get") as mock_get:
+        with patch("requests.Session.get") as mock_get:
             mock_get.return_value = MockResponse(200, '{"version": "5.3.4"}')
             version = get_client().version()
 
@@ -34,7 +51,7 @@ class MailroomClientTest(TembaTest):
     def test_flow_migrate(self):
         flow_def = {"nodes": [{"val": Decimal("1.23")}]}
 
-        with patch("requests.post") as mock_post:
+        with patch("requests.Session.post") as mock_post:
             mock_post.return_value = MockResponse(200, '{"name": "Migrated!"}')
             migrated = get_client().flow_migrate(flow_def, to_version="13.1.0")
 
@@ -50,7 +67,7 @@ class MailroomClientTest(TembaTest):
     def test_flow_inspect(self):
         flow_def = {"nodes": [{"val": Decimal("1.23")}]}
 
-        with patch("requests.post") as mock_post:
+        with patch("requests.Session.post") as mock_post:
             mock_post.return_value = MockResponse(200, '{"dependencies":[]}')
             info = get_client().flow_inspect(self.org.id, flow_def)
 
@@ -65,7 +82,7 @@ class MailroomClientTest(TembaTest):
     def test_flow_change_language(self):
         flow_def = {"nodes": [{"val": Decimal("1.23")}]}
 
-        with patch("requests.post") as mock_post:
+        with patch("requests.Session.post") as mock_post:
             mock_post.return_value = MockResponse(200, '{"language": "spa"}')
             migrated = get_client().flow_change_language(flow_def, language="spa")
 
@@ -78,7 +95,7 @@ class MailroomClientTest(TembaTest):
         self.assertEqual({"flow": flow_def, "language": "spa"}, json.loads(call[1]["data"]))
 
     def test_flow_start_preview(self):
-        with patch("requests.post") as mock_post:
+        with patch("requests.Session.post") as mock_post:
             mock_resp = {"query": 'group = "Farmers" AND status = "active"', "total": 2345}
             mock_post.return_value = MockResponse(200, json.dumps(mock_resp))
             preview = get_client().flow_start_preview(
@@ -117,7 +134,7 @@ class MailroomClientTest(TembaTest):
         )
 
     def test_msg_broadcast_preview(self):
-        with patch("requests.post") as mock_post:
+        with patch("requests.Session.post") as mock_post:
             mock_resp = {"query": 'group = "Farmers" AND status = "active"', "total": 2345}
             mock_post.return_value = MockResponse(200, json.dumps(mock_resp))
             preview = get_client().msg_broadcast_preview(
@@ -154,7 +171,7 @@ class MailroomClientTest(TembaTest):
         )
 
     def test_msg_broadcast(self):
-        with patch("requests.post") as mock_post:
+        with patch("requests.Session.post") as mock_post:
             mock_post.return_value = MockResponse(200, json.dumps({"id": 123}))
             resp = get_client().msg_broadcast(
                 self.org.id,
@@ -190,7 +207,7 @@ class MailroomClientTest(TembaTest):
         )
 
     def test_contact_modify(self):
-        with patch("requests.post") as mock_post:
+        with patch("requests.Session.post") as mock_post:
             mock_post.return_value = MockResponse(
                 200,
                 """{
@@ -258,7 +275,7 @@ class MailroomClientTest(TembaTest):
                 },
             )
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_msg_send(self, mock_post):
         mock_post.return_value = MockResponse(200, '{"id": 12345}')
         response = get_client().msg_send(
@@ -280,7 +297,7 @@ class MailroomClientTest(TembaTest):
             },
         )
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_msg_resend(self, mock_post):
         mock_post.return_value = MockResponse(200, '{"msg_ids": [12345]}')
         response = get_client().msg_resend(org_id=self.org.id, msg_ids=[12345, 67890])
@@ -294,7 +311,7 @@ class MailroomClientTest(TembaTest):
         )
 
     def test_po_export(self):
-        with patch("requests.post") as mock_post:
+        with patch("requests.Session.post") as mock_post:
             mock_post.return_value = MockResponse(200, 'msgid "Red"\nmsgstr "Rojo"\n\n')
             response = get_client().po_export(self.org.id, [123, 234], "spa")
 
@@ -307,7 +324,7 @@ class MailroomClientTest(TembaTest):
         )
 
     def test_po_import(self):
-        with patch("requests.post") as mock_post:
+        with patch("requests.Session.post") as mock_post:
             mock_post.return_value = MockResponse(200, '{"flows": []}')
             response = get_client().po_import(self.org.id, [123, 234], "spa", b'msgid "Red"\nmsgstr "Rojo"\n\n')
 
@@ -320,7 +337,7 @@ class MailroomClientTest(TembaTest):
             files={"po": b'msgid "Red"\nmsgstr "Rojo"\n\n'},
         )
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_parse_query(self, mock_post):
         mock_post.return_value = MockResponse(
             200, '{"query":"name ~ \\"frank\\"", "elastic_query": {}, "metadata": {"attributes":["name"]}}'
@@ -341,7 +358,7 @@ class MailroomClientTest(TembaTest):
         with self.assertRaises(MailroomException):
             get_client().parse_query(1, "age > 10")
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_contact_create(self, mock_post):
         mock_post.return_value = MockResponse(200, '{"contact": {"id": 1234, "name": "", "language": ""}}')
 
@@ -393,7 +410,7 @@ class MailroomClientTest(TembaTest):
             },
         )
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_contact_resolve(self, mock_post):
         mock_post.return_value = MockResponse(200, '{"contact": {"id": 1234}, "urn": {"id": 2345}}')
 
@@ -407,7 +424,7 @@ class MailroomClientTest(TembaTest):
             json={"org_id": self.org.id, "channel_id": 345, "urn": "tel:+1234567890"},
         )
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_contact_inspect(self, mock_post):
         mock_post.return_value = MockResponse(200, '{"101": {}, "102": {}}')
 
@@ -420,7 +437,7 @@ class MailroomClientTest(TembaTest):
             json={"org_id": self.org.id, "contact_ids": [101, 102]},
         )
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_contact_interrupt(self, mock_post):
         mock_post.return_value = MockResponse(200, '{"sessions": 1}')
 
@@ -433,7 +450,7 @@ class MailroomClientTest(TembaTest):
             json={"org_id": self.org.id, "user_id": 3, "contact_id": 345},
         )
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_contact_search(self, mock_post):
         mock_post.return_value = MockResponse(
             200,
@@ -470,7 +487,7 @@ class MailroomClientTest(TembaTest):
             get_client().contact_search(1, 2, "age > 10", "-created_on")
 
     def test_ticket_assign(self):
-        with patch("requests.post") as mock_post:
+        with patch("requests.Session.post") as mock_post:
             mock_post.return_value = MockResponse(200, '{"changed_ids": [123]}')
             response = get_client().ticket_assign(1, 12, [123, 345], 4)
 
@@ -482,7 +499,7 @@ class MailroomClientTest(TembaTest):
             )
 
     def test_ticket_add_note(self):
-        with patch("requests.post") as mock_post:
+        with patch("requests.Session.post") as mock_post:
             mock_post.return_value = MockResponse(200, '{"changed_ids": [123]}')
             response = get_client().ticket_add_note(1, 12, [123, 345], "please handle")
 
@@ -494,7 +511,7 @@ class MailroomClientTest(TembaTest):
             )
 
     def test_ticket_change_topic(self):
-        with patch("requests.post") as mock_post:
+        with patch("requests.Session.post") as mock_post:
             mock_post.return_value = MockResponse(200, '{"changed_ids": [123]}')
             response = get_client().ticket_change_topic(1, 12, [123, 345], 67)
 
@@ -506,7 +523,7 @@ class MailroomClientTest(TembaTest):
             )
 
     def test_ticket_close(self):
-        with patch("requests.post") as mock_post:
+        with patch("requests.Session.post") as mock_post:
             mock_post.return_value = MockResponse(200, '{"changed_ids": [123]}')
             response = get_client().ticket_close(1, 12, [123, 345], force=True)
 
@@ -518,7 +535,7 @@ class MailroomClientTest(TembaTest):
             )
 
     def test_ticket_reopen(self):
-        with patch("requests.post") as mock_post:
+        with patch("requests.Session.post") as mock_post:
             mock_post.return_value = MockResponse(200, '{"changed_ids": [123]}')
             response = get_client().ticket_reopen(1, 12, [123, 345])
 
@@ -532,7 +549,7 @@ class MailroomClientTest(TembaTest):
     def test_request_failure(self):
         flow = self.get_flow("color")
 
-        with patch("requests.post") as mock_post:
+        with patch("requests.Session.post") as mock_post:
             mock_post.return_value = MockResponse(400, '{"errors":["Bad request", "Doh!"]}')
 
             with self.assertRaises(MailroomException) as e:
@@ -543,6 +560,101 @@ class MailroomClientTest(TembaTest):
             {"endpoint": "flow/migrate", "request": matchers.Dict(), "response": {"errors": ["Bad request", "Doh!"]}},
         )
 
+    def test_session(self):
+        client = get_client()
+
+        # client and its session are reused so requests share pooled connections
+        self.assertIs(client, get_client())
+
+        adapter = client.session.get_adapter("http://localhost:8090/mr/")
+        self.assertEqual(10, adapter._pool_maxsize)
+        self.assertEqual((5, 60), adapter.timeout)
+        self.assertEqual(2, adapter.max_retries.connect)
+        self.assertEqual(0, adapter.max_retries.read)
+        self.assertNotIn("POST", adapter.max_retries.allowed_methods)
+
+        # but a new client is created if settings change
+        with override_settings(MAILROOM_URL="https://mailroom.temba.io", MAILROOM_AUTH_TOKEN="sesame"):
+            client2 = get_client()
+
+            self.assertIsNot(client, client2)
+            self.assertEqual("https://mailroom.temba.io", client2.base_url)
+            self.assertEqual("Token sesame", client2.headers["Authorization"])
+
+    @override_settings(MAILROOM_LATENCY_SAMPLE=1.0)
+    def test_latency_histograms(self):
+        get_redis_connection().delete(f"mailroom_latency:{timezone.now().date().isoformat()}")
+
+        with patch("requests.Session.post") as mock_post:
+            mock_post.return_value = MockResponse(200, '{"changed_ids": [123]}')
+
+            with patch("temba.mailroom.client.LatencyHistograms.record") as mock_record:
+                get_client().ticket_reopen(1, 12, [123])
+
+            mock_record.assert_called_once_with("ticket/reopen", matchers.Float())
+
+        LatencyHistograms.record("ticket/reopen", 20.0)
+        LatencyHistograms.record("ticket/reopen", 300.0)
+        LatencyHistograms.record("ticket/close", 20000.0)
+
+        histograms = LatencyHistograms.get()
+
+        self.assertEqual({"ticket/reopen", "ticket/close"}, set(histograms.keys()))
+        self.assertEqual(2, histograms["ticket/reopen"]["count"])
+        self.assertAlmostEqual(160.0, histograms["ticket/reopen"]["mean_ms"], places=3)
+        self.assertEqual(1, histograms["ticket/reopen"]["buckets"][25])
+        self.assertEqual(1, histograms["ticket/reopen"]["buckets"][500])
+        self.assertEqual(0, histograms["ticket/reopen"]["buckets"]["inf"])
+        self.assertEqual(1, histograms["ticket/close"]["count"])
+        self.assertEqual(1, histograms["ticket/close"]["buckets"]["inf"])
+
+        # nothing recorded for other days
+        self.assertEqual({}, LatencyHistograms.get(timezone.now().date() - timedelta(days=1)))
+
+    @override_settings(MAILROOM_LATENCY_SAMPLE=0.5)
+    def test_latency_histograms_sampled(self):
+        get_redis_connection().delete(f"mailroom_latency:{timezone.now().date().isoformat()}")
+
+        # only sampled requests are recorded
+        with patch("temba.mailroom.client.random.random", side_effect=[0.2, 0.7, 0.4]):
+            LatencyHistograms.record("ticket/reopen", 20.0)
+            LatencyHistograms.record("ticket/reopen", 30.0)
+            LatencyHistograms.record("ticket/reopen", 300.0)
+
+        # but counts are scaled up to estimates of all requests
+        histograms = LatencyHistograms.get()
+        self.assertEqual(4, histograms["ticket/reopen"]["count"])
+        self.assertAlmostEqual(160.0, histograms["ticket/reopen"]["mean_ms"], places=3)
+        self.assertEqual(2, histograms["ticket/reopen"]["buckets"][25])
+        self.assertEqual(2, histograms["ticket/reopen"]["buckets"][500])
+
+        # and nothing is recorded if sampling is disabled
+        with override_settings(MAILROOM_LATENCY_SAMPLE=0.0):
+            with patch("temba.mailroom.client.random.random") as mock_random:
+                LatencyHistograms.record("ticket/close", 20.0)
+
+            mock_random.assert_not_called()
+
+        self.assertNotIn("ticket/close", LatencyHistograms.get())
+
+    def test_async_client(self):
+        client = get_async_client()
+
+        async def reopen_all():
+            return await asyncio.gather(*[client.ticket_reopen(1, 12, [ticket_id]) for ticket_id in (123, 234, 345)])
+
+        with patch("requests.Session.post") as mock_post:
+            mock_post.return_value = MockResponse(200, '{"changed_ids": [123]}')
+
+            responses = asyncio.run(reopen_all())
+
+        self.assertEqual([{"changed_ids": [123]}] * 3, responses)
+        self.assertEqual(3, mock_post.call_count)
+        self.assertEqual({123, 234, 345}, {call.kwargs["json"]["ticket_ids"][0] for call in mock_post.call_args_list})
+
+        with self.assertRaises(AttributeError):
+            client._request
+
 
 class MailroomQueueTest(TembaTest):
     @mock_mailroom(queue=False)
@@ -783,6 +895,171 @@ class MailroomQueueTest(TembaTest):
             },
         )
 
+    def test_queue_batch_tasks(self):
+        jim = self.create_contact("Jim", phone="+12065551212")
+        bob = self.create_contact("Bob", phone="+12065551313")
+        flow = self.create_flow("Test")
+
+        tasks = [
+            interrupt_task(self.org, contacts=[jim]),
+            interrupt_task(self.org2, flow=flow),
+            interrupt_task(self.org, contacts=[bob]),
+        ]
+
+        with patch("redis.client.Pipeline.execute", autospec=True, side_effect=Pipeline.execute) as mock_execute:
+            queue_batch_tasks(tasks, HIGH_PRIORITY)
+
+        # all tasks queued in a single round trip
+        self.assertEqual(1, mock_execute.call_count)
+
+        r = get_redis_connection()
+        self.assertEqual({str(self.org.id).encode(), str(self.org2.id).encode()}, set(r.zrange("batch:active", 0, -1)))
+
+        # tasks for the same org keep their order
+        org1_tasks = [json.loads(t) for t in r.zrange(f"batch:{self.org.id}", 0, -1)]
+        self.assertEqual([{"contact_ids": [jim.id]}, {"contact_ids": [bob.id]}], [t["task"] for t in org1_tasks])
+        self.assertEqual(
+            {
+                "type": "interrupt_sessions",
+                "org_id": self.org2.id,
+                "task": {"flow_ids": [flow.id]},
+                "queued_on": matchers.ISODate(),
+            },
+            json.loads(r.zrange(f"batch:{self.org2.id}", 0, -1)[0]),
+        )
+
+        # queueing nothing is a noop
+        queue_batch_tasks([], HIGH_PRIORITY)
+
+    @override_settings(MAILROOM_QUEUE_RATE_SAMPLE=1.0)
+    def test_queue_stats(self):
+        self.assertEqual([], get_queue_stats())
+
+        jim = self.create_contact("Jim", phone="+12065551212")
+        flow = self.create_flow("Test")
+
+        with patch("temba.mailroom.queue.time") as mock_time:
+            mock_time.time.return_value = (timezone.now() - timedelta(minutes=2)).timestamp()
+
+            queue_batch_tasks(
+                [interrupt_task(self.org, contacts=[jim]), interrupt_task(self.org, flow=flow)], HIGH_PRIORITY
+            )
+            queue_batch_tasks([interrupt_task(self.org2, flow=flow)], HIGH_PRIORITY)
+
+        with patch("temba.mailroom.queue.STATS_BATCH_SIZE", 1):
+            stats = get_queue_stats()
+
+        self.assertEqual(
+            [
+                {"queue": "batch", "org_id": self.org.id, "size": 2, "head_age": matchers.Float(), "enqueue_rate": 0.4},
+                {
+                    "queue": "batch",
+                    "org_id": self.org2.id,
+                    "size": 1,
+                    "head_age": matchers.Float(),
+                    "enqueue_rate": 0.2,
+                },
+            ],
+            stats,
+        )
+        self.assertLess(stats[0]["head_age"], 5)
+
+        self.assertEqual([], get_queue_stats(queues=("handler",)))
+
+        out = StringIO()
+        call_command("mailroom_queues", stdout=out)
+
+        self.assertIn(f"batch    {self.org.id:>8} Nyaruka", out.getvalue())
+        self.assertIn(f"batch    {self.org2.id:>8} Trileet Inc.", out.getvalue())
+
+        out = StringIO()
+        call_command("mailroom_queues", limit=1, stdout=out)
+
+        self.assertIn("... and 1 more", out.getvalue())
+
+        out = StringIO()
+        call_command("mailroom_queues", queue="handler", stdout=out)
+
+        self.assertEqual("No active queues\n", out.getvalue())
+
+    @override_settings(MAILROOM_THROTTLE_BACKLOG=2)
+    def test_throttle_low_priority_tasks(self):
+        jim = self.create_contact("Jim", phone="+12065551212")
+        group1 = self.create_group("Group 1")
+        group1.query = "age > 18"
+        group2 = self.create_group("Group 2")
+        group2.query = "age > 65"
+
+        r = get_redis_connection()
+        r.delete(f"batch:{self.org.id}")
+
+        # org doesn't have a backlog yet so populate tasks are queued with high priority as normal
+        queue_interrupt(self.org, contacts=[jim])
+        queue_populate_dynamic_group(group1)
+
+        tasks = [json.loads(t) for t in r.zrange(f"batch:{self.org.id}", 0, -1)]
+        self.assertEqual(["interrupt_sessions", "populate_dynamic_group"], [t["type"] for t in tasks])
+
+        # and tasks which aren't throttled aren't remembered for coalescing
+        self.assertIsNone(r.get(f"mailroom_coalesce:{self.org.id}:populate_dynamic_group:{group1.id}"))
+
+        # now that it does, they're queued behind the backlog, and tasks identical to a throttled task for the same
+        # group which is still queued are dropped
+        queue_populate_dynamic_group(group2)
+        queue_populate_dynamic_group(group2)
+        queue_populate_dynamic_group(group1)
+        queue_populate_dynamic_group(group1)
+
+        tasks = [json.loads(t) for t in r.zrange(f"batch:{self.org.id}", 0, -1)]
+        self.assertEqual(
+            [
+                ("interrupt_sessions", None),
+                ("populate_dynamic_group", group1.id),
+                ("populate_dynamic_group", group2.id),
+                ("populate_dynamic_group", group1.id),
+            ],
+            [(t["type"], t["task"].get("group_id")) for t in tasks],
+        )
+
+        # but a group whose query has changed still gets its task
+        group2.query = "age > 70"
+        queue_populate_dynamic_group(group2)
+
+        self.assertEqual(5, r.zcard(f"batch:{self.org.id}"))
+
+        # and if it changes back, that gets queued too so that the last task queued is for the current query
+        group2.query = "age > 65"
+        queue_populate_dynamic_group(group2)
+
+        tasks = [json.loads(t) for t in r.zrange(f"batch:{self.org.id}", 0, -1)]
+        self.assertEqual(
+            ["age > 65", "age > 65", "age > 70"],
+            sorted(t["task"]["query"] for t in tasks if t["task"].get("group_id") == group2.id),
+        )
+
+        # once mailroom has taken that task from the queue, an identical task is queued again
+        r.zrem(f"batch:{self.org.id}", r.get(f"mailroom_coalesce:{self.org.id}:populate_dynamic_group:{group2.id}"))
+        self.assertEqual(5, r.zcard(f"batch:{self.org.id}"))
+
+        queue_populate_dynamic_group(group2)
+
+        self.assertEqual(6, r.zcard(f"batch:{self.org.id}"))
+
+        # other orgs aren't affected and still get high priority tasks
+        group3 = self.create_group("Group 3", org=self.org2)
+        group3.query = "age > 18"
+        queue_populate_dynamic_group(group3)
+
+        (_, score) = r.zrange(f"batch:{self.org2.id}", 0, -1, withscores=True)[0]
+        self.assertLess(score, time.time() * 1000 + HIGH_PRIORITY / 2)
+
+        # and throttling can be disabled
+        group2.query = "age > 80"
+        with override_settings(MAILROOM_THROTTLE_BACKLOG=0):
+            queue_populate_dynamic_group(group2)
+
+        self.assertEqual(7, r.zcard(f"batch:{self.org.id}"))
+
     def assert_org_queued(self, org, queue):
         r = get_redis_connection()
 
@@ -7,6 +7,7 @@ from django.conf import settings
 from django.utils import timezone, translation
 
 from temba.orgs.models import Org, User
+from temba.utils.models import CountCache
 
 
 class ExceptionMiddleware:
@@ -73,6 +74,19 @@ class OrgMiddleware:
         return None
 
 
+class CountCacheMiddleware:
+    """
+    Scopes cached count totals to the request so that each org's totals are fetched from redis at most once
+    """
+
+    def __init__(self, get_response=None):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with CountCache.scope():
+            return self.get_response(request)
+
+
 class TimezoneMiddleware:
     """
     Activates the timezone for the current org
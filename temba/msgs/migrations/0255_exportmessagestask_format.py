@@ -0,0 +1,25 @@
+# Generated by Django 4.2.8 on 2024-01-22 16:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("msgs", "0254_squashed"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="exportmessagestask",
+            name="format",
+            field=models.CharField(
+                choices=[
+                    ("xlsx", "Excel (.xlsx)"),
+                    ("csv.gz", "Compressed CSV (.csv.gz)"),
+                    ("jsonl.gz", "Compressed JSON Lines (.jsonl.gz)"),
+                ],
+                default="xlsx",
+                max_length=8,
+            ),
+        ),
+    ]
@@ -8,13 +8,11 @@ from fnmatch import fnmatch
 from urllib.parse import unquote, urlparse
 
 import iso8601
-from xlsxlite.writer import XLSXBook
 
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.postgres.fields import ArrayField
 from django.core.files.storage import default_storage
-from django.core.files.temp import NamedTemporaryFile
 from django.db import models
 from django.db.models import Prefetch, Q, Sum
 from django.db.models.functions import Lower
@@ -29,8 +27,8 @@ from temba.contacts.models import Contact, ContactGroup, ContactURN
 from temba.orgs.models import DependencyMixin, Org
 from temba.schedules.models import Schedule
 from temba.utils import chunk_list, on_transaction_commit
-from temba.utils.export import BaseExportAssetStore, BaseItemWithContactExport
-from temba.utils.models import JSONAsTextField, SquashableModel, TembaModel
+from temba.utils.export import BaseExport, BaseExportAssetStore, BaseItemWithContactExport
+from temba.utils.models import CountCache, JSONAsTextField, SquashableModel, TembaModel
 from temba.utils.s3 import public_file_storage
 from temba.utils.uuid import uuid4
 
@@ -760,20 +758,6 @@ class BroadcastMsgCount(SquashableModel):
     broadcast = models.ForeignKey(Broadcast, on_delete=models.PROTECT, related_name="counts", db_index=True)
     count = models.IntegerField(default=0)
 
-    @classmethod
-    def get_squash_query(cls, distinct_set):
-        sql = """
-        WITH deleted as (
-            DELETE FROM %(table)s WHERE "broadcast_id" = %%s RETURNING "count"
-        )
-        INSERT INTO %(table)s("broadcast_id", "count", "is_squashed")
-        VALUES (%%s, GREATEST(0, (SELECT SUM("count") FROM deleted)), TRUE);
-        """ % {
-            "table": cls._meta.db_table
-        }
-
-        return sql, (distinct_set.broadcast_id,) * 2
-
     @classmethod
     def get_count(cls, broadcast):
         return cls.sum(broadcast.counts.all())
@@ -888,30 +872,19 @@ class SystemLabelCount(SquashableModel):
     label_type = models.CharField(max_length=1, choices=SystemLabel.TYPE_CHOICES)
     count = models.IntegerField(default=0)
 
-    @classmethod
-    def get_squash_query(cls, distinct_set):
-        sql = """
-        WITH deleted as (
-            DELETE FROM %(table)s WHERE "org_id" = %%s AND "label_type" = %%s RETURNING "count"
-        )
-        INSERT INTO %(table)s("org_id", "label_type", "count", "is_squashed")
-        VALUES (%%s, %%s, GREATEST(0, (SELECT SUM("count") FROM deleted)), TRUE);
-        """ % {
-            "table": cls._meta.db_table
-        }
-
-        return sql, (distinct_set.org_id, distinct_set.label_type) * 2
-
     @classmethod
     def get_totals(cls, org):
         """
         Gets all system label counts by type for the given org
         """
-        counts = cls.objects.filter(org=org).values_list("label_type").annotate(count_sum=Sum("count"))
-        counts_by_type = {c[0]: c[1] for c in counts}
+
+        def fetch(label_types):
+            counts = cls.objects.filter(org=org).values_list("label_type").annotate(count_sum=Sum("count"))
+            counts_by_type = {c[0]: c[1] for c in counts}
+            return {lb: counts_by_type.get(lb, 0) for lb in label_types}
 
         # for convenience, include all label types
-        return {lb: counts_by_type.get(lb, 0) for lb, n in SystemLabel.TYPE_CHOICES}
+        return CountCache.get_totals(cls, org.id, [lb for lb, n in SystemLabel.TYPE_CHOICES], fetch)
 
     class Meta:
         indexes = [models.Index(fields=("org", "label_type", "is_squashed"))]
@@ -1008,32 +981,26 @@ class LabelCount(SquashableModel):
     is_archived = models.BooleanField(default=False)
     count = models.IntegerField(default=0)
 
-    @classmethod
-    def get_squash_query(cls, distinct_set):
-        sql = """
-            WITH deleted as (
-                DELETE FROM %(table)s WHERE "label_id" = %%s AND "is_archived" = %%s RETURNING "count"
-            )
-            INSERT INTO %(table)s("label_id", "is_archived", "count", "is_squashed")
-            VALUES (%%s, %%s, GREATEST(0, (SELECT SUM("count") FROM deleted)), TRUE);
-            """ % {
-            "table": cls._meta.db_table
-        }
-
-        return sql, (distinct_set.label_id, distinct_set.is_archived) * 2
-
     @classmethod
     def get_totals(cls, labels):
         """
         Gets total counts for all the given labels
         """
-        counts = (
-            cls.objects.filter(label__in=labels, is_archived=False)
-            .values_list("label_id")
-            .annotate(count_sum=Sum("count"))
-        )
-        counts_by_label_id = {c[0]: c[1] for c in counts}
-        return {lb: counts_by_label_id.get(lb.id, 0) for lb in labels}
+        labels = list(labels)
+        if not labels:
+            return {}
+
+        def fetch(label_ids):
+            counts = (
+                cls.objects.filter(label_id__in=label_ids, is_archived=False)
+                .values_list("label_id")
+                .annotate(count_sum=Sum("count"))
+            )
+            counts_by_label_id = {c[0]: c[1] for c in counts}
+            return {lid: counts_by_label_id.get(lid, 0) for lid in label_ids}
+
+        totals = CountCache.get_totals(cls, labels[0].org_id, [lb.id for lb in labels], fetch)
+        return {lb: totals[lb.id] for lb in labels}
 
 
 class OptIn(TembaModel):
@@ -1114,7 +1081,18 @@ class ExportMessagesTask(BaseItemWithContactExport):
     end_date = models.DateField(null=True)
 
     @classmethod
-    def create(cls, org, user, start_date, end_date, system_label=None, label=None, with_fields=(), with_groups=()):
+    def create(
+        cls,
+        org,
+        user,
+        start_date,
+        end_date,
+        system_label=None,
+        label=None,
+        with_fields=(),
+        with_groups=(),
+        format=BaseExport.FORMAT_XLSX,
+    ):
         assert not (label and system_label), "can't specify both label and system label"
 
         export = cls.objects.create(
@@ -1123,6 +1101,7 @@ class ExportMessagesTask(BaseItemWithContactExport):
             label=label,
             start_date=start_date,
             end_date=end_date,
+            format=format,
             created_by=user,
             modified_by=user,
         )
@@ -1130,39 +1109,26 @@ class ExportMessagesTask(BaseItemWithContactExport):
         export.with_groups.add(*with_groups)
         return export
 
-    def _add_msgs_sheet(self, book):
-        name = "Messages (%d)" % (book.num_msgs_sheets + 1) if book.num_msgs_sheets > 0 else "Messages"
-        sheet = book.add_sheet(name, book.num_msgs_sheets)
-        book.num_msgs_sheets += 1
-
-        self.append_row(sheet, book.headers)
-        return sheet
-
     def write_export(self):
-        book = XLSXBook()
-        book.num_msgs_sheets = 0
-        book.headers = (
+        headers = (
             ["Date"]
             + self._get_contact_headers()
             + ["Flow", "Direction", "Text", "Attachments", "Status", "Channel", "Labels"]
         )
-        book.current_msgs_sheet = self._add_msgs_sheet(book)
+        exporter = self._get_exporter("Messages", headers, number_first_sheet=False)
 
         start_date, end_date = self._get_date_range()
 
         logger.info(f"starting msgs export #{self.id} for org #{self.org.id}")
 
         for batch in self._get_msg_batches(self.system_label, self.label, start_date, end_date):
-            self._write_msgs(book, batch)
+            self._write_msgs(exporter, batch)
 
             # update modified_on so we can see if an export hangs
             self.modified_on = timezone.now()
             self.save(update_fields=("modified_on",))
 
-        temp = NamedTemporaryFile(delete=True, suffix=".xlsx", mode="wb+")
-        book.finalize(to_file=temp)
-        temp.flush()
-        return temp, "xlsx"
+        return exporter.save_file()
 
     def _get_msg_batches(self, system_label, label, start_date, end_date):
         from temba.archives.models import Archive
@@ -1217,7 +1183,7 @@ class ExportMessagesTask(BaseItemWithContactExport):
             # convert this batch of msgs to same format as records in our archives
             yield [msg.as_archive_json() for msg in msg_batch]
 
-    def _write_msgs(self, book, msgs):
+    def _write_msgs(self, exporter, msgs):
         # get all the contacts referenced in this batch
         contact_uuids = {m["contact"]["uuid"] for m in msgs}
         contacts = (
@@ -1232,11 +1198,7 @@ class ExportMessagesTask(BaseItemWithContactExport):
             contact = contacts_by_uuid.get(msg["contact"]["uuid"])
             flow = msg.get("flow")
 
-            if book.current_msgs_sheet.num_rows >= self.MAX_EXCEL_ROWS:  # pragma: no cover
-                book.current_msgs_sheet = self._add_msgs_sheet(book)
-
-            self.append_row(
-                book.current_msgs_sheet,
+            exporter.write_row(
                 [iso8601.parse_date(msg["created_on"])]
                 + self._get_contact_columns(contact, urn=msg["urn"])
                 + [
@@ -1257,4 +1219,4 @@ class MessageExportAssetStore(BaseExportAssetStore):
     key = "message_export"
     directory = "message_exports"
     permission = "msgs.msg_export"
-    extensions = ("xlsx",)
+    extensions = ("xlsx", "csv.gz", "jsonl.gz")
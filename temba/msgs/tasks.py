@@ -68,9 +68,11 @@ def export_messages_task(export_id):
 
 @cron_task(lock_timeout=7200)
 def squash_msg_counts():
-    SystemLabelCount.squash()
-    LabelCount.squash()
-    BroadcastMsgCount.squash()
+    return {
+        "SystemLabelCount": SystemLabelCount.squash_all(),
+        "LabelCount": LabelCount.squash_all(),
+        "BroadcastMsgCount": BroadcastMsgCount.squash_all(),
+    }
 
 
 @shared_task
@@ -805,6 +805,7 @@ class MsgCRUDL(SmartCRUDL):
                     label=label,
                     with_fields=with_fields,
                     with_groups=with_groups,
+                    format=form.cleaned_data["format"],
                 )
 
                 on_transaction_commit(lambda: export_messages_task.delay(export.id))
@@ -30,4 +30,4 @@ def send_notification_emails():
 
 @cron_task(lock_timeout=1800)
 def squash_notification_counts():
-    NotificationCount.squash()
+    return {"NotificationCount": NotificationCount.squash_all()}
@@ -659,6 +659,7 @@ class Org(SmartModel):
         """
         Suspends this org and any children.
         """
+        from temba.api.models import APIToken
         from temba.notifications.incidents.builtin import OrgSuspendedIncidentType
 
         assert not self.is_child
@@ -668,7 +669,11 @@ class Org(SmartModel):
             self.modified_on = timezone.now()
             self.save(update_fields=("is_suspended", "modified_on"))
 
-            self.children.filter(is_active=True).update(is_suspended=True, modified_on=timezone.now())
+            children = self.children.filter(is_active=True)
+            children.update(is_suspended=True, modified_on=timezone.now())
+
+            # bulk updates don't send signals so invalidate cached API tokens of children ourselves
+            APIToken.invalidate_cached(org_ids=list(children.values_list("id", flat=True)))
 
             OrgSuspendedIncidentType.get_or_create(self)  # create incident which will notify admins
 
@@ -676,6 +681,7 @@ class Org(SmartModel):
         """
         Unsuspends this org and any children.
         """
+        from temba.api.models import APIToken
         from temba.notifications.incidents.builtin import OrgSuspendedIncidentType
 
         assert not self.is_child
@@ -685,7 +691,11 @@ class Org(SmartModel):
             self.modified_on = timezone.now()
             self.save(update_fields=("is_suspended", "modified_on"))
 
-            self.children.filter(is_active=True).update(is_suspended=False, modified_on=timezone.now())
+            children = self.children.filter(is_active=True)
+            children.update(is_suspended=False, modified_on=timezone.now())
+
+            # bulk updates don't send signals so invalidate cached API tokens of children ourselves
+            APIToken.invalidate_cached(org_ids=list(children.values_list("id", flat=True)))
 
             OrgSuspendedIncidentType.get_or_create(self).end()
 
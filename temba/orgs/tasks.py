@@ -2,11 +2,12 @@ import logging
 from datetime import timedelta
 
 from celery import shared_task
+from django_redis import get_redis_connection
 
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
-from temba.contacts.models import URN, ContactURN, ExportContactsTask
+from temba.contacts.models import ContactURN, ExportContactsTask
 from temba.contacts.tasks import export_contacts_task
 from temba.flows.models import ExportFlowResultsTask
 from temba.flows.tasks import export_flow_results_task
@@ -61,9 +62,40 @@ def normalize_contact_tels_task(org_id):
 
     # do we have an org-level country code? if so, try to normalize any numbers not starting with +
     if org.default_country_code:
-        urns = ContactURN.objects.filter(org=org, scheme=URN.TEL_SCHEME).exclude(path__startswith="+").iterator()
-        for urn in urns:
-            urn.ensure_number_normalization(org.default_country_code)
+        for start_id, end_id in ContactURN.get_normalize_ranges(org):
+            normalize_contact_tels_range_task.delay(org_id, start_id, end_id)
+
+
+@shared_task
+def normalize_contact_tels_range_task(org_id, start_id, end_id):
+    """
+    Normalizes the tel URNs of an org in the given range of ids, a batch at a time. Progress is recorded in redis so that
+    a retried task resumes from the last batch it completed.
+    """
+    org = Org.objects.get(id=org_id)
+    r = get_redis_connection()
+    progress_key = f"normalize_contact_tels:{org_id}"
+
+    urns = ContactURN.get_unnormalized_tels(org).filter(id__gte=start_id)
+    if end_id:
+        urns = urns.filter(id__lt=end_id)
+
+    after_id = int(r.hget(progress_key, start_id) or 0)
+
+    while True:
+        batch = list(
+            urns.filter(id__gt=after_id).order_by("id").values_list("id", "path")[: ContactURN.NORMALIZE_BATCH_SIZE]
+        )
+        if not batch:
+            break
+
+        ContactURN.bulk_normalize_numbers(org, org.default_country_code, batch)
+
+        after_id = batch[-1][0]
+        r.hset(progress_key, start_id, after_id)
+        r.expire(progress_key, 60 * 60 * 24)
+
+    r.hdel(progress_key, start_id)
 
 
 @cron_task(lock_timeout=7200)
@@ -81,6 +113,7 @@ def resume_failed_tasks():
         status__in=[ExportFlowResultsTask.STATUS_COMPLETE, ExportFlowResultsTask.STATUS_FAILED]
     )
     for flow_results_export in flow_results_exports:
+        # sharded exports will only restart the shards which haven't completed
         export_flow_results_task.delay(flow_results_export.pk)
 
     msg_exports = ExportMessagesTask.objects.filter(modified_on__lte=window).exclude(
@@ -2381,9 +2381,10 @@ class OrgCRUDLTest(TembaTest, CRUDLTestMixin):
         self.assertEqual("Staff", menu[2]["name"])
 
         menu = self.client.get(f"{menu_url}staff/").json()["results"]
-        self.assertEqual(2, len(menu))
+        self.assertEqual(3, len(menu))
         self.assertEqual("Workspaces", menu[0]["name"])
         self.assertEqual("Users", menu[1]["name"])
+        self.assertEqual("Queues", menu[2]["name"])
 
         # if our org has new orgs but not child orgs, we should have a New Workspace button in the menu
         self.org.features = [Org.FEATURE_NEW_ORGS]
@@ -1395,6 +1395,12 @@ class OrgCRUDL(SmartCRUDL):
                         icon="users",
                         href=reverse("orgs.user_list"),
                     ),
+                    self.create_menu_item(
+                        menu_id="queues",
+                        name=_("Queues"),
+                        icon="progress_spinner",
+                        href=reverse("dashboard.dashboard_queues"),
+                    ),
                 ]
 
             menu = []
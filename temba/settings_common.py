@@ -189,6 +189,7 @@ MIDDLEWARE = (
     "temba.middleware.OrgMiddleware",
     "temba.middleware.LanguageMiddleware",
     "temba.middleware.TimezoneMiddleware",
+    "temba.middleware.CountCacheMiddleware",
 )
 
 # -----------------------------------------------------------------------------------
@@ -748,6 +749,18 @@ CACHES = {
 SESSION_ENGINE = "django.contrib.sessions.backends.cached_db"
 SESSION_CACHE_ALIAS = "default"
 
+# seconds to cache count totals for (0 disables)
+COUNTS_CACHE_TTL = 15
+
+# seconds to cache omnibox search results for each user (0 disables)
+OMNIBOX_CACHE_TTL = 30
+
+# seconds to cache the events of ended flow sessions for contact history (0 disables)
+SESSION_EVENTS_CACHE_TTL = 60 * 60
+
+# number of threads to fetch contact history sources with concurrently (0 disables)
+CONTACT_HISTORY_WORKERS = 4
+
 # -----------------------------------------------------------------------------------
 # Celery
 # -----------------------------------------------------------------------------------
@@ -805,6 +818,18 @@ REST_FRAMEWORK = {
 }
 REST_HANDLE_EXCEPTIONS = not TESTING
 
+# whether list endpoints which have them should use fast serializers (see temba.api.v2.fast)
+API_FAST_SERIALIZERS = False
+
+# streaming of list endpoints as newline-delimited JSON (see ListAPIMixin.stream)
+API_STREAM_BATCH_SIZE = 1000  # number of objects fetched per query
+API_STREAM_RECORDS_PER_REQUEST = 250  # number of streamed objects which count as one request for throttling
+API_STREAM_MAX_RECORDS = 100_000  # maximum number of objects in one streamed response
+
+# caching of API token lookups, of their roles in redis and of whole tokens briefly in local memory
+API_TOKEN_CACHE_TTL = 300
+API_TOKEN_LOCAL_CACHE_TTL = 5
+
 # -----------------------------------------------------------------------------------
 # Compression
 # -----------------------------------------------------------------------------------
@@ -918,6 +943,14 @@ NON_ISO6391_LANGUAGES = {"mul", "und"}
 
 MAILROOM_URL = None
 MAILROOM_AUTH_TOKEN = None
+MAILROOM_POOL_SIZE = 10  # max number of keep-alive connections per process
+MAILROOM_CONNECT_TIMEOUT = 5  # seconds
+MAILROOM_READ_TIMEOUT = 60  # seconds
+MAILROOM_RETRIES = 2  # retries of failed connections and of GETs which get gateway errors
+MAILROOM_RETRY_BACKOFF = 0.25  # backoff factor in seconds between retries
+MAILROOM_QUEUE_RATE_SAMPLE = 0.0  # fraction of enqueues to sample for enqueue rates (0 to disable)
+MAILROOM_LATENCY_SAMPLE = 0.1  # fraction of requests to sample for latency histograms (0 to disable)
+MAILROOM_THROTTLE_BACKLOG = 10_000  # org batch queue size above which low priority tasks are throttled (0 to disable)
 
 # -----------------------------------------------------------------------------------
 # ElasticSearch
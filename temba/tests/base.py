@@ -49,6 +49,19 @@ class TembaTest(SmartminTest):
     def setUp(self):
         super().setUp()
 
+        # caches which would make assertions non-deterministic are off unless a test overrides them, as are history
+        # worker threads which have their own database connections that can't see test transactions
+        uncached = override_settings(
+            COUNTS_CACHE_TTL=0,
+            OMNIBOX_CACHE_TTL=0,
+            SESSION_EVENTS_CACHE_TTL=0,
+            CONTACT_HISTORY_WORKERS=0,
+            API_TOKEN_CACHE_TTL=0,
+            API_TOKEN_LOCAL_CACHE_TTL=0,
+        )
+        uncached.enable()
+        self.addCleanup(uncached.disable)
+
         self.create_anonymous_user()
 
         self.superuser = User.objects.create_superuser(
@@ -24,6 +24,7 @@ class ESMockWithScroll:
             "_scroll_id": "1",
             "hits": {"hits": []},
         }
+        patched_object.count.return_value = {"count": len(self.data)}
 
         return patched_object()
 
@@ -372,7 +372,7 @@ def _wrap_test_method(f, mock_client: bool, mock_queue: bool, instance, *args, *
     mocks = Mocks()
 
     patch_get_client = None
-    patch_queue_batch_task = None
+    patch_queue_batch_tasks = []
 
     try:
         if mock_client:
@@ -381,22 +381,24 @@ def _wrap_test_method(f, mock_client: bool, mock_queue: bool, instance, *args, *
             mock_get_client.return_value = TestClient(mocks)
 
         if mock_queue:
-            patch_queue_batch_task = patch("temba.mailroom.queue._queue_batch_task")
-            mock_queue_batch_task = patch_queue_batch_task.start()
 
-            def queue_batch_task(org_id, task_type, task, priority):
-                mocks.queued_batch_tasks.append(
-                    {"type": task_type.value, "org_id": org_id, "task": task, "queued_on": timezone.now()}
-                )
+            def queue_batch_tasks(tasks, priority):
+                for org_id, task_type, task in tasks:
+                    mocks.queued_batch_tasks.append(
+                        {"type": task_type.value, "org_id": org_id, "task": task, "queued_on": timezone.now()}
+                    )
 
-            mock_queue_batch_task.side_effect = queue_batch_task
+            # function is called from within the queue module and via the package by other modules
+            for target in ("temba.mailroom.queue.queue_batch_tasks", "temba.mailroom.queue_batch_tasks"):
+                patch_queue_batch_tasks.append(patch(target, side_effect=queue_batch_tasks))
+                patch_queue_batch_tasks[-1].start()
 
         return f(instance, mocks, *args, **kwargs)
     finally:
         if patch_get_client:
             patch_get_client.stop()
-        if patch_queue_batch_task:
-            patch_queue_batch_task.stop()
+        for p in patch_queue_batch_tasks:
+            p.stop()
 
 
 def apply_modifiers(org, user, contacts, modifiers: list):
@@ -1,4 +1,5 @@
 import gzip
+import hashlib
 import io
 from collections import defaultdict
 from datetime import datetime
@@ -42,13 +43,26 @@ class MockPaginator:
         return [getattr(self.client, self.method)(**kwargs)]
 
 
+class MockNoSuchKey(Exception):
+    pass
+
+
+class MockNoSuchUpload(Exception):
+    pass
+
+
 class MockS3Client:
     """
     A mock of the boto S3 client
     """
 
+    class exceptions:
+        NoSuchKey = MockNoSuchKey
+        NoSuchUpload = MockNoSuchUpload
+
     def __init__(self):
         self.objects = {}
+        self.uploads = {}
         self.calls = defaultdict(list)
 
     def put_object(self, Bucket: str, Key: str, Body, **kwargs):
@@ -56,9 +70,55 @@ class MockS3Client:
 
         self.objects[(Bucket, Key)] = Body
 
+    def create_multipart_upload(self, Bucket: str, Key: str, **kwargs):
+        self.calls["create_multipart_upload"].append(call(Bucket=Bucket, Key=Key, **kwargs))
+
+        upload_id = f"upload{len(self.calls['create_multipart_upload'])}"
+        self.uploads[upload_id] = {}
+        return {"Bucket": Bucket, "Key": Key, "UploadId": upload_id}
+
+    def upload_part(self, Bucket: str, Key: str, UploadId: str, PartNumber: int, Body, **kwargs):
+        self.calls["upload_part"].append(call(Bucket=Bucket, Key=Key, UploadId=UploadId, PartNumber=PartNumber))
+
+        if UploadId not in self.uploads:
+            raise MockNoSuchUpload()
+
+        self.uploads[UploadId][PartNumber] = Body
+        return {"ETag": f'"{hashlib.md5(Body).hexdigest()}"'}
+
+    def complete_multipart_upload(self, Bucket: str, Key: str, UploadId: str, MultipartUpload: dict, **kwargs):
+        self.calls["complete_multipart_upload"].append(
+            call(Bucket=Bucket, Key=Key, UploadId=UploadId, MultipartUpload=MultipartUpload, **kwargs)
+        )
+
+        if UploadId not in self.uploads:
+            raise MockNoSuchUpload()
+
+        parts = self.uploads.pop(UploadId)
+        self.objects[(Bucket, Key)] = io.BytesIO(b"".join(parts[p["PartNumber"]] for p in MultipartUpload["Parts"]))
+        return {"Bucket": Bucket, "Key": Key}
+
+    def abort_multipart_upload(self, Bucket: str, Key: str, UploadId: str, **kwargs):
+        self.calls["abort_multipart_upload"].append(call(Bucket=Bucket, Key=Key, UploadId=UploadId, **kwargs))
+
+        if UploadId not in self.uploads:
+            raise MockNoSuchUpload()
+
+        del self.uploads[UploadId]
+        return {}
+
+    def copy(self, CopySource: dict, Bucket: str, Key: str, ExtraArgs: dict = None, **kwargs):
+        self.calls["copy"].append(call(CopySource=CopySource, Bucket=Bucket, Key=Key, ExtraArgs=ExtraArgs, **kwargs))
+
+        source = self.objects[(CopySource["Bucket"], CopySource["Key"])]
+        self.objects[(Bucket, Key)] = io.BytesIO(source.getvalue())
+
     def get_object(self, Bucket, Key, **kwargs):
         self.calls["get_object"].append(call(Bucket=Bucket, Key=Key, **kwargs))
 
+        if (Bucket, Key) not in self.objects:
+            raise MockNoSuchKey()
+
         body = self.objects[(Bucket, Key)]
         body.seek(0)
         return {"Bucket": Bucket, "Key": Key, "Body": body}
@@ -66,7 +126,7 @@ class MockS3Client:
     def delete_object(self, Bucket, Key, **kwargs):
         self.calls["delete_object"].append(call(Bucket=Bucket, Key=Key, **kwargs))
 
-        del self.objects[(Bucket, Key)]
+        self.objects.pop((Bucket, Key), None)
 
         return {"DeleteMarker": False, "VersionId": "versionId", "RequestCharged": "requester"}
 
@@ -17,8 +17,8 @@ from temba.contacts.models import Contact
 from temba.orgs.models import DependencyMixin, Org, User, UserSettings
 from temba.utils import chunk_list
 from temba.utils.dates import date_range
-from temba.utils.export import BaseExportAssetStore, BaseItemWithContactExport, MultiSheetExporter
-from temba.utils.models import DailyCountModel, DailyTimingModel, SquashableModel, TembaModel
+from temba.utils.export import BaseExport, BaseExportAssetStore, BaseItemWithContactExport
+from temba.utils.models import CountCache, DailyCountModel, DailyTimingModel, SquashableModel, TembaModel
 from temba.utils.uuid import uuid4
 
 logger = logging.getLogger(__name__)
@@ -121,7 +121,9 @@ class Ticket(models.Model):
     def bulk_assign(cls, org, user: User, tickets: list, assignee: User):
         ticket_ids = [t.id for t in tickets]
         assignee_id = assignee.id if assignee else None
-        return mailroom.get_client().ticket_assign(org.id, user.id, ticket_ids, assignee_id)
+        response = mailroom.get_client().ticket_assign(org.id, user.id, ticket_ids, assignee_id)
+        CountCache.invalidate(org.id)
+        return response
 
     @classmethod
     def bulk_add_note(cls, org, user: User, tickets: list, note: str):
@@ -131,17 +133,23 @@ class Ticket(models.Model):
     @classmethod
     def bulk_change_topic(cls, org, user: User, tickets: list, topic: Topic):
         ticket_ids = [t.id for t in tickets]
-        return mailroom.get_client().ticket_change_topic(org.id, user.id, ticket_ids, topic.id)
+        response = mailroom.get_client().ticket_change_topic(org.id, user.id, ticket_ids, topic.id)
+        CountCache.invalidate(org.id)
+        return response
 
     @classmethod
     def bulk_close(cls, org, user, tickets, *, force: bool = False):
         ticket_ids = [t.id for t in tickets]
-        return mailroom.get_client().ticket_close(org.id, user.id, ticket_ids, force=force)
+        response = mailroom.get_client().ticket_close(org.id, user.id, ticket_ids, force=force)
+        CountCache.invalidate(org.id)
+        return response
 
     @classmethod
     def bulk_reopen(cls, org, user, tickets):
         ticket_ids = [t.id for t in tickets]
-        return mailroom.get_client().ticket_reopen(org.id, user.id, ticket_ids)
+        response = mailroom.get_client().ticket_reopen(org.id, user.id, ticket_ids)
+        CountCache.invalidate(org.id)
+        return response
 
     @classmethod
     def get_allowed_assignees(cls, org):
@@ -311,37 +319,15 @@ class TicketCount(SquashableModel):
     status = models.CharField(max_length=1, choices=Ticket.STATUS_CHOICES)
     count = models.IntegerField(default=0)
 
-    @classmethod
-    def get_squash_query(cls, distinct_set) -> tuple:
-        sql = """
-        WITH removed as (
-            DELETE FROM %(table)s WHERE "org_id" = %%s AND "scope" = %%s AND "status" = %%s RETURNING "count"
-        )
-        INSERT INTO %(table)s("org_id", "scope", "status", "count", "is_squashed")
-        VALUES (%%s, %%s, %%s, GREATEST(0, (SELECT SUM("count") FROM removed)), TRUE);
-        """ % {
-            "table": cls._meta.db_table
-        }
-
-        params = (distinct_set.org_id, distinct_set.scope, distinct_set.status) * 2
-
-        return sql, params
-
     @classmethod
     def get_by_assignees(cls, org, assignees: list, status: str) -> dict:
         """
         Gets counts for a set of assignees (None means no assignee)
         """
 
-        scopes = [cls._assignee_scope(a) for a in assignees]
-        counts = (
-            cls.objects.filter(org=org, scope__in=scopes, status=status)
-            .values_list("scope")
-            .annotate(count_sum=Sum("count"))
-        )
-        counts_by_scope = {c[0]: c[1] for c in counts}
+        counts_by_scope = cls._get_by_scopes(org, [cls._assignee_scope(a) for a in assignees], status)
 
-        return {a: counts_by_scope.get(cls._assignee_scope(a), 0) for a in assignees}
+        return {a: counts_by_scope[cls._assignee_scope(a)] for a in assignees}
 
     @classmethod
     def get_by_topics(cls, org, topics: list, status: str) -> dict:
@@ -349,22 +335,34 @@ class TicketCount(SquashableModel):
         Gets counts for a set of topics
         """
 
-        scopes = [cls._topic_scope(t) for t in topics]
-        counts = (
-            cls.objects.filter(org=org, scope__in=scopes, status=status)
-            .values_list("scope")
-            .annotate(count_sum=Sum("count"))
-        )
-        counts_by_scope = {c[0]: c[1] for c in counts}
+        counts_by_scope = cls._get_by_scopes(org, [cls._topic_scope(t) for t in topics], status)
 
-        return {t: counts_by_scope.get(cls._topic_scope(t), 0) for t in topics}
+        return {t: counts_by_scope[cls._topic_scope(t)] for t in topics}
 
     @classmethod
     def get_all(cls, org, status: str) -> int:
         """
         Gets count for org and status regardless of assignee
         """
-        return cls.sum(cls.objects.filter(org=org, scope__startswith="assignee:", status=status))
+
+        def fetch(keys):
+            return {keys[0]: cls.sum(cls.objects.filter(org=org, scope__startswith="assignee:", status=status))}
+
+        return CountCache.get_totals(cls, org.id, [f"all:{status}"], fetch)[f"all:{status}"]
+
+    @classmethod
+    def _get_by_scopes(cls, org, scopes: list, status: str) -> dict:
+        def fetch(keys):
+            counts = (
+                cls.objects.filter(org=org, scope__in=[k.rsplit(":", 1)[0] for k in keys], status=status)
+                .values_list("scope")
+                .annotate(count_sum=Sum("count"))
+            )
+            counts_by_scope = {c[0]: c[1] for c in counts}
+            return {k: counts_by_scope.get(k.rsplit(":", 1)[0], 0) for k in keys}
+
+        totals = CountCache.get_totals(cls, org.id, [f"{s}:{status}" for s in scopes], fetch)
+        return {s: totals[f"{s}:{status}"] for s in scopes}
 
     @staticmethod
     def _assignee_scope(user) -> str:
@@ -539,9 +537,9 @@ class ExportTicketsTask(BaseItemWithContactExport):
     notification_export_type = "ticket"
 
     @classmethod
-    def create(cls, org, user, start_date, end_date, with_fields=(), with_groups=()):
+    def create(cls, org, user, start_date, end_date, with_fields=(), with_groups=(), format=BaseExport.FORMAT_XLSX):
         export = cls.objects.create(
-            org=org, start_date=start_date, end_date=end_date, created_by=user, modified_by=user
+            org=org, start_date=start_date, end_date=end_date, format=format, created_by=user, modified_by=user
         )
         export.with_fields.add(*with_fields)
         export.with_groups.add(*with_groups)
@@ -558,7 +556,7 @@ class ExportTicketsTask(BaseItemWithContactExport):
             .values_list("id", flat=True)
         )
 
-        exporter = MultiSheetExporter("Tickets", headers, self.org.timezone)
+        exporter = self._get_exporter("Tickets", headers)
 
         # add tickets to the export in batches of 1k to limit memory usage
         for batch_ids in chunk_list(ticket_ids, 1000):
@@ -595,4 +593,4 @@ class TicketExportAssetStore(BaseExportAssetStore):
     key = "ticket_export"
     directory = "ticket_exports"
     permission = "tickets.ticket_export"
-    extensions = ("xlsx",)
+    extensions = ("xlsx", "csv.gz", "jsonl.gz")
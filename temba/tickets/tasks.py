@@ -21,6 +21,8 @@ def export_tickets_task(task_id):
 
 @cron_task(lock_timeout=7200)
 def squash_ticket_counts():
-    TicketCount.squash()
-    TicketDailyCount.squash()
-    TicketDailyTiming.squash()
+    return {
+        "TicketCount": TicketCount.squash_all(),
+        "TicketDailyCount": TicketDailyCount.squash_all(),
+        "TicketDailyTiming": TicketDailyTiming.squash_all(),
+    }
@@ -463,7 +463,13 @@ class TicketCRUDL(SmartCRUDL):
                 with_fields = form.cleaned_data["with_fields"]
                 with_groups = form.cleaned_data["with_groups"]
                 export = ExportTicketsTask.create(
-                    org, user, start_date, end_date, with_fields=with_fields, with_groups=with_groups
+                    org,
+                    user,
+                    start_date,
+                    end_date,
+                    with_fields=with_fields,
+                    with_groups=with_groups,
+                    format=form.cleaned_data["format"],
                 )
 
                 # schedule the export job
@@ -1,3 +1,4 @@
+from concurrent.futures import ThreadPoolExecutor
 from itertools import islice
 
 from django.conf import settings
@@ -62,6 +63,26 @@ def chunk_list(iterable, size):
         item = list(islice(it, size))
 
 
+def read_ahead(iterable):
+    """
+    Iterates over the given iterable whilst fetching its next item on a background thread, so that the caller can
+    process each item while the next one is being fetched. Shouldn't be used for iterables which query the database.
+    """
+    it = iter(iterable)
+    end = object()
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(next, it, end)
+
+        while True:
+            item = future.result()
+            if item is end:
+                return
+
+            future = executor.submit(next, it, end)
+            yield item
+
+
 def on_transaction_commit(func):
     """
     Requests that the given function be called after the current transaction has been committed. However function will
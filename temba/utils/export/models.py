@@ -1,11 +1,14 @@
+import csv
 import gc
+import gzip
+import io
 import logging
 import os
 import time
 from datetime import datetime, timedelta
 
+import iso8601
 from smartmin.models import SmartModel
-from xlsxlite.writer import XLSXBook
 
 from django.core.files import File
 from django.core.files.temp import NamedTemporaryFile
@@ -15,10 +18,12 @@ from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 from temba.assets.models import BaseAssetStore, get_asset_store
-from temba.utils import analytics
+from temba.utils import analytics, json
 from temba.utils.models import TembaUUIDMixin
 from temba.utils.text import clean_string
 
+from .xlsx import XLSXWriter
+
 logger = logging.getLogger(__name__)
 
 
@@ -39,6 +44,15 @@ class BaseExport(TembaUUIDMixin, SmartModel):
     MAX_EXCEL_ROWS = 1_048_576
     MAX_EXCEL_COLS = 16384
 
+    FORMAT_XLSX = "xlsx"
+    FORMAT_CSVGZ = "csv.gz"
+    FORMAT_JSONLGZ = "jsonl.gz"
+    FORMAT_CHOICES = (
+        (FORMAT_XLSX, _("Excel (.xlsx)")),
+        (FORMAT_CSVGZ, _("Compressed CSV (.csv.gz)")),
+        (FORMAT_JSONLGZ, _("Compressed JSON Lines (.jsonl.gz)")),
+    )
+
     WIDTH_SMALL = 15
     WIDTH_MEDIUM = 20
     WIDTH_LARGE = 100
@@ -62,6 +76,7 @@ class BaseExport(TembaUUIDMixin, SmartModel):
     )
 
     status = models.CharField(max_length=1, default=STATUS_PENDING, choices=STATUS_CHOICES)
+    format = models.CharField(max_length=8, default=FORMAT_XLSX, choices=FORMAT_CHOICES)
 
     def perform(self):
         """
@@ -106,10 +121,28 @@ class BaseExport(TembaUUIDMixin, SmartModel):
 
     def write_export(self):  # pragma: no cover
         """
-        Should return a file handle for a temporary file and the file extension
+        Should return a file handle for a temporary file and the file extension, which should be the export format
         """
         pass
 
+    def _get_exporter(self, base_sheet_name: str, headers: list, *, number_first_sheet: bool = True):
+        """
+        Gets an exporter for the format of this export. Non-XLSX formats are streamed to a single file with no limit on
+        the number of rows.
+        """
+        if self.format == self.FORMAT_CSVGZ:
+            return CSVGZExporter(headers, self.org.timezone)
+        elif self.format == self.FORMAT_JSONLGZ:
+            return JSONLGZExporter(headers, self.org.timezone)
+
+        return MultiSheetExporter(
+            base_sheet_name,
+            headers,
+            self.org.timezone,
+            max_rows=self.MAX_EXCEL_ROWS,
+            number_first_sheet=number_first_sheet,
+        )
+
     def update_status(self, status):
         self.status = status
         self.save(update_fields=("status", "modified_on"))
@@ -131,9 +164,6 @@ class BaseExport(TembaUUIDMixin, SmartModel):
 
         return cls.get_unfinished().filter(org=org, created_on__gt=day_ago).order_by("created_on").last()
 
-    def append_row(self, sheet, values):
-        sheet.append_row(*[prepare_value(v, self.org.timezone) for v in values])
-
     def get_download_url(self) -> str:
         asset_store = get_asset_store(model=self.__class__)
         return asset_store.get_asset_url(self.id)
@@ -252,24 +282,31 @@ class MultiSheetExporter:
     new sheets.
     """
 
-    def __init__(self, base_sheet_name: str, headers: list, tz):
+    def __init__(self, base_sheet_name: str, headers: list, tz, *, max_rows=None, number_first_sheet: bool = True):
         self.base_sheet_name = base_sheet_name
         self.headers = headers
         self.tz = tz
+        self.max_rows = max_rows
+        self.number_first_sheet = number_first_sheet
 
-        self.current_sheet = 0
-        self.current_row = 0
-
-        self.workbook = XLSXBook()
+        self.temp_file = NamedTemporaryFile(delete=False, suffix=".xlsx", mode="wb+")
+        self.writer = XLSXWriter(self.temp_file, tz)
         self.sheet_number = 0
         self._add_sheet()
 
     def _add_sheet(self):
         self.sheet_number += 1
 
-        # add our sheet
-        self.sheet = self.workbook.add_sheet(f"{self.base_sheet_name} {self.sheet_number}")
-        self.sheet.append_row(*self.headers)
+        # add our sheet, e.g. "Contacts 1", "Contacts 2" or "Runs", "Runs (2)"
+        if self.number_first_sheet:
+            name = f"{self.base_sheet_name} {self.sheet_number}"
+        elif self.sheet_number > 1:
+            name = f"{self.base_sheet_name} ({self.sheet_number})"
+        else:
+            name = self.base_sheet_name
+
+        self.writer.add_sheet(name)
+        self.writer.append_row(self.headers)
         self.sheet_row = 2
 
     def write_row(self, values):
@@ -280,23 +317,130 @@ class MultiSheetExporter:
         assert len(values) == len(self.headers), "need same number of column values as column headers"
 
         # time for a new sheet? do it
-        if self.sheet_row > BaseExport.MAX_EXCEL_ROWS:
+        if self.sheet_row > (self.max_rows or BaseExport.MAX_EXCEL_ROWS):
             self._add_sheet()
 
-        self.sheet.append_row(*[prepare_value(v, self.tz) for v in values])
+        self.writer.append_row(values)
         self.sheet_row += 1
 
     def save_file(self):
         """
         Saves our data to a file, returning the file saved to and the extension
         """
-        gc.collect()  # force garbage collection
+        self.writer.close()
+        self.temp_file.flush()
+
+        return self.temp_file, "xlsx"
+
+
+class GzipExporter:
+    """
+    Base class for exporters which stream rows straight into a gzipped file on disk
+    """
+
+    extension = None
+
+    def __init__(self, headers: list, tz):
+        self.headers = headers
+        self.tz = tz
+
+        self.temp_file = NamedTemporaryFile(delete=False, suffix=f".{self.extension}", mode="wb+")
+        self.stream = gzip.GzipFile(fileobj=self.temp_file, mode="wb")
+
+    def write_row(self, values):
+        """
+        Writes the passed in row to our exporter
+        """
+
+        assert len(values) == len(self.headers), "need same number of column values as column headers"
+
+        self._write_row(values)
+
+    def _write_row(self, values):  # pragma: no cover
+        pass
+
+    def _prepare_datetime(self, value):
+        return value.astimezone(self.tz).replace(microsecond=0).isoformat()
+
+    def save_file(self):
+        """
+        Saves our data to a file, returning the file saved to and the extension
+        """
+        self.stream.close()
+        self.temp_file.flush()
+
+        return self.temp_file, self.extension
+
+
+class CSVGZExporter(GzipExporter):
+    """
+    Exporter which writes rows as gzipped CSV, with a header row
+    """
+
+    extension = BaseExport.FORMAT_CSVGZ
+
+    def __init__(self, headers: list, tz):
+        super().__init__(headers, tz)
+
+        self.text_stream = io.TextIOWrapper(self.stream, encoding="utf-8", newline="")
+        self.writer = csv.writer(self.text_stream)
+        self.writer.writerow(headers)
+
+    def _write_row(self, values):
+        self.writer.writerow([self._prepare_value(v) for v in values])
+
+    def _prepare_value(self, value):
+        if isinstance(value, datetime):
+            return self._prepare_datetime(value)
+
+        # same as we'd write to a cell, so spreadsheet apps which open the file don't evaluate formulas
+        return prepare_value(value)
+
+    def save_file(self):
+        self.text_stream.flush()
+        self.text_stream.detach()
+
+        return super().save_file()
+
+
+class JSONLGZExporter(GzipExporter):
+    """
+    Exporter which writes rows as gzipped JSON lines, with each row an object keyed by header
+    """
+
+    extension = BaseExport.FORMAT_JSONLGZ
+
+    def _write_row(self, values):
+        record = {h: self._prepare_datetime(v) if isinstance(v, datetime) else v for h, v in zip(self.headers, values)}
 
-        temp_file = NamedTemporaryFile(delete=False, suffix=".xlsx", mode="wb+")
-        self.workbook.finalize(to_file=temp_file)
-        temp_file.flush()
+        self.stream.write(json.dumps(record).encode("utf-8"))
+        self.stream.write(b"\n")
 
-        return temp_file, "xlsx"
+
+class PartExporter(GzipExporter):
+    """
+    Exporter which writes rows as gzipped JSON arrays, for exports which are written in parts that are later merged into
+    the final file. Values should be strings, integers, booleans, datetimes or None.
+    """
+
+    extension = "json.gz"
+
+    def _write_row(self, values):
+        self.stream.write(json.dumps(values).encode("utf-8"))
+        self.stream.write(b"\n")
+
+    @staticmethod
+    def read_rows(file, datetime_cols=()):
+        """
+        Reads back the rows from a part file, parsing the given columns as datetimes
+        """
+        with gzip.GzipFile(fileobj=file, mode="rb") as stream:
+            for line in stream:
+                row = json.loads(line)
+                for c in datetime_cols:
+                    if row[c] is not None:
+                        row[c] = iso8601.parse_date(row[c])
+                yield row
 
 
 def response_from_workbook(workbook, filename: str) -> HttpResponse:
@@ -1,5 +1,9 @@
+import csv
+import gzip
+import json
 import os
-from datetime import datetime
+import tempfile
+from datetime import datetime, timezone as tzone
 from unittest.mock import PropertyMock, patch
 from zoneinfo import ZoneInfo
 
@@ -8,7 +12,8 @@ from openpyxl import load_workbook
 from temba.contacts.models import ExportContactsTask
 from temba.tests import TembaTest
 
-from .models import MultiSheetExporter, prepare_value
+from .models import CSVGZExporter, JSONLGZExporter, MultiSheetExporter, prepare_value
+from .xlsx import XLSXWriter
 
 
 class ExportTest(TembaTest):
@@ -106,3 +111,90 @@ class ExportTest(TembaTest):
         self.assertEqual(32 + 16, len(list(sheet2.columns)))
 
         os.unlink(temp_file.name)
+
+    def test_xlsx_writer(self):
+        dt = datetime(2017, 2, 7, 15, 41, 23, 123_456).replace(tzinfo=ZoneInfo("Africa/Nairobi"))
+
+        with tempfile.NamedTemporaryFile(suffix=".xlsx") as temp_file:
+            writer = XLSXWriter(temp_file, self.org.timezone)
+            writer.BATCH_SIZE = 2
+            writer.add_sheet('Values "1"')
+            writer.append_row(["Text", "Number", "Date", "Flag", "Mixed"])
+            writer.append_row(["=SUM(A1)", 12, dt, True, None])
+            writer.append_row(["<b>bad\x01</b>", 1.5, dt, False, 3])
+            writer.append_row(["", 0, dt, True, dt])
+
+            with self.assertRaises(ValueError):
+                writer.append_row(["too", "short"])
+
+            writer.add_sheet("Other")
+            writer.append_row([self.org.name])
+            writer.close()
+
+            workbook = load_workbook(filename=temp_file.name)
+
+        self.assertEqual(['Values "1"', "Other"], workbook.sheetnames)
+        self.assertEqual(
+            [
+                ("Text", "Number", "Date", "Flag", "Mixed"),
+                ("'=SUM(A1)", 12, datetime(2017, 2, 7, 14, 41, 23), True, ""),
+                ("<b>bad</b>", 1.5, datetime(2017, 2, 7, 14, 41, 23), False, 3),
+                ("", 0, datetime(2017, 2, 7, 14, 41, 23), True, datetime(2017, 2, 7, 14, 41, 23)),
+            ],
+            list(workbook.worksheets[0].iter_rows(values_only=True)),
+        )
+        self.assertEqual([(self.org.name,)], list(workbook.worksheets[1].iter_rows(values_only=True)))
+
+        # unsupported values error when their batch is written
+        with tempfile.NamedTemporaryFile(suffix=".xlsx") as temp_file:
+            writer = XLSXWriter(temp_file, self.org.timezone)
+            writer.BATCH_SIZE = 1
+            writer.add_sheet("Errors")
+
+            with self.assertRaises(ValueError):
+                writer.append_row([self])
+
+    def test_gzip_exporters(self):
+        tz = ZoneInfo("Africa/Kigali")
+        headers = ["Text", "Number", "Date", "Flag", "Empty"]
+        row = ["=SUM(A1)", 12, datetime(2017, 2, 7, 12, 41, 23, 123456, tzinfo=tzone.utc), True, None]
+
+        exporter = CSVGZExporter(headers, tz)
+        exporter.write_row(row)
+        temp_file, file_ext = exporter.save_file()
+
+        self.assertEqual("csv.gz", file_ext)
+
+        with gzip.open(temp_file.name, "rt", encoding="utf-8", newline="") as f:
+            self.assertEqual(
+                [headers, ["'=SUM(A1)", "12", "2017-02-07T14:41:23+02:00", "True", ""]], list(csv.reader(f))
+            )
+
+        os.unlink(temp_file.name)
+
+        exporter = JSONLGZExporter(headers, tz)
+        exporter.write_row(row)
+        exporter.write_row(["Hi", 1.5, None, False, None])
+        temp_file, file_ext = exporter.save_file()
+
+        self.assertEqual("jsonl.gz", file_ext)
+
+        with gzip.open(temp_file.name, "rt", encoding="utf-8") as f:
+            self.assertEqual(
+                [
+                    {
+                        "Text": "=SUM(A1)",
+                        "Number": 12,
+                        "Date": "2017-02-07T14:41:23+02:00",
+                        "Flag": True,
+                        "Empty": None,
+                    },
+                    {"Text": "Hi", "Number": 1.5, "Date": None, "Flag": False, "Empty": None},
+                ],
+                [json.loads(line) for line in f],
+            )
+
+        os.unlink(temp_file.name)
+
+        with self.assertRaises(AssertionError):
+            exporter.write_row(["too", "few"])
@@ -9,7 +9,9 @@ from django.utils.translation import gettext_lazy as _
 
 from temba.contacts.models import ContactField, ContactGroup
 from temba.orgs.views import ModalMixin, OrgPermsMixin
-from temba.utils.fields import SelectMultipleWidget, TembaDateField
+from temba.utils.fields import SelectMultipleWidget, SelectWidget, TembaDateField
+
+from .models import BaseExport
 
 
 class BaseExportView(ModalMixin, OrgPermsMixin, SmartFormView):
@@ -24,6 +26,14 @@ class BaseExportView(ModalMixin, OrgPermsMixin, SmartFormView):
         start_date = TembaDateField(label=_("Start Date"))
         end_date = TembaDateField(label=_("End Date"))
 
+        format = forms.ChoiceField(
+            choices=BaseExport.FORMAT_CHOICES,
+            initial=BaseExport.FORMAT_XLSX,
+            required=False,
+            label=_("Format"),
+            widget=SelectWidget(),
+        )
+
         with_fields = forms.ModelMultipleChoiceField(
             ContactField.user_fields.none(),
             required=False,
@@ -48,6 +58,9 @@ class BaseExportView(ModalMixin, OrgPermsMixin, SmartFormView):
                 Lower("name")
             )
 
+        def clean_format(self):
+            return self.cleaned_data["format"] or BaseExport.FORMAT_XLSX
+
         def clean_with_fields(self):
             data = self.cleaned_data["with_fields"]
             if data and len(data) > self.MAX_FIELDS_COLS:
@@ -0,0 +1,207 @@
+import re
+import zipfile
+from datetime import datetime
+from xml.sax.saxutils import escape
+
+from xlsxlite.writer import MINIMAL_STYLESHEET, WORKBOOK_HEADER, WORKSHEET_HEADER, XML_HEADER
+
+from temba.utils.text import CONTROL_CHARACTERES_REGEX, NON_CHARACTERES_REGEX, clean_string
+
+CONTENT_TYPES_XML = (
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    "{sheets}</Types>"
+)
+CONTENT_TYPES_SHEET_XML = (
+    '<Override PartName="/xl/worksheets/sheet{id}.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+)
+ROOT_RELS_XML = (
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/></Relationships>'
+)
+WORKBOOK_RELS_XML = (
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">{sheets}'
+    '<Relationship Id="rIdStyles" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>'
+    "</Relationships>"
+)
+WORKBOOK_RELS_SHEET_XML = (
+    '<Relationship Id="rId{id}" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet{id}.xml"/>'
+)
+
+# matches strings which need cleaning by clean_string, which is too slow to call on every cell
+UNCLEAN_STRING_REGEX = re.compile(f"{NON_CHARACTERES_REGEX}|{CONTROL_CHARACTERES_REGEX}")
+
+EXCEL_EPOCH = datetime(1899, 12, 30)
+SECONDS_PER_DAY = 60 * 60 * 24
+
+CELL_EMPTY = '<c t="inlineStr"><is><t></t></is></c>'
+CELL_TRUE = '<c t="b"><v>1</v></c>'
+CELL_FALSE = '<c t="b"><v>0</v></c>'
+
+
+class XLSXWriter:
+    """
+    High throughput XLSX writer. Rows are buffered and encoded a column at a time, so each column is converted with a
+    single function for its type, and sheet XML is compressed straight into the zip file as it's written. Sheets are
+    written one after the other, and values are converted the same way as prepare_value.
+    """
+
+    BATCH_SIZE = 1000  # number of rows to buffer before they're encoded and written
+    MAX_COLS = 16384
+
+    def __init__(self, file, tz, *, compress_level: int = 6):
+        self.tz = tz
+        self.zip = zipfile.ZipFile(file, "w", zipfile.ZIP_DEFLATED, compresslevel=compress_level)
+        self.sheet_names = []
+        self.sheet_rows = 0
+        self.sheet_cols = None
+
+        self._stream = None
+        self._buffer = []
+
+    def add_sheet(self, name: str):
+        """
+        Adds a new sheet which will receive all subsequently appended rows
+        """
+        self._close_sheet()
+
+        self.sheet_names.append(name)
+        self.sheet_rows = 0
+        self.sheet_cols = None
+
+        path = f"xl/worksheets/sheet{len(self.sheet_names)}.xml"
+        self._stream = self.zip.open(path, "w", force_zip64=True)
+        self._stream.write(f"{XML_HEADER}{WORKSHEET_HEADER}<sheetData>".encode("utf-8"))
+
+    def append_row(self, values):
+        """
+        Appends a row of values to the current sheet, which must have the same number of values as its other rows
+        """
+        if self.sheet_cols is None:
+            if len(values) > self.MAX_COLS:
+                raise ValueError(f"rows can have a maximum of {self.MAX_COLS} columns")
+            self.sheet_cols = len(values)
+        elif len(values) != self.sheet_cols:
+            raise ValueError(f"rows in this sheet must have {self.sheet_cols} columns")
+
+        self._buffer.append(values)
+        self.sheet_rows += 1
+
+        if len(self._buffer) >= self.BATCH_SIZE:
+            self._flush()
+
+    def close(self):
+        """
+        Writes the remaining parts of the workbook and closes the zip file
+        """
+        if not self.sheet_names:
+            self.add_sheet("Sheet1")
+
+        self._close_sheet()
+
+        sheet_ids = range(1, len(self.sheet_names) + 1)
+        sheet_names = [escape(n, {'"': "&quot;"}) for n in self.sheet_names]
+        sheets = "".join(f'<sheet name="{n}" sheetId="{i}" r:id="rId{i}"/>' for i, n in zip(sheet_ids, sheet_names))
+
+        self._write_part(
+            "[Content_Types].xml",
+            CONTENT_TYPES_XML.format(sheets="".join(CONTENT_TYPES_SHEET_XML.format(id=i) for i in sheet_ids)),
+        )
+        self._write_part("_rels/.rels", ROOT_RELS_XML)
+        self._write_part(
+            "xl/_rels/workbook.xml.rels",
+            WORKBOOK_RELS_XML.format(sheets="".join(WORKBOOK_RELS_SHEET_XML.format(id=i) for i in sheet_ids)),
+        )
+        self._write_part("xl/styles.xml", MINIMAL_STYLESHEET)
+        self._write_part("xl/workbook.xml", f"{WORKBOOK_HEADER}<sheets>{sheets}</sheets></workbook>")
+
+        self.zip.close()
+
+    def _write_part(self, path: str, xml: str):
+        self.zip.writestr(path, XML_HEADER + xml)
+
+    def _close_sheet(self):
+        if self._stream:
+            self._flush()
+            self._stream.write(b"</sheetData></worksheet>")
+            self._stream.close()
+            self._stream = None
+
+    def _flush(self):
+        if not self._buffer:
+            return
+
+        columns = [self._encode_column(c) for c in zip(*self._buffer)]
+        chunk = "".join(f"<row>{''.join(cells)}</row>" for cells in zip(*columns))
+
+        self._stream.write(chunk.encode("utf-8"))
+        self._buffer = []
+
+    def _encode_column(self, values) -> list:
+        """
+        Encodes a column of values as cells, using a single encoder if all the values have the same type
+        """
+        types = set(map(type, values))
+        if len(types) == 1:
+            encoder = self._encoders.get(types.pop())
+            if encoder:
+                return [encoder(self, v) for v in values]
+
+        return [self._encode_value(v) for v in values]
+
+    def _encode_value(self, value) -> str:
+        if value is None:
+            return CELL_EMPTY
+        elif isinstance(value, bool):
+            return CELL_TRUE if value else CELL_FALSE
+        elif isinstance(value, (int, float)):
+            return self._encode_number(value)
+        elif isinstance(value, str):
+            return self._encode_str(value)
+        elif isinstance(value, datetime):
+            return self._encode_datetime(value)
+
+        raise ValueError(f"Unsupported type for excel export: {type(value)}")
+
+    def _encode_none(self, value) -> str:
+        return CELL_EMPTY
+
+    def _encode_bool(self, value: bool) -> str:
+        return CELL_TRUE if value else CELL_FALSE
+
+    def _encode_number(self, value) -> str:
+        return f'<c t="n"><v>{value}</v></c>'
+
+    def _encode_str(self, value: str) -> str:
+        if value.startswith("="):  # escape = so value isn't mistaken for a formula
+            value = "'" + value
+        if UNCLEAN_STRING_REGEX.search(value):
+            value = clean_string(value)
+
+        return f'<c t="inlineStr"><is><t>{escape(value)}</t></is></c>'
+
+    def _encode_datetime(self, value: datetime) -> str:
+        delta = value.astimezone(self.tz).replace(microsecond=0, tzinfo=None) - EXCEL_EPOCH
+        serial = delta.days + float(delta.seconds) / SECONDS_PER_DAY
+
+        return f'<c t="n" s="1"><v>{serial}</v></c>'  # style 1 is the shared datetime style
+
+    _encoders = {
+        type(None): _encode_none,
+        bool: _encode_bool,
+        int: _encode_number,
+        float: _encode_number,
+        str: _encode_str,
+        datetime: _encode_datetime,
+    }
@@ -0,0 +1,83 @@
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone as tzone
+from zoneinfo import ZoneInfo
+
+from xlsxlite.writer import XLSXBook
+
+from django.core.management.base import BaseCommand
+
+from temba.utils.export.models import prepare_value
+from temba.utils.export.xlsx import XLSXWriter
+
+
+class Command(BaseCommand):  # pragma: no cover
+    help = "Benchmarks writing of large XLSX exports"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=1_000_000, help="Number of rows to write")
+        parser.add_argument("--cols", type=int, default=50, help="Number of columns per row")
+        parser.add_argument("--skip-legacy", action="store_true", help="Don't benchmark the legacy writer")
+
+    def handle(self, rows: int, cols: int, skip_legacy: bool, **options):
+        tz = ZoneInfo("Africa/Kigali")
+        headers = [f"Column {c}" for c in range(cols)]
+        row_templates = [self._generate_row(r, cols) for r in range(100)]
+
+        def generate_rows():
+            for r in range(rows):
+                yield row_templates[r % len(row_templates)]
+
+        def write_legacy(path):
+            book = XLSXBook()
+            sheet = book.add_sheet("Export 1")
+            sheet.append_row(*headers)
+            for row in generate_rows():
+                sheet.append_row(*[prepare_value(v, tz) for v in row])
+            with open(path, "wb") as f:
+                book.finalize(to_file=f)
+
+        def write_new(path):
+            with open(path, "wb") as f:
+                writer = XLSXWriter(f, tz)
+                writer.add_sheet("Export 1")
+                writer.append_row(headers)
+                for row in generate_rows():
+                    writer.append_row(row)
+                writer.close()
+
+        self.stdout.write(f"Writing {rows} rows x {cols} columns...")
+
+        if not skip_legacy:
+            self._bench("legacy", rows, write_legacy)
+        self._bench("streaming", rows, write_new)
+
+    def _bench(self, name: str, num_rows: int, fn):
+        path = tempfile.mktemp(suffix=".xlsx")
+
+        start = time.perf_counter()
+        fn(path)
+        time_taken = time.perf_counter() - start
+
+        size = os.path.getsize(path)
+        os.unlink(path)
+
+        self.stdout.write(
+            f" > {name}: {time_taken:.2f}s ({int(num_rows / time_taken)} rows/s, file {size / 1_000_000:.1f}MB)"
+        )
+
+    def _generate_row(self, r: int, cols: int) -> list:
+        """
+        Generates a row with a mix of the value types our exports contain
+        """
+        dt = datetime(2024, 1, 1, tzinfo=tzone.utc) + timedelta(minutes=r)
+        generators = (
+            lambda c: f"Value {r}-{c}",
+            lambda c: r * c,
+            lambda c: dt,
+            lambda c: r % 2 == 0,
+            lambda c: None if r % 3 == 0 else f"Optional & <escaped> {c}",
+            lambda c: r * 0.5,
+        )
+        return [generators[c % len(generators)](c) for c in range(cols)]
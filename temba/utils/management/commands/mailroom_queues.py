@@ -0,0 +1,33 @@
+from django.core.management import BaseCommand
+
+from temba.mailroom.queue import BATCH_QUEUE, HANDLER_QUEUE, get_queue_stats
+from temba.orgs.models import Org
+
+
+class Command(BaseCommand):
+    help = "Shows the size and age of the mailroom task queues of each active org"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--queue", type=str, choices=(BATCH_QUEUE, HANDLER_QUEUE), help="Only show this queue")
+        parser.add_argument("--limit", type=int, default=50, help="Maximum number of org queues to show")
+
+    def handle(self, queue: str, limit: int, *args, **kwargs):
+        stats = get_queue_stats(queues=(queue,) if queue else (BATCH_QUEUE, HANDLER_QUEUE))
+        if not stats:
+            self.stdout.write("No active queues")
+            return
+
+        shown = stats[:limit]
+        org_names = dict(Org.objects.filter(id__in=[s["org_id"] for s in shown]).values_list("id", "name"))
+
+        self.stdout.write(f"{'Queue':<8} {'Org':>8} {'Name':<30} {'Size':>10} {'Head Age':>10} {'Rate/min':>10}")
+
+        for s in shown:
+            name = org_names.get(s["org_id"], "")[:30]
+            head_age = f"{s['head_age']:.0f}s" if s["head_age"] is not None else "-"
+            rate = f"{s['enqueue_rate']:.1f}" if s["enqueue_rate"] is not None else "-"
+
+            self.stdout.write(f"{s['queue']:<8} {s['org_id']:>8} {name:<30} {s['size']:>10} {head_age:>10} {rate:>10}")
+
+        if len(stats) > limit:
+            self.stdout.write(f"... and {len(stats) - limit} more")
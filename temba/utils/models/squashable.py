@@ -1,9 +1,17 @@
 import logging
+import threading
 import time
-from abc import abstractmethod
+from collections import defaultdict
+from contextlib import contextmanager
 
+from django_redis import get_redis_connection
+
+from django.conf import settings
 from django.db import connection, models
 from django.db.models import Sum
+from django.utils import timezone
+
+from temba.utils import json
 
 
 class SquashableModel(models.Model):
@@ -11,7 +19,23 @@ class SquashableModel(models.Model):
     Base class for models which track counts by delta insertions which are then periodically squashed
     """
 
-    squash_over = ()
+    squash_over = ()  # columns which identify a distinct set of counts
+    squash_sum = ("count",)  # columns which are summed when a set is squashed
+    squash_carry = ()  # other columns which are copied into the squashed row (must be the same across the set)
+
+    squash_max_sets = 5000  # max number of distinct sets to squash per call
+    squash_batch_size = 100  # initial number of distinct sets to squash per statement
+    squash_batch_min = 10
+    squash_batch_max = 1000
+    squash_batch_target = 1.0  # number of seconds we aim for each batch statement to take
+    squash_max_rows = 100_000  # max number of rows to remove per statement, remaining rows are left for next time
+
+    squash_partitions = 1  # default number of partitions which can be squashed concurrently, can be changed in redis
+    squash_lock_timeout = 900
+
+    SQUASH_PARTITIONS_KEY = "squash_partitions"
+    SQUASH_PROGRESS_KEY = "squash_progress"
+    SQUASH_PROGRESS_EXPIRES = 60 * 60 * 48  # 2 days
 
     id = models.BigAutoField(auto_created=True, primary_key=True)
     is_squashed = models.BooleanField(default=False)
@@ -21,26 +45,209 @@ class SquashableModel(models.Model):
         return cls.objects.filter(is_squashed=False)
 
     @classmethod
-    def squash(cls):
+    def get_squash_partitions(cls) -> int:
+        """
+        Gets the number of partitions this model is currently squashed in
+        """
+        num_partitions = get_redis_connection().hget(cls.SQUASH_PARTITIONS_KEY, cls._meta.db_table)
+        return int(num_partitions) if num_partitions else cls.squash_partitions
+
+    @classmethod
+    def set_squash_partitions(cls, num_partitions: int):
+        """
+        Rebalances squashing of this model over the given number of partitions. Partition tasks queued for the previous
+        number of partitions will be skipped.
+        """
+        assert num_partitions > 0, "must have at least one partition"
+
+        r = get_redis_connection()
+        r.hset(cls.SQUASH_PARTITIONS_KEY, cls._meta.db_table, num_partitions)
+        r.delete(f"{cls.SQUASH_PROGRESS_KEY}:{cls._meta.db_table}")
+
+    @classmethod
+    def get_squash_progress(cls) -> dict:
+        """
+        Gets the results of the last squash of each partition of this model
+        """
+        progress = get_redis_connection().hgetall(f"{cls.SQUASH_PROGRESS_KEY}:{cls._meta.db_table}")
+        return {k.decode(): json.loads(v) for k, v in progress.items()}
+
+    @classmethod
+    def squash_all(cls) -> dict:
+        """
+        Squashes this model. If it's split into multiple partitions, a task is queued to squash each partition so they
+        can be squashed concurrently by different workers.
+        """
+        from temba.utils.tasks import squash_partition
+
+        num_partitions = cls.get_squash_partitions()
+        if num_partitions == 1:
+            return cls.squash_partition(0, 1)
+
+        for partition in range(num_partitions):
+            squash_partition.delay(cls._meta.label, partition, num_partitions)
+
+        return {"partitions": num_partitions}
+
+    @classmethod
+    def squash_partition(cls, partition: int, num_partitions: int) -> dict:
+        """
+        Squashes a single partition of this model whilst holding a lock on that partition. Skipped if the model has
+        since been rebalanced or the partition is already being squashed.
+        """
+        if num_partitions != cls.get_squash_partitions():
+            return {"skipped": True}
+
+        r = get_redis_connection()
+        table = cls._meta.db_table
+        lock = r.lock(f"squash_lock:{table}:{num_partitions}:{partition}", timeout=cls.squash_lock_timeout)
+
+        if not lock.acquire(blocking=False):
+            return {"skipped": True}
+
+        try:
+            start = timezone.now()
+            metrics = cls.squash(partition, num_partitions)
+            progress = {**metrics, "time": (timezone.now() - start).total_seconds(), "last_squashed": start}
+
+            progress_key = f"{cls.SQUASH_PROGRESS_KEY}:{table}"
+            pipe = r.pipeline()
+            pipe.hset(progress_key, f"{partition}/{num_partitions}", json.dumps(progress))
+            pipe.expire(progress_key, cls.SQUASH_PROGRESS_EXPIRES)
+            pipe.execute()
+        finally:
+            lock.release()
+
+        return metrics
+
+    @classmethod
+    def squash(cls, partition: int = 0, num_partitions: int = 1) -> dict:
+        """
+        Squashes distinct sets of unsquashed counts into single rows, in batches of sets per statement, and returns
+        metrics for the squashing. Sets are assigned to partitions by hashing their squash_over values so different
+        partitions never touch the same rows.
+        """
         start = time.time()
-        num_sets = 0
+        num_sets, num_rows = 0, 0
+
+        unsquashed = cls.get_unsquashed()
+        if num_partitions > 1:
+            unsquashed = unsquashed.extra(where=[cls.get_partition_condition()], params=[num_partitions, partition])
+
+        distinct_sets = list(
+            unsquashed.order_by(*cls.squash_over)
+            .distinct(*cls.squash_over)
+            .values_list(*cls.squash_over)[: cls.squash_max_sets]
+        )
 
-        for distinct_set in cls.get_unsquashed().order_by(*cls.squash_over).distinct(*cls.squash_over)[:5000]:
-            with connection.cursor() as cursor:
-                sql, params = cls.get_squash_query(distinct_set)
+        batch_size = cls.squash_batch_size
 
-                cursor.execute(sql, params)
+        while distinct_sets:
+            batch, distinct_sets = distinct_sets[:batch_size], distinct_sets[batch_size:]
 
-            num_sets += 1
+            batch_start = time.time()
+            num_rows += cls._squash_batch(batch)
+            num_sets += len(batch)
 
+            batch_size = cls._get_next_batch_size(batch_size, time.time() - batch_start)
+
+        oldest_unsquashed = cls.get_unsquashed().order_by("id").values_list("id", flat=True).first()
         time_taken = time.time() - start
 
-        logging.debug("Squashed %d distinct sets of %s in %0.3fs" % (num_sets, cls.__name__, time_taken))
+        logging.debug(
+            "Squashed %d distinct sets of %s (%d rows) in %0.3fs" % (num_sets, cls.__name__, num_rows, time_taken)
+        )
+
+        metrics = {"sets": num_sets, "rows": num_rows, "oldest_unsquashed": oldest_unsquashed}
+
+        from temba.utils import analytics
+
+        table = cls._meta.db_table
+        analytics.gauges(
+            {
+                f"temba.squash_{table}_sets": num_sets,
+                f"temba.squash_{table}_rows": num_rows,
+                f"temba.squash_{table}_oldest_unsquashed": oldest_unsquashed or 0,
+            }
+        )
+
+        return metrics
 
     @classmethod
-    @abstractmethod
-    def get_squash_query(cls, distinct_set) -> tuple:  # pragma: no cover
-        pass
+    def _squash_batch(cls, distinct_sets: list) -> int:
+        """
+        Squashes the given distinct sets in a single statement and returns the number of rows collapsed
+        """
+        sql, params = cls.get_squash_query(distinct_sets)
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            num_removed, num_inserted = cursor.fetchone()
+
+        return num_removed - num_inserted
+
+    @classmethod
+    def _get_next_batch_size(cls, batch_size: int, time_taken: float) -> int:
+        """
+        Adapts the batch size to try to keep each statement close to our target time
+        """
+        if time_taken < cls.squash_batch_target / 2:
+            batch_size *= 2
+        elif time_taken > cls.squash_batch_target:
+            batch_size //= 2
+
+        return min(max(batch_size, cls.squash_batch_min), cls.squash_batch_max)
+
+    @classmethod
+    def get_partition_condition(cls) -> str:
+        """
+        Gets a SQL condition which matches rows in a partition, with the number of partitions and partition as params
+        """
+        cols = ", ".join(f'"{cls._meta.get_field(c).column}"' for c in cls.squash_over)
+        return f"(hashtext(ROW({cols})::text) & 2147483647) %% %s = %s"
+
+    @classmethod
+    def get_squash_query(cls, distinct_sets: list) -> tuple:
+        """
+        Builds a statement which squashes the given distinct sets, by deleting their rows and inserting one summed row
+        for each set. Returns the number of rows removed and inserted.
+        """
+        table = cls._meta.db_table
+        fields = [cls._meta.get_field(c) for c in cls.squash_over]
+
+        def quote(cols) -> str:
+            return ", ".join(f'"{c}"' for c in cols)
+
+        def join(field) -> str:
+            op = "IS NOT DISTINCT FROM" if field.null else "="
+            return f't."{field.column}" {op} s."{field.column}"'
+
+        row = "(" + ", ".join(f"%s::{f.db_type(connection)}" for f in fields) + ")"
+        keys = quote(cls.squash_over)
+        insert_cols = quote(cls.squash_over + cls.squash_carry + cls.squash_sum)
+        select_cols = ", ".join(
+            [f'"{c}"' for c in cls.squash_over]
+            + [f'MAX("{c}")' for c in cls.squash_carry]
+            + [f'GREATEST(0, SUM("{c}"))' for c in cls.squash_sum]
+        )
+
+        sql = f"""
+        WITH removed AS (
+            DELETE FROM {table} WHERE "id" IN (
+                SELECT t."id" FROM {table} t
+                INNER JOIN (VALUES {", ".join([row] * len(distinct_sets))}) AS s({keys}) ON {" AND ".join(join(f) for f in fields)}
+                LIMIT {cls.squash_max_rows}
+            ) RETURNING {quote(cls.squash_over + cls.squash_carry + cls.squash_sum)}
+        ), inserted AS (
+            INSERT INTO {table}({insert_cols}, "is_squashed")
+            SELECT {select_cols}, TRUE FROM removed GROUP BY {keys}
+            RETURNING 1
+        )
+        SELECT (SELECT COUNT(*) FROM removed), (SELECT COUNT(*) FROM inserted);
+        """
+
+        params = [v for distinct_set in distinct_sets for v in distinct_set]
+        return sql, params
 
     @classmethod
     def sum(cls, instances) -> int:
@@ -51,6 +258,122 @@ class SquashableModel(models.Model):
         abstract = True
 
 
+class CountCache:
+    """
+    Short lived read-through cache of count totals in redis. Each org's totals are stored in a single hash so that all
+    the totals needed by a request can be fetched in one round trip.
+    """
+
+    KEY_BASE = "count_cache"
+    STATS_KEY = "count_cache_stats"
+
+    _local = threading.local()
+
+    def __init__(self):
+        self.totals_by_org = {}
+        self.stats = defaultdict(int)
+
+    @classmethod
+    @contextmanager
+    def scope(cls):
+        """
+        Context manager for a request, within which each org's cached totals are only fetched once
+        """
+        current = getattr(cls._local, "current", None)
+        if current:
+            yield current
+            return
+
+        cache = cls()
+        cls._local.current = cache
+        try:
+            yield cache
+        finally:
+            cls._local.current = None
+            cache._record_stats()
+
+    @classmethod
+    def get_totals(cls, model, org_id: int, keys: list, fetch) -> dict:
+        """
+        Gets totals by key for the given count model, calling fetch with any keys which aren't cached
+        """
+        if not settings.COUNTS_CACHE_TTL:
+            return fetch(keys)
+
+        with cls.scope() as cache:
+            return cache._get_totals(model._meta.db_table, org_id, keys, fetch)
+
+    @classmethod
+    def invalidate(cls, org_id: int):
+        """
+        Clears all cached totals for the given org, e.g. after counts have been inserted
+        """
+        get_redis_connection().delete(f"{cls.KEY_BASE}:{org_id}")
+
+        current = getattr(cls._local, "current", None)
+        if current:
+            current.totals_by_org.pop(org_id, None)
+
+    @classmethod
+    def get_stats(cls) -> dict:
+        """
+        Gets the hit and miss counts for each count model
+        """
+        stats = defaultdict(lambda: {"hits": 0, "misses": 0})
+        for field, value in get_redis_connection().hgetall(cls.STATS_KEY).items():
+            table, stat = field.decode().split(":")
+            stats[table][stat] = int(value)
+        return dict(stats)
+
+    def _get_totals(self, table: str, org_id: int, keys: list, fetch) -> dict:
+        ttl = settings.COUNTS_CACHE_TTL
+        now = time.time()
+        cached = self._get_org_totals(org_id)
+
+        totals, missing = {}, []
+        for key in keys:
+            value = cached.get(f"{table}:{key}")
+            if value:
+                total, expires_on = value.split(":")
+                if float(expires_on) > now:
+                    totals[key] = int(total)
+                    continue
+
+            missing.append(key)
+
+        self.stats[f"{table}:hits"] += len(keys) - len(missing)
+        self.stats[f"{table}:misses"] += len(missing)
+
+        if missing:
+            fetched = fetch(missing)
+            totals.update(fetched)
+
+            to_cache = {f"{table}:{k}": f"{v}:{now + ttl}" for k, v in fetched.items()}
+            cached.update(to_cache)
+
+            org_key = f"{self.KEY_BASE}:{org_id}"
+            pipe = get_redis_connection().pipeline()
+            pipe.hset(org_key, mapping=to_cache)
+            pipe.expire(org_key, ttl)
+            pipe.execute()
+
+        return totals
+
+    def _get_org_totals(self, org_id: int) -> dict:
+        if org_id not in self.totals_by_org:
+            values = get_redis_connection().hgetall(f"{self.KEY_BASE}:{org_id}")
+            self.totals_by_org[org_id] = {k.decode(): v.decode() for k, v in values.items()}
+
+        return self.totals_by_org[org_id]
+
+    def _record_stats(self):
+        if self.stats:
+            pipe = get_redis_connection().pipeline()
+            for field, count in self.stats.items():
+                pipe.hincrby(self.STATS_KEY, field, count)
+            pipe.execute()
+
+
 class ScopedCountModel(SquashableModel):
     """
     Base for scoped count squashable models
@@ -62,18 +385,6 @@ class ScopedCountModel(SquashableModel):
     scope = models.CharField(max_length=32)
     count = models.IntegerField()
 
-    @classmethod
-    def get_squash_query(cls, distinct_set):  # pragma: no cover
-        sql = f"""
-        WITH removed as (
-            DELETE FROM {cls._meta.db_table} WHERE count_type = %s AND scope = %s RETURNING count
-        )
-        INSERT INTO {cls._meta.db_table}(count_type, scope, count, is_squashed)
-        VALUES (%s, %s, GREATEST(0, (SELECT SUM(count) FROM removed)), TRUE);
-        """
-
-        return sql, (distinct_set.count_type, distinct_set.scope)
-
     class CountSet:
         """
         A queryset of counts which can be aggregated in different ways
@@ -116,18 +427,6 @@ class DailyCountModel(ScopedCountModel):
 
     day = models.DateField()
 
-    @classmethod
-    def get_squash_query(cls, distinct_set):
-        sql = f"""
-        WITH removed as (
-            DELETE FROM {cls._meta.db_table} WHERE count_type = %s AND scope = %s AND day = %s RETURNING count
-        )
-        INSERT INTO {cls._meta.db_table}(count_type, scope, day, count, is_squashed)
-        VALUES (%s, %s, %s, GREATEST(0, (SELECT SUM(count) FROM removed)), TRUE);
-        """
-
-        return sql, (distinct_set.count_type, distinct_set.scope, distinct_set.day) * 2
-
     @classmethod
     def _get_counts(cls, count_type: str, scopes: dict, since, until):
         counts = cls.objects.filter(count_type=count_type, scope__in=scopes.keys())
@@ -168,19 +467,9 @@ class DailyTimingModel(DailyCountModel):
     Base for daily scoped count+seconds squashable models
     """
 
-    seconds = models.BigIntegerField()
+    squash_sum = ("count", "seconds")
 
-    @classmethod
-    def get_squash_query(cls, distinct_set):
-        sql = f"""
-        WITH removed as (
-            DELETE FROM {cls._meta.db_table} WHERE count_type = %s AND scope = %s AND day = %s RETURNING count, seconds
-        )
-        INSERT INTO {cls._meta.db_table}(count_type, scope, day, count, seconds, is_squashed)
-        VALUES (%s, %s, %s, GREATEST(0, (SELECT SUM(count) FROM removed)), GREATEST(0, (SELECT SUM(seconds) FROM removed)), TRUE);
-        """
-
-        return sql, (distinct_set.count_type, distinct_set.scope, distinct_set.day) * 2
+    seconds = models.BigIntegerField()
 
     @classmethod
     def _get_count_set(cls, count_type: str, scopes: dict, since, until):
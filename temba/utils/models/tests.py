@@ -1,17 +1,26 @@
+import time
+from datetime import date
 from decimal import Decimal
+from unittest.mock import patch
+
+from django_redis import get_redis_connection
 
 from django.contrib.auth.models import Group, User
 from django.core import checks
 from django.db import connection, models
-from django.test import TestCase
+from django.db.models import Sum
+from django.test import TestCase, override_settings
 
-from temba.contacts.models import Contact
+from temba.channels.models import ChannelCount
+from temba.contacts.models import Contact, ContactGroupCount
 from temba.flows.models import Flow
+from temba.msgs.models import SystemLabel
 from temba.tests import TembaTest
 
 from .base import delete_in_batches, patch_queryset_count
 from .es import IDSliceQuerySet
 from .fields import JSONAsTextField
+from .squashable import CountCache
 
 
 class ModelsTest(TembaTest):
@@ -52,6 +61,161 @@ class ModelsTest(TembaTest):
         self.assertEqual(4, Group.objects.filter(id__in=[g.id for g in to_delete]).count())
 
 
+class SquashableModelTest(TembaTest):
+    def test_squash(self):
+        channel2 = self.create_channel("A", "Android", "+250785551212")
+        day1, day2 = date(2024, 1, 1), date(2024, 1, 2)
+
+        def create_count(channel, count_type, day, count):
+            return ChannelCount.objects.create(channel=channel, count_type=count_type, day=day, count=count)
+
+        # days can be null and those sets should be squashed separately
+        for channel in (self.channel, channel2):
+            for day in (day1, day2, None):
+                for count in (1, 2, 3, -1):
+                    create_count(channel, "IM", day, count)
+                create_count(channel, "OM", day, 4)
+
+        def get_totals():
+            counts = ChannelCount.objects.values_list("channel", "count_type", "day").annotate(total=Sum("count"))
+            return {(c[0], c[1], c[2]): c[3] for c in counts}
+
+        totals_before = get_totals()
+        oldest = ChannelCount.objects.order_by("id").first()
+
+        # squash with tiny batches so we need multiple statements
+        with patch.object(ChannelCount, "squash_batch_size", 2), patch.object(ChannelCount, "squash_batch_min", 1):
+            with patch.object(ChannelCount, "squash_max_sets", 10):
+                metrics = ChannelCount.squash()
+
+        self.assertEqual(
+            {"sets": 10, "rows": 18, "oldest_unsquashed": ChannelCount.get_unsquashed().first().id}, metrics
+        )
+        self.assertGreater(metrics["oldest_unsquashed"], oldest.id)
+
+        metrics = ChannelCount.squash()
+
+        self.assertEqual({"sets": 2, "rows": 0, "oldest_unsquashed": None}, metrics)
+        self.assertEqual(12, ChannelCount.objects.count())
+        self.assertEqual(0, ChannelCount.get_unsquashed().count())
+        self.assertEqual(totals_before, get_totals())
+
+        # adding new counts and squashing again merges them into the existing squashed rows
+        create_count(self.channel, "IM", None, 5)
+        create_count(self.channel, "IM", None, 5)
+
+        self.assertEqual({"sets": 1, "rows": 2, "oldest_unsquashed": None}, ChannelCount.squash())
+        self.assertEqual(12, ChannelCount.objects.count())
+        self.assertEqual(15, ChannelCount.objects.get(channel=self.channel, count_type="IM", day=None).count)
+
+    def test_squash_partitions(self):
+        channel2 = self.create_channel("A", "Android", "+250785551212")
+
+        for channel in (self.channel, channel2):
+            for day in range(1, 11):
+                for count in (1, 2):
+                    ChannelCount.objects.create(channel=channel, count_type="IM", day=date(2024, 1, day), count=count)
+
+        # each distinct set belongs to exactly one partition
+        metrics = [ChannelCount.squash(p, 3) for p in range(3)]
+
+        self.assertEqual(20, sum(m["sets"] for m in metrics))
+        self.assertEqual(20, sum(m["rows"] for m in metrics))
+        self.assertEqual(0, ChannelCount.get_unsquashed().count())
+        self.assertEqual(20, ChannelCount.objects.count())
+
+        self.assertEqual(1, ChannelCount.get_squash_partitions())
+
+        # with a single partition, squashing happens inline
+        self.assertEqual({"sets": 0, "rows": 0, "oldest_unsquashed": None}, ChannelCount.squash_all())
+        self.assertEqual(["0/1"], list(ChannelCount.get_squash_progress().keys()))
+
+        # rebalance over 4 partitions which will be queued as separate tasks
+        ChannelCount.set_squash_partitions(4)
+
+        self.assertEqual(4, ChannelCount.get_squash_partitions())
+        self.assertEqual({}, ChannelCount.get_squash_progress())
+
+        with patch("temba.utils.tasks.squash_partition.delay") as mock_delay:
+            self.assertEqual({"partitions": 4}, ChannelCount.squash_all())
+
+        self.assertEqual(
+            [(("channels.channelcount", p, 4),) for p in range(4)], [c.args for c in mock_delay.call_args_list]
+        )
+
+        ChannelCount.objects.create(channel=self.channel, count_type="IM", day=date(2024, 1, 1), count=3)
+
+        # a task queued before rebalancing is skipped
+        self.assertEqual({"skipped": True}, ChannelCount.squash_partition(0, 3))
+
+        # as is a partition which is already being squashed
+        with get_redis_connection().lock(f"squash_lock:{ChannelCount._meta.db_table}:4:0", timeout=10):
+            self.assertEqual({"skipped": True}, ChannelCount.squash_partition(0, 4))
+
+        metrics = [ChannelCount.squash_partition(p, 4) for p in range(4)]
+
+        self.assertEqual(1, sum(m["sets"] for m in metrics))
+        self.assertEqual(1, sum(m["rows"] for m in metrics))
+        self.assertEqual(0, ChannelCount.get_unsquashed().count())
+        self.assertEqual({"0/4", "1/4", "2/4", "3/4"}, set(ChannelCount.get_squash_progress().keys()))
+
+    def test_squash_batch_sizing(self):
+        self.assertEqual(200, ChannelCount._get_next_batch_size(100, 0.1))
+        self.assertEqual(100, ChannelCount._get_next_batch_size(100, 0.7))
+        self.assertEqual(50, ChannelCount._get_next_batch_size(100, 1.5))
+        self.assertEqual(1000, ChannelCount._get_next_batch_size(1000, 0.1))
+        self.assertEqual(10, ChannelCount._get_next_batch_size(10, 2.0))
+
+
+class CountCacheTest(TembaTest):
+    @override_settings(COUNTS_CACHE_TTL=15)
+    def test_get_totals(self):
+        contact = self.create_contact("Ann", phone="+250788000001")
+        group1 = self.create_group("Group 1", contacts=[contact])
+        group2 = self.create_group("Group 2", contacts=[])
+
+        with self.assertNumQueries(1):
+            self.assertEqual({group1: 1, group2: 0}, ContactGroupCount.get_totals([group1, group2]))
+
+        group2.contacts.add(contact)  # triggers a count insert which the cache doesn't see
+
+        with self.assertNumQueries(0):
+            self.assertEqual({group1: 1, group2: 0}, ContactGroupCount.get_totals([group1, group2]))
+
+        # within a scope, the org's cached totals are only fetched once and only missing totals are queried
+        with CountCache.scope(), self.assertNumQueries(1):
+            self.assertEqual({group1: 1}, ContactGroupCount.get_totals([group1]))
+            self.assertEqual(0, SystemLabel.get_counts(self.org)[SystemLabel.TYPE_INBOX])
+            self.assertEqual(0, SystemLabel.get_counts(self.org)[SystemLabel.TYPE_INBOX])
+
+        CountCache.invalidate(self.org.id)
+
+        with self.assertNumQueries(1):
+            self.assertEqual({group1: 1, group2: 1}, ContactGroupCount.get_totals([group1, group2]))
+
+        # expired totals are fetched again
+        with patch("time.time", return_value=time.time() + 20), self.assertNumQueries(1):
+            self.assertEqual({group1: 1, group2: 1}, ContactGroupCount.get_totals([group1, group2]))
+
+        self.assertEqual(
+            {
+                "contacts_contactgroupcount": {"hits": 3, "misses": 6},
+                "msgs_systemlabelcount": {"hits": 8, "misses": 8},
+            },
+            CountCache.get_stats(),
+        )
+
+    def test_disabled(self):
+        group = self.create_group("Group 1", contacts=[self.create_contact("Ann", phone="+250788000001")])
+
+        with self.assertNumQueries(1):
+            self.assertEqual({group: 1}, ContactGroupCount.get_totals([group]))
+        with self.assertNumQueries(1):
+            self.assertEqual({group: 1}, ContactGroupCount.get_totals([group]))
+
+        self.assertEqual({}, CountCache.get_stats())
+
+
 class IDSliceQuerySetTest(TembaTest):
     def test_fields(self):
         # if we don't specify fields, we fetch *
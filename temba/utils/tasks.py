@@ -0,0 +1,11 @@
+from celery import shared_task
+
+from django.apps import apps
+
+
+@shared_task
+def squash_partition(model_label: str, partition: int, num_partitions: int):
+    """
+    Squashes a single partition of the given squashable model
+    """
+    return apps.get_model(model_label).squash_partition(partition, num_partitions)
@@ -18,6 +18,7 @@ from django.views.decorators.csrf import csrf_exempt
 from temba import __version__ as temba_version
 from temba.utils import json
 from temba.utils.fields import CheckboxWidget, DateWidget, InputWidget, SelectMultipleWidget, SelectWidget
+from temba.utils.models import CountCache
 
 logger = logging.getLogger(__name__)
 
@@ -275,6 +276,9 @@ class BulkActionMixin:
                 logger.exception(f"error applying '{action}' to {self.model.__name__} objects")
                 action_error = _("An error occurred while making your changes. Please try again.")
 
+            # actions will likely have changed counts so don't serve cached totals for this org
+            CountCache.invalidate(org.id)
+
         response = self.get(request, *args, **kwargs)
         if action_error:
             response["Temba-Toast"] = HEADER_VALUE_STRIP_RE.sub("", str(action_error))